@@ -23,6 +23,8 @@ class Bot(Client):
             api_hash=Config.API_HASH,
             bot_token=Config.BOT_TOKEN,
             workers=Config.WORKERS,
+            # Every running job can fetch several download parts at once
+            max_concurrent_transmissions=max(1, Config.QUEUE_WORKERS * Config.DOWNLOAD_PARTS),
             plugins=dict(root="handlers"),
             sleep_threshold=60
         )
@@ -48,14 +50,39 @@ class Bot(Client):
             # Try again
             await Database.init_db()
         
+        # Remove files left behind by jobs that didn't finish
+        from utils.workspace import Workspace
+        Workspace.start()
+        
+        # Resume queued tasks and start the workers
+        from utils.job_queue import JobQueue
+        await JobQueue.start(self)
+        
         logger.info(f"╔══════════════════════════════════════════╗")
         logger.info(f"║  Bot Started Successfully!               ║")
         logger.info(f"║  Username: @{me.username:<25} ║")
         logger.info(f"║  Bot ID: {me.id:<29} ║")
         logger.info(f"╚══════════════════════════════════════════╝")
         
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        # Local files and relayed Telegram files go through the uploader
+        # that retries failed parts
+        from utils.uploader import Uploader, RelayStream
+        if isinstance(path, RelayStream):
+            return await Uploader.save_stream(self, path, file_id, file_part, progress, progress_args)
+        if isinstance(path, str) and os.path.isfile(path):
+            return await Uploader.save_file(self, path, file_id, file_part, progress, progress_args)
+        return await super().save_file(path, file_id, file_part, progress, progress_args)
+        
     async def stop(self):
+        from utils.job_queue import JobQueue
+        from utils.workspace import Workspace
+        await JobQueue.stop()
+        await Workspace.stop()
         await super().stop()
+        # Flush the queued writes once nothing can queue more
+        from utils.database import Database
+        await Database.close()
         logger.info("Bot stopped!")
 
 if __name__ == "__main__":
@@ -3,6 +3,13 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 from utils.database import Database
 from utils.config import Config
+from utils.cpu_budget import CPUBudget
+from utils.disk_budget import DiskBudget
+from utils.helpers import format_size
+from utils.job_queue import JobQueue
+from utils.rendition_cache import RenditionCache
+from utils.source_cache import SourceCache
+from utils.workspace import Workspace
 import os
 import sys
 import subprocess
@@ -22,6 +29,11 @@ def admin_only(func):
 async def restart_bot(client: Client, message: Message):
     """Restart the bot"""
     await message.reply_text("**🔄 Restarting bot...**")
+    # Bot.stop never runs here, so stop the jobs (and their FFmpeg children)
+    # before writing the buffered registrations and queued writes
+    await JobQueue.stop()
+    await Workspace.stop()
+    await Database.close()
     os.execl(sys.executable, sys.executable, *sys.argv)
 
 
@@ -29,10 +41,22 @@ async def restart_bot(client: Client, message: Message):
 @admin_only
 async def check_queue(client: Client, message: Message):
     """Check total queue"""
-    queue_size = await Database.get_queue_size()
+    queue = await Database.get_queue_stats()
+    cpu = CPUBudget.get_stats()
+    disk = DiskBudget.get_stats()
     await message.reply_text(
         f"**📊 Queue Status**\n\n"
-        f"**Total Pending Tasks:** `{queue_size}`"
+        f"**Total Pending Tasks:** `{queue['pending']}`\n"
+        f"**Running Tasks:** `{queue['running']}/{Config.QUEUE_WORKERS}`\n"
+        f"**Finished:** `{queue['done']}` done, `{queue['failed']}` failed\n\n"
+        f"**⚙️ FFmpeg Processes**\n"
+        f"├ Running: `{cpu['active']}`\n"
+        f"├ Waiting for CPU: `{cpu['waiting']}`\n"
+        f"└ Threads: `{cpu['allocated']}/{cpu['total']}`\n\n"
+        f"**💾 Disk**\n"
+        f"├ Reserved: `{format_size(disk['reserved'])}` by `{disk['active']}` tasks\n"
+        f"├ Free for downloads: `{format_size(disk['download_free'])}`\n"
+        f"└ Free for outputs: `{format_size(disk['upload_free'])}`"
     )
 
 
@@ -41,7 +65,45 @@ async def check_queue(client: Client, message: Message):
 async def clear_queue(client: Client, message: Message):
     """Clear all queue tasks"""
     await Database.clear_queue()
-    await message.reply_text("**✅ Queue cleared successfully!**")
+    await message.reply_text(
+        "**✅ Queue cleared successfully!**\n\n"
+        "Tasks that are already running will finish."
+    )
+
+
+@Client.on_message(filters.command("cachestats") & filters.private)
+@admin_only
+async def rendition_cache_stats(client: Client, message: Message):
+    """Show rendition cache statistics"""
+    stats = await RenditionCache.get_stats()
+    sources = SourceCache.get_stats()
+    await message.reply_text(
+        f"**♻️ Rendition Cache**\n\n"
+        f"**Cached Renditions:** `{stats['entries']}`\n"
+        f"**Cached Size:** `{format_size(stats['size'])}`\n"
+        f"**Total Hits:** `{stats['hits']}`\n\n"
+        f"**Since Restart:**\n"
+        f"├ Hits: `{stats['session_hits']}`\n"
+        f"├ Misses: `{stats['session_misses']}`\n"
+        f"└ Hit Rate: `{stats['hit_rate']:.1f}%`\n\n"
+        f"**Eviction:** `{Config.RENDITION_CACHE_MAX_AGE_DAYS} days / {Config.RENDITION_CACHE_MAX_ENTRIES} entries`\n\n"
+        f"**📥 Source Cache**\n\n"
+        f"**Cached Files:** `{sources['files']}` (`{sources['in_use']}` in use)\n"
+        f"**Disk Usage:** `{format_size(sources['size'])}` / `{format_size(Config.SOURCE_CACHE_MAX_SIZE_MB * 1024 * 1024)}`\n"
+        f"**Hit Rate:** `{sources['hit_rate']:.1f}%` (`{sources['hits']}` hits, `{sources['misses']}` misses)"
+    )
+
+
+@Client.on_message(filters.command("clearcache") & filters.private)
+@admin_only
+async def clear_rendition_cache(client: Client, message: Message):
+    """Clear the rendition and source caches"""
+    await Database.clear_rendition_cache()
+    removed = SourceCache.clear()
+    await message.reply_text(
+        f"**✅ Rendition cache cleared!**\n\n"
+        f"**Source files removed:** `{removed}` (files in use are kept)"
+    )
 
 
 @Client.on_message(filters.command("audio") & filters.private)
@@ -144,6 +206,28 @@ async def set_crf(client: Client, message: Message):
         await message.reply_text("**⚠️ Invalid CRF value! Must be a number.**")
 
 
+@Client.on_message(filters.command("adaptivecrf") & filters.private)
+@admin_only
+async def set_adaptive_crf(client: Client, message: Message):
+    """Toggle per-title CRF selection"""
+    current = (await Database.get_bot_setting("adaptive_crf") or str(Config.ADAPTIVE_CRF)).lower() == "true"
+    
+    if len(message.command) < 2 or message.command[1].lower() not in ["on", "off"]:
+        await message.reply_text(
+            f"**🔬 Adaptive CRF**\n\n"
+            f"**Current:** `{'ON' if current else 'OFF'}`\n\n"
+            f"When on, a few short samples of every video are encoded first and\n"
+            f"the CRF of each quality is picked to hit its target bitrate.\n"
+            f"The `/crf` value is used as the starting point.\n\n"
+            f"**Usage:** `/adaptivecrf on` or `/adaptivecrf off`"
+        )
+        return
+    
+    enabled = message.command[1].lower() == "on"
+    await Database.set_bot_setting("adaptive_crf", str(enabled).lower())
+    await message.reply_text(f"**✅ Adaptive CRF turned {'on' if enabled else 'off'}!**")
+
+
 @Client.on_message(filters.command("addchnl") & filters.private)
 @admin_only
 async def add_fsub_channel(client: Client, message: Message):
@@ -2,8 +2,10 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from utils.ffmpeg_helper import FFmpegHelper
-from utils.config import Config
 from utils.helpers import format_size
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from handlers.encoding import upload_or_defer
 import os
 import time
 
@@ -14,7 +16,6 @@ user_audio_operations = {}
 @Client.on_message(filters.command("extract_audio") & filters.private)
 async def extract_audio(client: Client, message: Message):
     """Extract audio from video"""
-    user_id = message.from_user.id
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
@@ -24,46 +25,57 @@ async def extract_audio(client: Client, message: Message):
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    file = message.reply_to_message.video or message.reply_to_message.document
+    await JobQueue.submit(message, "extract_audio", file.file_id, download_size=file.file_size, output_size=file.file_size // 10)
+
+
+@JobQueue.runner("extract_audio")
+async def run_extract_audio(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued audio extraction"""
+    user_id = message.from_user.id
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    
+    input_path = None
     
     try:
         file = message.reply_to_message.video or message.reply_to_message.document
         
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
-        await client.download_media(message.reply_to_message, file_name=input_path)
+        input_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file.file_name)
         
         await processing_msg.edit_text("**🔄 Extracting audio...**")
         
         # Extract audio
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_audio.mp3")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_audio.mp3")
         success = await FFmpegHelper.extract_audio(input_path, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to extract audio!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
         # Upload audio file
         file_size = os.path.getsize(output_path)
-        await message.reply_audio(
-            audio=output_path,
-            caption=f"**✅ Audio extracted successfully!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**💪 Extracted By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "audio",
+            "caption": f"**✅ Audio extracted successfully!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**💪 Extracted By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        if os.path.exists(input_path):
-            os.remove(input_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_message(filters.command("addaudio") & filters.private)
@@ -87,7 +99,6 @@ async def add_audio_command(client: Client, message: Message):
 @Client.on_message(filters.command("remaudio") & filters.private)
 async def remove_audio(client: Client, message: Message):
     """Remove audio from video"""
-    user_id = message.from_user.id
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
@@ -97,46 +108,57 @@ async def remove_audio(client: Client, message: Message):
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    file = message.reply_to_message.video or message.reply_to_message.document
+    await JobQueue.submit(message, "remove_audio", file.file_id, download_size=file.file_size, output_size=file.file_size)
+
+
+@JobQueue.runner("remove_audio")
+async def run_remove_audio(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued audio removal"""
+    user_id = message.from_user.id
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    
+    input_path = None
     
     try:
         file = message.reply_to_message.video or message.reply_to_message.document
         
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
-        await client.download_media(message.reply_to_message, file_name=input_path)
+        input_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file.file_name)
         
         await processing_msg.edit_text("**🔄 Removing audio...**")
         
         # Remove audio
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_no_audio.mp4")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_no_audio.mp4")
         success = await FFmpegHelper.remove_audio(input_path, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to remove audio!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
         # Upload result
         file_size = os.path.getsize(output_path)
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ Audio removed successfully!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ Audio removed successfully!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        if os.path.exists(input_path):
-            os.remove(input_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 # Handle audio file uploads for audio operations
@@ -157,6 +179,8 @@ async def handle_audio_file(client: Client, message: Message):
     file = message.audio
     state['audio'] = {
         'file_id': file.file_id,
+        'file_unique_id': file.file_unique_id,
+        'file_size': file.file_size,
         'file_name': file.file_name or f"audio_{int(time.time())}.mp3"
     }
     
@@ -167,55 +191,70 @@ async def handle_audio_file(client: Client, message: Message):
     
     # Check if we have both video and audio
     if state['video'] and state['audio']:
-        await process_audio_addition(client, message, user_id, state)
+        await submit_audio_addition(message, user_audio_operations.pop(user_id))
+
 
+async def submit_audio_addition(message: Message, state: dict):
+    """Queue the combination of a video and an audio file"""
+    sizes = (state['video'].get('file_size') or 0) + (state['audio'].get('file_size') or 0)
+    await JobQueue.submit(message, "add_audio", state['video']['file_id'], state, download_size=sizes, output_size=sizes)
 
-async def process_audio_addition(client, message, user_id, state):
+
+@JobQueue.runner("add_audio")
+async def process_audio_addition(client: Client, message: Message, processing_msg: Message, job: dict):
     """Process video + audio combination"""
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading files...**")
+    user_id = job['user_id']
+    state = job['payload']
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading files...**")
+    video_path = audio_path = None
     
     try:
         # Download video
-        video_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_video.mp4")
-        await client.download_media(state['video']['file_id'], file_name=video_path)
+        video = state['video']
+        video_path = await SourceCache.acquire(
+            client, video['file_id'], video.get('file_unique_id'), video.get('file_size') or 0, video['file_name']
+        )
         
         # Download audio
-        audio_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_audio.mp3")
-        await client.download_media(state['audio']['file_id'], file_name=audio_path)
+        audio = state['audio']
+        audio_path = await SourceCache.acquire(
+            client, audio['file_id'], audio.get('file_unique_id'), audio.get('file_size') or 0, audio['file_name']
+        )
         
         await processing_msg.edit_text("**🔄 Adding audio to video...**")
         
         # Add audio
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_with_audio.mp4")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_with_audio.mp4")
         success = await FFmpegHelper.add_audio(video_path, audio_path, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to add audio!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
         # Upload result
         file_size = os.path.getsize(output_path)
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ Audio added successfully!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ Audio added successfully!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        for path in [video_path, audio_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
-        
-        # Clear state
-        del user_audio_operations[user_id]
+        if os.path.exists(output_path):
+            os.remove(output_path)
         
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(video_path)
+        SourceCache.release(audio_path)
 
 
 @Client.on_callback_query(filters.regex("^audio_menu$"))
@@ -308,6 +347,8 @@ async def handle_video_for_audio(client: Client, message: Message):
     # Store video file
     state['video'] = {
         'file_id': file.file_id,
+        'file_unique_id': file.file_unique_id,
+        'file_size': file.file_size,
         'file_name': file.file_name or f"video_{int(time.time())}.mp4"
     }
     
@@ -319,4 +360,4 @@ async def handle_video_for_audio(client: Client, message: Message):
     
     # If audio is already received, process
     if state['audio']:
-        await process_audio_addition(client, message, user_id, state)
+        await submit_audio_addition(message, user_audio_operations.pop(user_id))
@@ -4,8 +4,13 @@ from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineK
 from utils.database import Database
 from utils.ffmpeg_helper import FFmpegHelper
 from utils.config import Config
-from utils.helpers import format_size, format_time, format_progress_bar
+from utils.helpers import format_size, format_time, format_progress_bar, parse_size
 from utils.progress import ProgressTracker
+from utils.rendition_cache import RenditionCache
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from utils.uploader import RelayStream
+from utils.workspace import Workspace
 import os
 import time
 import asyncio
@@ -13,6 +18,16 @@ import asyncio
 # Store user's last video for encoding
 user_videos = {}
 
+# Renditions produced by /all
+ALL_QUALITIES = ["144p", "240p", "360p", "480p", "720p", "1080p"]
+
+
+class FakeCallbackQuery:
+    """Lets commands and queued jobs reuse the callback code paths"""
+    def __init__(self, message):
+        self.message = message
+        self.from_user = message.from_user
+
 
 @Client.on_message(filters.video & filters.private | filters.document & filters.private)
 async def handle_video(client: Client, message: Message):
@@ -29,8 +44,10 @@ async def handle_video(client: Client, message: Message):
     user_videos[user_id] = {
         "file_id": file.file_id,
         "file_name": file.file_name or f"video_{int(time.time())}.mp4",
+        "file_unique_id": file.file_unique_id,
         "file_size": file.file_size,
         "duration": getattr(file, 'duration', 0),
+        "height": getattr(file, 'height', 0),
         "message_id": message.id
     }
     
@@ -102,65 +119,202 @@ async def encode_callback(client: Client, callback_query: CallbackQuery):
     
     video_info = user_videos[user_id]
     
-    # Show processing message
-    processing_msg = await callback_query.message.reply_text(
-        f"**⏳ Initializing...**\n\n"
-        f"Preparing to process your video..."
+    await submit_encode(callback_query.message, video_info, quality, user_name, user_id)
+
+
+async def submit_encode(message, video_info, quality, user_name, user_id=None):
+    """Queue an encode, reserving disk space for the source and its renditions"""
+    file_size = video_info.get('file_size') or 0
+    await JobQueue.submit(
+        message, "encode", video_info['file_id'],
+        {"quality": quality, "video": video_info, "user_name": user_name},
+        user_id=user_id,
+        download_size=file_size,
+        # The whole ladder adds up to about twice the source
+        output_size=file_size * 2 if quality == "all" else file_size
     )
+
+
+@JobQueue.runner("encode")
+async def run_encode(client: Client, message: Message, status_msg: Message, job: dict):
+    """Run a queued encode"""
+    payload = job['payload']
+    await process_encode(
+        client, FakeCallbackQuery(message), payload['video'], payload['quality'],
+        status_msg, payload['user_name'], job['user_id'], job['workspace']
+    )
+
+
+async def process_encode(client, callback_query, video_info, quality, status_msg, user_name, user_id, workspace):
+    """Download and encode a video, resending cached renditions where possible"""
+    profile = await Database.get_user_profile(user_id)
+    watermark = profile['watermark']
+    user_settings = profile['settings']
+    settings = Database.get_encode_settings()
+    media_type = "document" if user_settings['upload_as_doc'] else "video"
+    
+    qualities = [quality]
+    if quality == "all":
+        # Prune the ladder from the Telegram metadata before any lookup, the
+        # renditions it drops are never encoded and so never cached. The
+        # overall bitrate is an upper bound of the video bitrate, so this
+        # keeps every rendition the probe after the download would keep.
+        duration = video_info.get('duration') or 0
+        source = {
+            "height": video_info.get('height') or 0,
+            "video_bitrate": (video_info.get('file_size') or 0) * 8 // duration if duration else 0
+        }
+        qualities = FFmpegHelper.plan_ladder(
+            source, ALL_QUALITIES, settings['codec'],
+            watermark.get('text'), watermark.get('image')
+        )
+    
+    cache_keys = {
+        q: RenditionCache.make_key(video_info.get('file_unique_id'), q, settings, watermark, media_type)
+        for q in qualities
+    }
+    
+    # Answer already encoded renditions without downloading anything
+    pending = []
+    for q in qualities:
+        cached = await RenditionCache.get(cache_keys[q])
+        if cached and await send_cached_rendition(callback_query.message, cached, q, user_name, user_settings):
+            continue
+        if cached:
+            await RenditionCache.invalidate(cache_keys[q])
+        pending.append(q)
+    
+    if not pending:
+        await status_msg.delete()
+        return
+    
+    download_path = None
     
     try:
-        # Download video
-        download_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}.mp4")
+        # Encode while downloading where the source allows it
+        if quality != "all" and await stream_encode(client, callback_query, video_info, quality, status_msg, user_name, user_id, workspace, cache_keys[quality]):
+            return
+        
+        # Download video, or reuse the copy left by an earlier operation
         start_time = time.time()
         
-        await client.download_media(
+        download_path = await SourceCache.acquire(
+            client,
             video_info['file_id'],
-            file_name=download_path,
+            video_info.get('file_unique_id'),
+            video_info.get('file_size') or 0,
+            video_info['file_name'],
             progress=ProgressTracker.download_progress,
-            progress_args=(processing_msg, video_info['file_name'], user_name, user_id, start_time)
+            progress_args=(status_msg, video_info['file_name'], user_name, user_id, start_time)
         )
         
         if quality == "all":
             # Encode in all qualities
-            await encode_all_qualities(client, callback_query, download_path, video_info, processing_msg, user_name, user_id)
+            await encode_all_qualities(client, callback_query, download_path, video_info, status_msg, user_name, user_id, workspace, pending, cache_keys)
         else:
             # Encode single quality
-            await encode_single(client, callback_query, download_path, video_info, quality, processing_msg, user_name, user_id)
-        
-        # Clean up
-        if os.path.exists(download_path):
-            os.remove(download_path)
+            await encode_single(client, callback_query, download_path, video_info, quality, status_msg, user_name, user_id, workspace, cache_keys[quality])
         
     except Exception as e:
-        await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
-        if os.path.exists(download_path):
-            os.remove(download_path)
+        await status_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(download_path)
 
 
-async def encode_single(client, callback_query, input_file, video_info, quality, status_msg, user_name, user_id):
-    """Encode video in single quality"""
+async def send_cached_rendition(message, cached, quality, user_name, user_settings) -> bool:
+    """Resend a previously uploaded rendition by its file_id"""
+    caption = f"""
+**✅ Encoding Complete!**
+
+**🎬 Quality:** `{quality.upper()}`
+**📦 Size:** `{format_size(cached['file_size'])}`
+**👤 Encoded For:** {user_name}
+    """
+    
+    try:
+        if cached['media_type'] == "document":
+            await message.reply_document(document=cached['file_id'], caption=caption)
+        else:
+            await message.reply_video(
+                video=cached['file_id'],
+                caption=caption,
+                has_spoiler=user_settings['spoiler_enabled']
+            )
+        return True
+    except Exception:
+        return False
+
+
+async def stream_encode(client, callback_query, video_info, quality, status_msg, user_name, user_id, workspace, cache_key=None) -> bool:
+    """Encode a single quality while the source is still downloading
+    
+    Returns False when the source has to be downloaded first: it is cached
+    already, its container can't be read from a pipe, or the encode needs
+    the whole file (adaptive CRF, segmented encoding, a possible remux).
+    """
+    settings = Database.get_encode_settings()
+    duration = video_info.get('duration') or 0
+    
+    if not Config.STREAM_INGEST or settings['adaptive_crf'] or not duration:
+        return False
+    if Config.SEGMENT_ENCODING and duration >= Config.SEGMENT_MIN_DURATION:
+        return False
+    if video_info.get('height') == FFmpegHelper.target_height(quality):
+        return False
+    
+    async with SourceCache.stream(
+        client,
+        video_info['file_id'],
+        video_info.get('file_unique_id'),
+        video_info.get('file_size') or 0,
+        video_info['file_name'],
+        check=FFmpegHelper.can_stream_input
+    ) as chunks:
+        if chunks is None:
+            return False
+        
+        return await encode_single(
+            client, callback_query, None, video_info, quality,
+            status_msg, user_name, user_id, workspace, cache_key, input_stream=chunks
+        ) is not False
+
+
+async def encode_single(client, callback_query, input_file, video_info, quality, status_msg, user_name, user_id, workspace, cache_key=None, input_stream=None):
+    """Encode video in single quality
+    
+    With `input_stream` the source is encoded as it downloads, a failed
+    encode then returns False so the caller can retry from a download.
+    """
     
     # Get user settings
-    watermark = await Database.get_watermark(user_id)
-    thumbnail = await Database.get_thumbnail(user_id)
-    user_settings = await Database.get_user_settings(user_id)
+    profile = await Database.get_user_profile(user_id)
+    watermark = profile['watermark']
+    thumbnail = profile['thumbnail']
+    user_settings = profile['settings']
     
     # Prepare output file
-    output_file = os.path.join(
-        Config.UPLOAD_DIR,
-        f"{os.path.splitext(video_info['file_name'])[0]}_{quality}.mp4"
-    )
+    output_file = workspace.path(f"{os.path.splitext(video_info['file_name'])[0]}_{quality}.mp4")
     
     # Get bot settings
-    codec = await Database.get_bot_setting("codec") or Config.DEFAULT_CODEC
-    preset = await Database.get_bot_setting("preset") or Config.DEFAULT_PRESET
-    crf = int(await Database.get_bot_setting("crf") or Config.DEFAULT_CRF)
-    audio_bitrate = await Database.get_bot_setting("audio_bitrate") or Config.DEFAULT_AUDIO_BITRATE
+    settings = Database.get_encode_settings()
+    crf = settings['crf']
+    
+    # Pick the CRF for this title from a few sample encodes
+    if settings['adaptive_crf'] and input_stream is None:
+        info = await FFmpegHelper.get_video_info(input_file)
+        if not FFmpegHelper.can_stream_copy(info, quality, settings['codec'], watermark.get('text'), watermark.get('image')):
+            await status_msg.edit_text(
+                f"**🔬 Analyzing {quality.upper()}**\n\n"
+                f"┃ `{video_info['file_name']}`\n\n"
+                f"Encoding samples to pick the CRF..."
+            )
+            crf = await FFmpegHelper.choose_crf(input_file, quality, settings['codec'], settings['preset'], crf, info)
     
     # Update status
     bot_stats = ProgressTracker.get_bot_stats()
     await status_msg.edit_text(
-        f"**2. Encoding to {quality.upper()}**\n\n"
+        f"**2. {'Streaming & Encoding' if input_stream is not None else 'Encoding'} to {quality.upper()}**\n\n"
         f"┃ `{video_info['file_name']}`\n\n"
         f"[ ○○○○○○○○○○ ] >> 0%\n"
         f"├ Speed: Calculating...\n"
@@ -179,12 +333,12 @@ async def encode_single(client, callback_query, input_file, video_info, quality,
     
     start_time = time.time()
     
-    async def progress_callback(percentage, speed, eta, current, total):
+    async def progress_callback(percentage, speed, eta, current, total, fps=0, **stats):
         """Progress callback for encoding"""
         await ProgressTracker.encoding_progress(
             percentage, speed, eta, current, total,
             status_msg, video_info['file_name'], quality,
-            user_name, user_id, start_time
+            user_name, user_id, start_time, fps
         )
     
     # Encode video
@@ -192,30 +346,48 @@ async def encode_single(client, callback_query, input_file, video_info, quality,
         input_file=input_file,
         output_file=output_file,
         resolution=quality,
-        codec=codec,
-        preset=preset,
+        codec=settings['codec'],
+        preset=settings['preset'],
         crf=crf,
-        audio_bitrate=audio_bitrate,
+        audio_bitrate=settings['audio_bitrate'],
         watermark_text=watermark.get('text'),
         watermark_image=watermark.get('image'),
-        progress_callback=progress_callback
+        progress_callback=progress_callback,
+        input_stream=input_stream,
+        duration=video_info.get('duration') or None
     )
     
     if not success or not os.path.exists(output_file):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        if input_stream is not None:
+            return False
         await status_msg.edit_text("**❌ Encoding failed!**")
         return
     
+    uploaded = await upload_rendition(
+        client, callback_query, output_file, video_info, quality,
+        status_msg, user_name, user_id, workspace, thumbnail, user_settings, cache_key
+    )
+    
+    if uploaded:
+        await status_msg.delete()
+
+
+async def upload_rendition(client, callback_query, output_file, video_info, quality, status_msg, user_name, user_id, workspace, thumbnail, user_settings, cache_key=None, show_progress=True) -> bool:
+    """Upload an encoded rendition and remove it afterwards"""
+    
     # Get encoded file size
     encoded_size = os.path.getsize(output_file)
     
     # Download thumbnail if exists
     thumb_path = None
     if thumbnail:
-        thumb_path = os.path.join(Config.THUMB_DIR, f"{user_id}_thumb.jpg")
+        thumb_path = workspace.path(f"{quality}_thumb.jpg", size=0)
         await client.download_media(thumbnail, file_name=thumb_path)
     else:
         # Extract thumbnail from video
-        thumb_path = os.path.join(Config.THUMB_DIR, f"{user_id}_auto_thumb.jpg")
+        thumb_path = workspace.path(f"{quality}_auto_thumb.jpg", size=0)
         await FFmpegHelper.extract_thumbnail(output_file, thumb_path)
     
     # Upload video
@@ -229,48 +401,251 @@ async def encode_single(client, callback_query, input_file, video_info, quality,
 **👤 Encoded For:** {user_name}
     """
     
+    upload = {
+        "path": output_file,
+        "media_type": "document" if user_settings['upload_as_doc'] else "video",
+        "caption": caption,
+        "duration": video_info.get('duration', 0),
+        "spoiler": user_settings['spoiler_enabled'],
+        "thumbnail": thumbnail,
+        "cache_key": cache_key,
+        "user_name": user_name
+    }
+    
+    uploaded = False
+    deferred = False
     try:
-        if user_settings['upload_as_doc']:
-            await callback_query.message.reply_document(
-                document=output_file,
-                caption=caption,
-                thumb=thumb_path if os.path.exists(thumb_path) else None,
-                progress=ProgressTracker.upload_progress,
-                progress_args=(status_msg, os.path.basename(output_file), user_name, user_id, upload_start)
-            )
-        else:
-            await callback_query.message.reply_video(
-                video=output_file,
-                caption=caption,
-                thumb=thumb_path if os.path.exists(thumb_path) else None,
-                duration=video_info.get('duration', 0),
-                supports_streaming=True,
-                has_spoiler=user_settings['spoiler_enabled'],
-                progress=ProgressTracker.upload_progress,
-                progress_args=(status_msg, os.path.basename(output_file), user_name, user_id, upload_start)
-            )
-        
-        await status_msg.delete()
+        await send_upload(
+            callback_query.message, upload, thumb_path,
+            progress=ProgressTracker.upload_progress if show_progress else None,
+            progress_args=(status_msg, os.path.basename(output_file), user_name, user_id, upload_start)
+        )
+        uploaded = True
     except Exception as e:
-        await status_msg.edit_text(f"**❌ Upload failed:** {str(e)}")
+        if not show_progress:
+            # Ladder renditions share the status message, the retry gets its own
+            status_msg = await callback_query.message.reply_text(f"**❌ Failed to upload:** `{os.path.basename(output_file)}`")
+        deferred = await defer_upload(callback_query.message, status_msg, upload, user_id, e)
     
-    # Clean up
-    if os.path.exists(output_file):
+    # Free the space early, a deferred upload has moved its file already
+    if not deferred and os.path.exists(output_file):
         os.remove(output_file)
     if thumb_path and os.path.exists(thumb_path):
         os.remove(thumb_path)
+    
+    return uploaded
+
 
+async def send_upload(message, upload, thumb_path=None, progress=None, progress_args=(), source=None):
+    """Send a file described by an upload dict and cache its file_id
+    
+    `source` is sent instead of upload['path'] for files that aren't on
+    disk, like a RelayStream.
+    """
+    source = source or upload['path']
+    thumb = thumb_path if thumb_path and os.path.exists(thumb_path) else None
+    file_size = upload.get('file_size') or os.path.getsize(source)
+    
+    if upload['media_type'] == "document":
+        sent = await message.reply_document(
+            document=source,
+            caption=upload['caption'],
+            thumb=thumb,
+            progress=progress,
+            progress_args=progress_args
+        )
+        media = sent.document
+    elif upload['media_type'] == "audio":
+        sent = await message.reply_audio(
+            audio=source,
+            caption=upload['caption'],
+            thumb=thumb,
+            progress=progress,
+            progress_args=progress_args
+        )
+        media = sent.audio
+    else:
+        sent = await message.reply_video(
+            video=source,
+            caption=upload['caption'],
+            thumb=thumb,
+            duration=upload.get('duration', 0),
+            width=upload.get('width', 0),
+            height=upload.get('height', 0),
+            supports_streaming=True,
+            has_spoiler=upload.get('spoiler', False),
+            progress=progress,
+            progress_args=progress_args
+        )
+        media = sent.video
+    
+    if media:
+        await RenditionCache.put(upload.get('cache_key'), media.file_id, upload['media_type'], file_size)
+    return sent
+
+
+async def defer_upload(message, status_msg, upload, user_id, error) -> bool:
+    """Queue a failed upload to be sent again later, False once out of retries
+    
+    Local files are kept for the retry. Relayed files (upload['relay'])
+    are downloaded again.
+    """
+    retry = upload.get('retry', 0) + 1
+    if retry > Config.UPLOAD_RETRIES:
+        await status_msg.edit_text(f"**❌ Upload failed:** {str(error)}")
+        return False
+    
+    # Back off further with every failed retry
+    delay = Config.UPLOAD_RETRY_DELAY * retry
+    upload = dict(upload, retry=retry)
+    if upload.get('path'):
+        upload['path'] = Workspace.keep(upload['path'])
+    job_id = await JobQueue.submit(
+        message, "upload_retry", payload=upload,
+        user_id=user_id, delay=delay, status_msg=status_msg
+    )
+    if not job_id:
+        if upload.get('path'):
+            Workspace.discard(upload['path'])
+        await status_msg.edit_text(f"**❌ Upload failed:** {str(error)}")
+        return False
+    
+    await status_msg.edit_text(
+        f"**⚠️ Upload failed:** {str(error)}\n\n"
+        f"Retrying in {format_time(delay)} ({retry}/{Config.UPLOAD_RETRIES})."
+    )
+    return True
+
+
+async def upload_or_defer(message, status_msg, upload, user_id, thumb_path=None, progress=None, progress_args=(), source=None):
+    """Send an upload and delete the status message, queueing a retry if it fails
+    
+    Returns True once sent, None when a retry was queued and False when
+    the upload failed for good.
+    """
+    try:
+        await send_upload(message, upload, thumb_path, progress, progress_args, source)
+    except Exception as e:
+        if await defer_upload(message, status_msg, upload, user_id, e):
+            return None
+        if upload.get('path') and os.path.exists(upload['path']):
+            os.remove(upload['path'])
+        return False
+    
+    await status_msg.delete()
+    return True
 
-async def encode_all_qualities(client, callback_query, input_file, video_info, status_msg, user_name, user_id):
-    """Encode video in all qualities"""
-    qualities = ["144p", "240p", "360p", "480p", "720p", "1080p"]
+
+@JobQueue.runner("upload_retry")
+async def run_upload_retry(client: Client, message: Message, status_msg: Message, job: dict):
+    """Send an upload that failed before"""
+    upload = job['payload']
+    user_id = job['user_id']
+    path = upload.get('path')
+    
+    if path and not os.path.exists(path):
+        await status_msg.edit_text("**❌ Upload failed:** the file is gone.")
+        return False
+    
+    source = None
+    if upload.get('relay'):
+        relay = upload['relay']
+        source = RelayStream(client, relay['file_id'], relay['file_size'], relay['name'])
+    
+    file_name = os.path.basename(path) if path else upload['relay']['name']
+    thumb_path = job['workspace'].path("thumb.jpg", size=0)
+    if upload.get('thumbnail'):
+        await client.download_media(upload['thumbnail'], file_name=thumb_path)
+    elif path and upload['media_type'] == "video":
+        await FFmpegHelper.extract_thumbnail(path, thumb_path)
+    
+    deferred = False
+    try:
+        await send_upload(
+            message, upload, thumb_path,
+            progress=ProgressTracker.upload_progress,
+            progress_args=(status_msg, file_name, upload.get('user_name', "User"), user_id, time.time()),
+            source=source
+        )
+        await status_msg.delete()
+        return True
+    except Exception as e:
+        deferred = await defer_upload(message, status_msg, upload, user_id, e)
+        return False
+    finally:
+        if path and not deferred:
+            Workspace.discard(path)
+
+
+async def encode_all_qualities(client, callback_query, input_file, video_info, status_msg, user_name, user_id, workspace, qualities=None, cache_keys=None):
+    """Encode video in all qualities with a single FFmpeg pass"""
+    cache_keys = cache_keys or {}
+    
+    profile = await Database.get_user_profile(user_id)
+    watermark = profile['watermark']
+    thumbnail = profile['thumbnail']
+    user_settings = profile['settings']
+    settings = Database.get_encode_settings()
+    
+    # Build the ladder from the source instead of always encoding every quality.
+    # The plan covers the whole ladder, so renditions missing from the cache
+    # can't be mistaken for everything the source supports.
+    requested = qualities or ALL_QUALITIES
+    info = await FFmpegHelper.get_video_info(input_file)
+    ladder = FFmpegHelper.plan_ladder(
+        info, ALL_QUALITIES, settings['codec'],
+        watermark.get('text'), watermark.get('image')
+    )
+    qualities = [q for q in ladder if q in requested]
+    skipped = [q for q in requested if q not in qualities]
     total = len(qualities)
     
+    if not qualities:
+        await status_msg.edit_text(
+            f"**✅ All encodings complete!**\n\n"
+            f"**Skipped:** {', '.join(q.upper() for q in skipped)} (not smaller than source)\n"
+            f"**Encoded For:** {user_name}"
+        )
+        return
+    
+    base_name = os.path.splitext(video_info['file_name'])[0]
+    outputs = {
+        quality: workspace.path(f"{base_name}_{quality}.mp4")
+        for quality in qualities
+    }
+    
+    skipped_text = ""
+    if skipped:
+        skipped_text = f"**Skipped:** {', '.join(q.upper() for q in skipped)} (not smaller than source)\n"
+    
+    # Pick a CRF per rendition from a few sample encodes
+    crf = settings['crf']
+    crf_text = ""
+    if settings['adaptive_crf']:
+        await status_msg.edit_text(
+            f"**🔬 Analyzing {total} renditions**\n\n"
+            f"┃ `{video_info['file_name']}`\n\n"
+            f"Encoding samples to pick the CRFs..."
+        )
+        crf = {
+            quality: await FFmpegHelper.choose_crf(
+                input_file, quality, settings['codec'], settings['preset'], settings['crf'], info
+            )
+            for quality in qualities
+            if not FFmpegHelper.can_stream_copy(
+                info, quality, settings['codec'], watermark.get('text'), watermark.get('image')
+            )
+        }
+        if crf:
+            crf_text = f"**CRF:** {', '.join(f'{q.upper()} {value}' for q, value in crf.items())}\n"
+    
     bot_stats = ProgressTracker.get_bot_stats()
     await status_msg.edit_text(
         f"**🌟 Encoding in ALL qualities**\n\n"
         f"**Total Tasks:** {total}\n"
         f"**Progress:** 0/{total}\n"
+        f"{skipped_text}"
+        f"{crf_text}"
         f"**Task By:** {user_name}\n\n"
         f"**📊 Bot Stats**\n"
         f"├ CPU: {bot_stats['cpu']:.1f}%\n"
@@ -278,22 +653,104 @@ async def encode_all_qualities(client, callback_query, input_file, video_info, s
         f"└ UPTIME: {bot_stats['uptime']}"
     )
     
-    for i, quality in enumerate(qualities, 1):
+    # Encode the ladder in stages and upload each finished stage while the
+    # next one encodes
+    stages = FFmpegHelper.split_ladder(qualities, Config.LADDER_STAGES)
+    upload_queue = asyncio.Queue()
+    uploaded = 0
+    
+    async def uploader():
+        """Upload finished renditions in the background"""
+        nonlocal uploaded
+        while True:
+            quality = await upload_queue.get()
+            if quality is None:
+                return
+            if os.path.exists(outputs[quality]) and await upload_rendition(
+                client, callback_query, outputs[quality], video_info, quality,
+                status_msg, user_name, user_id, workspace, thumbnail, user_settings,
+                cache_keys.get(quality), show_progress=False
+            ):
+                uploaded += 1
+    
+    # Encode non-AAC audio once for every stage instead of once per stage
+    shared_audio = None
+    encodes_video = any(
+        not FFmpegHelper.can_stream_copy(info, q, settings['codec'], watermark.get('text'), watermark.get('image'))
+        for q in qualities
+    )
+    if len(stages) > 1 and encodes_video and info.get('audio_codec', 'none') not in ("none", "aac"):
+        shared_audio = workspace.path(f"{base_name}_audio.m4a")
+        if not await FFmpegHelper.encode_audio(input_file, shared_audio, settings['audio_bitrate']):
+            shared_audio = None
+    
+    uploaders = [asyncio.create_task(uploader()) for _ in range(max(1, Config.LADDER_UPLOAD_WORKERS))]
+    success = True
+    
+    try:
+        for stage in stages:
+            start_time = time.time()
+            label = ", ".join(stage)
+            
+            async def progress_callback(percentage, speed, eta, current, total, fps=0, **stats):
+                """Progress callback for the ladder encode"""
+                await ProgressTracker.encoding_progress(
+                    percentage, speed, eta, current, total,
+                    status_msg, video_info['file_name'], f"{label} ({uploaded}/{len(qualities)} uploaded)",
+                    user_name, user_id, start_time, fps
+                )
+            
+            # Decode the source once and write every rendition of the stage in the same pass
+            success = await FFmpegHelper.encode_ladder(
+                input_file=input_file,
+                outputs={quality: outputs[quality] for quality in stage},
+                codec=settings['codec'],
+                preset=settings['preset'],
+                crf=crf,
+                audio_bitrate=settings['audio_bitrate'],
+                watermark_text=watermark.get('text'),
+                watermark_image=watermark.get('image'),
+                progress_callback=progress_callback,
+                info=info,
+                shared_audio=shared_audio
+            )
+            if not success:
+                break
+            
+            for quality in stage:
+                upload_queue.put_nowait(quality)
+    except BaseException:
+        for task in uploaders:
+            task.cancel()
+        raise
+    finally:
+        if shared_audio and os.path.exists(shared_audio):
+            os.remove(shared_audio)
+    
+    # Let the uploaders drain the queue
+    await status_msg.edit_text(
+        f"**🌟 Encoding in ALL qualities**\n\n"
+        f"**Progress:** {uploaded}/{total}\n"
+        f"**Task By:** {user_name}\n"
+        f"**Status:** Uploading..."
+    )
+    for _ in uploaders:
+        upload_queue.put_nowait(None)
+    await asyncio.gather(*uploaders)
+    
+    if not success:
+        for output_file in outputs.values():
+            if os.path.exists(output_file):
+                os.remove(output_file)
         await status_msg.edit_text(
-            f"**🌟 Encoding in ALL qualities**\n\n"
-            f"**Current:** {quality.upper()}\n"
-            f"**Progress:** {i-1}/{total}\n"
-            f"**Task By:** {user_name}\n"
-            f"**Status:** Encoding..."
+            f"**❌ Encoding failed!**\n\n"
+            f"**Uploaded:** {uploaded}/{total}"
         )
-        
-        await encode_single(client, callback_query, input_file, video_info, quality, status_msg, user_name, user_id)
-        
-        await asyncio.sleep(2)
+        return
     
     await status_msg.edit_text(
         f"**✅ All encodings complete!**\n\n"
-        f"**Total:** {total} videos\n"
+        f"**Total:** {uploaded}/{total} videos\n"
         f"**Encoded For:** {user_name}"
     )
 
@@ -312,31 +769,7 @@ async def quality_command(client: Client, message: Message):
     
     video_info = user_videos[user_id]
     
-    processing_msg = await message.reply_text("**⏳ Initializing...**")
-    
-    try:
-        download_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}.mp4")
-        start_time = time.time()
-        
-        await client.download_media(
-            video_info['file_id'],
-            file_name=download_path,
-            progress=ProgressTracker.download_progress,
-            progress_args=(processing_msg, video_info['file_name'], user_name, user_id, start_time)
-        )
-        
-        class FakeCallbackQuery:
-            def __init__(self, message):
-                self.message = message
-                self.from_user = message.from_user
-        
-        fake_cb = FakeCallbackQuery(message)
-        await encode_single(client, fake_cb, download_path, video_info, quality, processing_msg, user_name, user_id)
-        
-        if os.path.exists(download_path):
-            os.remove(download_path)
-    except Exception as e:
-        await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+    await submit_encode(message, video_info, quality, user_name)
 
 
 @Client.on_message(filters.command("all") & filters.private)
@@ -350,70 +783,86 @@ async def all_command(client: Client, message: Message):
         return
     
     video_info = user_videos[user_id]
-    processing_msg = await message.reply_text("**⏳ Initializing...**")
     
-    try:
-        download_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}.mp4")
-        start_time = time.time()
-        
-        await client.download_media(
-            video_info['file_id'],
-            file_name=download_path,
-            progress=ProgressTracker.download_progress,
-            progress_args=(processing_msg, video_info['file_name'], user_name, user_id, start_time)
-        )
-        
-        class FakeCallbackQuery:
-            def __init__(self, message):
-                self.message = message
-                self.from_user = message.from_user
-        
-        fake_cb = FakeCallbackQuery(message)
-        await encode_all_qualities(client, fake_cb, download_path, video_info, processing_msg, user_name, user_id)
-        
-        if os.path.exists(download_path):
-            os.remove(download_path)
-    except Exception as e:
-        await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+    await submit_encode(message, video_info, "all", user_name)
 
 
 @Client.on_message(filters.command("compress") & filters.private)
 async def compress_command(client: Client, message: Message):
     """Compress video"""
-    user_id = message.from_user.id
-    user_name = message.from_user.first_name or message.from_user.username or "User"
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
             "**🗜 Compress Video**\n\n"
-            "**Usage:** Reply to a video with `/compress`\n\n"
+            "**Usage:** Reply to a video with `/compress [size]`\n\n"
+            "**Examples:**\n"
+            "• `/compress` - Compress with CRF 35\n"
+            "• `/compress 50MB` - Fit the video into 50 MB\n"
+            "• `/compress 1.5GB` - Fit the video into 1.5 GB\n\n"
             "This will compress the video to reduce file size."
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Initializing...**")
+    file = message.reply_to_message.video or message.reply_to_message.document
+    
+    # Optional target size
+    target_size = 0
+    if len(message.command) > 1:
+        target_size = parse_size(message.command[1])
+        if not target_size:
+            await message.reply_text("**⚠️ Invalid size!**\n\nUse a size like `50MB`, `700M` or `1.5GB`.")
+            return
+        
+        duration = getattr(file, 'duration', 0)
+        if file.file_size > target_size and duration and \
+                FFmpegHelper.target_video_bitrate(target_size, duration) < FFmpegHelper.MIN_VIDEO_BITRATE:
+            await message.reply_text(
+                f"**⚠️ Target too small!**\n\n"
+                f"`{format_size(target_size)}` is not enough for a {format_time(duration)} video."
+            )
+            return
+    
+    await JobQueue.submit(
+        message, "compress", file.file_id, {"target_size": target_size},
+        download_size=file.file_size, output_size=min(target_size or file.file_size, file.file_size)
+    )
+
+
+@JobQueue.runner("compress")
+async def run_compress(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued compression"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    target_size = job['payload']['target_size']
+    input_path = None
     
     try:
         file = message.reply_to_message.video or message.reply_to_message.document
         file_name = file.file_name or f"video_{int(time.time())}.mp4"
         
         # Download
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
         start_time = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
+        input_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, start_time)
         )
         
+        input_size = os.path.getsize(input_path)
+        if not target_size:
+            mode_text = "Processing with CRF 35..."
+        elif input_size <= target_size:
+            mode_text = f"Already under {format_size(target_size)}, copying streams..."
+        else:
+            mode_text = f"Two-pass encode to fit {format_size(target_size)}..."
+        
         # Compress
         bot_stats = ProgressTracker.get_bot_stats()
         await processing_msg.edit_text(
             f"**2. Compressing**\n\n"
             f"┃ `{file_name}`\n\n"
-            f"Processing with CRF 35...\n"
+            f"{mode_text}\n"
             f"├ Task By: {user_name}\n"
             f"└ User ID: {user_id}\n\n"
             f"**📊 Bot Stats**\n"
@@ -421,30 +870,71 @@ async def compress_command(client: Client, message: Message):
             f"└ RAM: {bot_stats['ram']:.1f}%"
         )
         
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_compressed.mp4")
-        success = await FFmpegHelper.compress_video(input_path, output_path, crf=35)
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_compressed.mp4")
+        encode_start = time.time()
+        
+        async def progress_callback(percentage, speed, eta, current, total, fps=0, **stats):
+            """Progress callback for compression"""
+            await ProgressTracker.encoding_progress(
+                percentage, speed, eta, current, total,
+                processing_msg, file_name, format_size(target_size) if target_size else "CRF 35",
+                user_name, user_id, encode_start, fps
+            )
+        
+        if target_size:
+            success = await FFmpegHelper.compress_to_size(input_path, output_path, target_size, progress_callback=progress_callback)
+        else:
+            success = await FFmpegHelper.compress_video(input_path, output_path, crf=35, progress_callback=progress_callback)
         
-        if not success:
+        if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Compression failed!**")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return False
+        
+        file_size = os.path.getsize(output_path)
+        
+        # Don't upload a "compressed" file that came out bigger
+        if not target_size and file_size >= input_size:
+            await processing_msg.edit_text(
+                f"**⚠️ Video is already well compressed!**\n\n"
+                f"CRF 35 would not make `{file_name}` any smaller.\n"
+                f"Try `/compress <size>` to force a target size."
+            )
+            if os.path.exists(output_path):
+                os.remove(output_path)
             return
         
         # Upload
         upload_start = time.time()
-        file_size = os.path.getsize(output_path)
         
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ Video compressed!**\n\n**📦 Size:** `{format_size(file_size)}`\n**👤 Compressed For:** {user_name}",
-            progress=ProgressTracker.upload_progress,
-            progress_args=(processing_msg, file_name, user_name, user_id, upload_start)
-        )
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ Video compressed!**\n\n**📦 Size:** `{format_size(file_size)}`\n**👤 Compressed For:** {user_name}",
+            "user_name": user_name
+        }
+        try:
+            await send_upload(
+                message, upload,
+                progress=ProgressTracker.upload_progress,
+                progress_args=(processing_msg, file_name, user_name, user_id, upload_start)
+            )
+        except Exception as e:
+            if await defer_upload(message, processing_msg, upload, user_id, e):
+                return
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return False
         
         await processing_msg.delete()
         
         # Cleanup
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
                 
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
@@ -2,17 +2,17 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery
 from utils.ffmpeg_helper import FFmpegHelper
-from utils.config import Config
-from utils.helpers import format_size
+from utils.helpers import format_size, parse_time
 from utils.progress import ProgressTracker
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from handlers.encoding import upload_or_defer
 import os
 import time
 
 @Client.on_message(filters.command("extract_thumb") & filters.private)
 async def extract_thumbnail(client: Client, message: Message):
     """Extract thumbnail from video"""
-    user_id = message.from_user.id
-    user_name = message.from_user.first_name or message.from_user.username or "User"
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
@@ -22,11 +22,22 @@ async def extract_thumbnail(client: Client, message: Message):
         )
         return
     
+    file = message.reply_to_message.video or message.reply_to_message.document
+    
+    await JobQueue.submit(message, "extract_thumb", file.file_id, download_size=file.file_size)
+
+
+@JobQueue.runner("extract_thumb")
+async def run_extract_thumbnail(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued thumbnail extraction"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    
     file = message.reply_to_message.video or message.reply_to_message.document
     file_name = file.file_name or f"video_{int(time.time())}.mp4"
     
     bot_stats = ProgressTracker.get_bot_stats()
-    processing_msg = await message.reply_text(
+    await processing_msg.edit_text(
         f"**1. Downloading**\n\n"
         f"┃ `{file_name}`\n\n"
         f"Downloading video file...\n"
@@ -37,14 +48,14 @@ async def extract_thumbnail(client: Client, message: Message):
         f"└ RAM: {bot_stats['ram']:.1f}%"
     )
     
+    input_path = None
+    
     try:
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
         start_time = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
+        input_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, start_time)
         )
@@ -63,12 +74,12 @@ async def extract_thumbnail(client: Client, message: Message):
         )
         
         # Extract thumbnail
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_thumb.jpg")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_thumb.jpg", size=0)
         success = await FFmpegHelper.extract_thumbnail(input_path, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to extract thumbnail!**")
-            return
+            return False
         
         # Upload thumbnail
         await message.reply_photo(
@@ -79,19 +90,19 @@ async def extract_thumbnail(client: Client, message: Message):
         await processing_msg.delete()
         
         # Clean up
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_message(filters.command("cut") & filters.private)
 async def cut_video(client: Client, message: Message):
     """Trim/cut video by time"""
-    user_id = message.from_user.id
-    user_name = message.from_user.first_name or message.from_user.username or "User"
     
     if len(message.command) < 3:
         await message.reply_text(
@@ -112,19 +123,42 @@ async def cut_video(client: Client, message: Message):
     start_time = message.command[1]
     end_time = message.command[2]
     
+    file = message.reply_to_message.video or message.reply_to_message.document
+    
+    await JobQueue.submit(
+        message, "cut", file.file_id, {"start_time": start_time, "end_time": end_time},
+        download_size=file.file_size, output_size=estimate_clip_size(file, start_time, end_time)
+    )
+
+
+def estimate_clip_size(file, start_time: str, end_time: str) -> int:
+    """Expected size of a cut, its share of the source by duration"""
+    duration = getattr(file, 'duration', 0)
+    clip = parse_time(end_time) - parse_time(start_time)
+    if not duration or clip <= 0:
+        return file.file_size
+    return min(file.file_size, file.file_size * clip // duration)
+
+
+@JobQueue.runner("cut")
+async def run_cut_video(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued cut"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    start_time = job['payload']['start_time']
+    end_time = job['payload']['end_time']
+    
     file = message.reply_to_message.video or message.reply_to_message.document
     file_name = file.file_name or f"video_{int(time.time())}.mp4"
     
-    processing_msg = await message.reply_text("**⏳ Initializing...**")
+    input_path = None
     
     try:
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
         dl_start = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
+        input_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, dl_start)
         )
@@ -144,42 +178,50 @@ async def cut_video(client: Client, message: Message):
         )
         
         # Trim video
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_cut.mp4")
+        # Short clips are staged in RAM
+        output_path = job['workspace'].path(
+            f"{user_id}_{int(time.time())}_cut.mp4",
+            size=estimate_clip_size(file, start_time, end_time)
+        )
         success = await FFmpegHelper.trim_video(input_path, output_path, start_time, end_time)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to cut video!**")
-            return
+            return False
         
         # Upload result
         file_size = os.path.getsize(output_path)
         upload_start = time.time()
         
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ Video cut successfully!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**👤 Cut For:** {user_name}",
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ Video cut successfully!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**👤 Cut For:** {user_name}",
+            "user_name": user_name
+        }
+        if await upload_or_defer(
+            message, processing_msg, upload, user_id,
             progress=ProgressTracker.upload_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, upload_start)
-        )
-        
-        await processing_msg.delete()
+        ) is False:
+            return False
         
         # Clean up
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_message(filters.command("crop") & filters.private)
 async def crop_video(client: Client, message: Message):
     """Crop video to different aspect ratio"""
-    user_id = message.from_user.id
-    user_name = message.from_user.first_name or message.from_user.username or "User"
     
     if len(message.command) < 2:
         await message.reply_text(
@@ -204,19 +246,29 @@ async def crop_video(client: Client, message: Message):
         await message.reply_text("**⚠️ Invalid aspect ratio!**\n\nUse: 16:9, 9:16, 1:1, or 4:3")
         return
     
+    file = message.reply_to_message.video or message.reply_to_message.document
+    
+    await JobQueue.submit(message, "crop", file.file_id, {"aspect_ratio": aspect_ratio}, download_size=file.file_size, output_size=file.file_size)
+
+
+@JobQueue.runner("crop")
+async def run_crop_video(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued crop"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    aspect_ratio = job['payload']['aspect_ratio']
+    
     file = message.reply_to_message.video or message.reply_to_message.document
     file_name = file.file_name or f"video_{int(time.time())}.mp4"
     
-    processing_msg = await message.reply_text("**⏳ Initializing...**")
+    input_path = None
     
     try:
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
         dl_start = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
+        input_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, dl_start)
         )
@@ -235,35 +287,41 @@ async def crop_video(client: Client, message: Message):
         )
         
         # Crop video
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_crop.mp4")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_crop.mp4")
         success = await FFmpegHelper.crop_video(input_path, output_path, aspect_ratio)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to crop video!**")
-            return
+            return False
         
         # Upload result
         file_size = os.path.getsize(output_path)
         upload_start = time.time()
         
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ Video cropped to {aspect_ratio}!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**👤 Cropped For:** {user_name}",
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ Video cropped to {aspect_ratio}!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**👤 Cropped For:** {user_name}",
+            "user_name": user_name
+        }
+        if await upload_or_defer(
+            message, processing_msg, upload, user_id,
             progress=ProgressTracker.upload_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, upload_start)
-        )
-        
-        await processing_msg.delete()
+        ) is False:
+            return False
         
         # Clean up
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_callback_query(filters.regex("^(extract_thumb|cut_video|crop_video)$"))
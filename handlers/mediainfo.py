@@ -5,7 +5,11 @@ from utils.ffmpeg_helper import FFmpegHelper
 from utils.config import Config
 from utils.helpers import format_size, format_time
 from utils.progress import ProgressTracker
-import os
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from utils.downloader import ParallelDownloader
+from utils.workspace import Workspace
+import math
 import time
 
 @Client.on_message(filters.command("mediainfo") & filters.private)
@@ -25,22 +29,55 @@ async def media_info(client: Client, message: Message):
     file = message.reply_to_message.video or message.reply_to_message.document
     file_name = file.file_name or f"video_{int(time.time())}.mp4"
     
-    processing_msg = await message.reply_text(
+    # Probe cached files and the head and tail of the others right away,
+    # only a full download waits in the queue behind the encodes
+    status_msg = await message.reply_text(
         f"**📊 Analyzing Media**\n\n"
         f"┃ `{file_name}`\n\n"
-        f"Downloading for analysis...\n"
+        f"Reading the file headers...\n"
         f"├ Task By: {user_name}\n"
         f"└ User ID: {user_id}"
     )
     
+    info = {}
+    try:
+        if SourceCache.contains(file.file_unique_id, file_name):
+            input_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file_name)
+            try:
+                info = await FFmpegHelper.get_video_info(input_path)
+            finally:
+                SourceCache.release(input_path)
+        else:
+            with Workspace("mediainfo") as workspace:
+                info = await probe_partial(client, file, file_name, workspace)
+    except Exception:
+        info = {}
+    
+    if info:
+        await status_msg.edit_text(format_media_info(info, file_name, user_name, user_id))
+        return
+    
+    await status_msg.delete()
+    await JobQueue.submit(message, "mediainfo", file.file_id, download_size=file.file_size)
+
+
+@JobQueue.runner("mediainfo")
+async def run_media_info(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued media analysis that needs the whole file"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    
+    file = message.reply_to_message.video or message.reply_to_message.document
+    file_name = file.file_name or f"video_{int(time.time())}.mp4"
+    
+    input_path = None
+    
     try:
         # Download file
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_mediainfo.mp4")
         start_time = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
+        input_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, start_time)
         )
@@ -58,18 +95,28 @@ async def media_info(client: Client, message: Message):
         
         if not info:
             await processing_msg.edit_text("**❌ Failed to get media information!**")
-            return
+            return False
         
-        # Format info
-        duration = format_time(int(info.get('duration', 0)))
-        size = format_size(info.get('size', 0))
-        bitrate = f"{info.get('bitrate', 0) // 1000} kbps" if info.get('bitrate') else "Unknown"
-        resolution = f"{info.get('width', 0)}x{info.get('height', 0)}"
-        video_codec = info.get('video_codec', 'Unknown').upper()
-        audio_codec = info.get('audio_codec', 'Unknown').upper()
-        fps = f"{info.get('fps', 0):.2f}" if info.get('fps') else "Unknown"
-        
-        info_text = f"""
+        await processing_msg.edit_text(format_media_info(info, file_name, user_name, user_id))
+            
+    except Exception as e:
+        await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
+
+
+def format_media_info(info: dict, file_name: str, user_name: str, user_id: int) -> str:
+    """Media information message for a probed file"""
+    duration = format_time(int(info.get('duration', 0)))
+    size = format_size(info.get('size', 0))
+    bitrate = f"{info.get('bitrate', 0) // 1000} kbps" if info.get('bitrate') else "Unknown"
+    resolution = f"{info.get('width', 0)}x{info.get('height', 0)}"
+    video_codec = info.get('video_codec', 'Unknown').upper()
+    audio_codec = info.get('audio_codec', 'Unknown').upper()
+    fps = f"{info.get('fps', 0):.2f}" if info.get('fps') else "Unknown"
+    
+    return f"""
 **📊 Media Information**
 
 **📁 File Details:**
@@ -88,16 +135,41 @@ async def media_info(client: Client, message: Message):
 
 **👤 Requested By:** {user_name}
 **🆔 User ID:** {user_id}
-        """
-        
-        await processing_msg.edit_text(info_text)
-        
-        # Clean up
-        if os.path.exists(input_path):
-            os.remove(input_path)
-            
-    except Exception as e:
-        await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+    """
+
+
+async def probe_partial(client, file, file_name, workspace) -> dict:
+    """Probe a file from its head and tail only, {} when that isn't enough
+    
+    The chunks are written into a sparse file of the full size, so ffprobe
+    sees the real size and the offsets of the container's index.
+    """
+    chunk_size = ParallelDownloader.CHUNK_SIZE
+    chunks = math.ceil((file.file_size or 0) / chunk_size)
+    head, tail = Config.PROBE_HEAD_MB, Config.PROBE_TAIL_MB
+    if chunks <= head + tail:
+        return {}
+    
+    probe_path = workspace.path(file_name)
+    await ParallelDownloader.download_ranges(
+        client, file.file_id, probe_path, file.file_size,
+        [(0, head), (chunks - tail, tail)]
+    )
+    
+    # An MP4 index written after the media data can start before the tail
+    with open(probe_path, "rb") as f:
+        index = FFmpegHelper.index_offset(f.read(head * chunk_size))
+    if index is not None and index // chunk_size < chunks - tail:
+        start = index // chunk_size
+        await ParallelDownloader.download_ranges(
+            client, file.file_id, probe_path, file.file_size,
+            [(start, chunks - tail - start)]
+        )
+    
+    info = await FFmpegHelper.get_video_info(probe_path)
+    if not info.get('duration') or (info.get('video_codec') == 'none' and info.get('audio_codec') == 'none'):
+        return {}
+    return info
 
 
 @Client.on_callback_query(filters.regex("^show_mediainfo$"))
@@ -2,8 +2,10 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from utils.ffmpeg_helper import FFmpegHelper
-from utils.config import Config
 from utils.helpers import format_size, format_time
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from handlers.encoding import upload_or_defer
 import os
 import time
 
@@ -19,7 +21,6 @@ async def merge_videos_command(client: Client, message: Message):
     # Initialize merge session
     user_merge_videos[user_id] = {
         "videos": [],
-        "file_paths": [],
         "started_at": time.time()
     }
     
@@ -57,7 +58,9 @@ async def done_merging(client: Client, message: Message):
         )
         return
     
-    await process_merge(client, message, user_id, session)
+    # The job picks the downloaded files up from the source cache
+    output_size = sum(video.get('file_size') or 0 for video in session['videos'])
+    await JobQueue.submit(message, "merge", session['videos'][0]['file_id'], user_merge_videos.pop(user_id), output_size=output_size)
 
 
 @Client.on_message(filters.command("cancel") & filters.private)
@@ -66,11 +69,7 @@ async def cancel_merge(client: Client, message: Message):
     user_id = message.from_user.id
     
     if user_id in user_merge_videos:
-        # Clean up downloaded files
-        for file_path in user_merge_videos[user_id]['file_paths']:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
+        # Downloaded files are left to the source cache eviction
         del user_merge_videos[user_id]
         await message.reply_text("**✅ Merge session cancelled!**")
     else:
@@ -96,21 +95,18 @@ async def collect_merge_videos(client: Client, message: Message):
     status_msg = await message.reply_text("**⬇️ Downloading video...**")
     
     try:
-        file_path = os.path.join(
-            Config.DOWNLOAD_DIR,
-            f"{user_id}_merge_{len(session['videos'])}_{int(time.time())}.mp4"
-        )
-        
-        await client.download_media(message, file_name=file_path)
+        # Download into the source cache now so merging starts right away
+        file_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file.file_name)
+        SourceCache.release(file_path)
         
         # Store video info
         session['videos'].append({
             'file_id': file.file_id,
+            'file_unique_id': file.file_unique_id,
             'file_name': file.file_name or f"video_{len(session['videos']) + 1}.mp4",
             'file_size': file.file_size,
             'duration': getattr(file, 'duration', 0)
         })
-        session['file_paths'].append(file_path)
         
         # Show status
         total_duration = sum(v['duration'] for v in session['videos'])
@@ -133,26 +129,34 @@ async def collect_merge_videos(client: Client, message: Message):
         await status_msg.edit_text(f"**❌ Error downloading video:** {str(e)}")
 
 
-async def process_merge(client, message, user_id, session):
+@JobQueue.runner("merge")
+async def process_merge(client: Client, message: Message, processing_msg: Message, job: dict):
     """Process video merging"""
-    processing_msg = await message.reply_text(
+    user_id = job['user_id']
+    session = job['payload']
+    await processing_msg.edit_text(
         f"**🔀 Merging {len(session['videos'])} videos...**\n\n"
         "**⏳ This may take a while...**"
     )
     
+    file_paths = []
+    
     try:
+        # Get the videos from the source cache, downloading any that were evicted
+        for video in session['videos']:
+            file_paths.append(await SourceCache.acquire(
+                client, video['file_id'], video.get('file_unique_id'), video.get('file_size') or 0, video['file_name']
+            ))
+        
         # Prepare output file
-        output_path = os.path.join(
-            Config.UPLOAD_DIR,
-            f"{user_id}_merged_{int(time.time())}.mp4"
-        )
+        output_path = job['workspace'].path(f"{user_id}_merged_{int(time.time())}.mp4")
         
         # Merge videos
-        success = await FFmpegHelper.merge_videos(session['file_paths'], output_path)
+        success = await FFmpegHelper.merge_videos(file_paths, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to merge videos!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading merged video...**")
         
@@ -170,32 +174,25 @@ async def process_merge(client, message, user_id, session):
 **💪 Merged By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏
         """
         
-        await message.reply_video(
-            video=output_path,
-            caption=caption,
-            duration=int(total_duration)
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": caption,
+            "duration": int(total_duration)
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        for file_path in session['file_paths']:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
         if os.path.exists(output_path):
             os.remove(output_path)
         
-        # Clear session
-        del user_merge_videos[user_id]
-        
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
-        
-        # Clean up on error
-        for file_path in session['file_paths']:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        return False
+    finally:
+        for file_path in file_paths:
+            SourceCache.release(file_path)
 
 
 @Client.on_callback_query(filters.regex("^merge_videos$"))
@@ -206,7 +203,6 @@ async def merge_callback(client: Client, callback_query: CallbackQuery):
     # Initialize merge session
     user_merge_videos[user_id] = {
         "videos": [],
-        "file_paths": [],
         "started_at": time.time()
     }
     
@@ -4,7 +4,12 @@ from pyrogram.types import Message, CallbackQuery
 from utils.config import Config
 from utils.helpers import format_size, clean_filename, change_filename
 from utils.progress import ProgressTracker
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from utils.uploader import RelayStream
+from handlers.encoding import upload_or_defer
 import os
+import shutil
 import time
 
 # Store rename sessions
@@ -14,7 +19,6 @@ rename_sessions = {}
 @Client.on_message(filters.command("Rename") & filters.private)
 async def rename_file(client: Client, message: Message):
     """Rename telegram files"""
-    user_id = message.from_user.id
     
     if len(message.command) < 2:
         await message.reply_text(
@@ -51,65 +55,95 @@ async def rename_file(client: Client, message: Message):
     else:
         new_name = clean_filename(new_name)
     
+    # Relayed renames never touch the disk, the others link the cached download
+    relay = Config.RENAME_RELAY and file.file_size
+    await JobQueue.submit(
+        message, "rename", file.file_id, {"new_name": new_name},
+        download_size=0 if relay else file.file_size
+    )
+
+
+@JobQueue.runner("rename")
+async def run_rename_file(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued rename"""
+    user_id = message.from_user.id
     user_name = message.from_user.first_name or message.from_user.username or "User"
+    new_name = job['payload']['new_name']
     
-    processing_msg = await message.reply_text("**⏳ Renaming file...**")
+    await processing_msg.edit_text("**⏳ Renaming file...**")
+    input_path = None
     
     try:
-        # Download file
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_{old_name}")
-        start_time = time.time()
+        file = (message.reply_to_message.video or 
+                message.reply_to_message.document or
+                message.reply_to_message.audio or
+                message.reply_to_message.animation)
+        old_name = file.file_name or "file"
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=input_path,
-            progress=ProgressTracker.download_progress,
-            progress_args=(processing_msg, old_name, user_name, user_id, start_time)
-        )
+        file_size = file.file_size
         
-        # Rename (move) file
-        output_path = os.path.join(Config.UPLOAD_DIR, new_name)
-        os.rename(input_path, output_path)
+        if Config.RENAME_RELAY and file_size and not SourceCache.contains(file.file_unique_id, old_name):
+            # Upload the chunks as they download, nothing is written to disk
+            upload_source = RelayStream(client, file.file_id, file_size, new_name)
+        else:
+            # Download file
+            start_time = time.time()
+            
+            input_path = await SourceCache.acquire(
+                client, file.file_id, file.file_unique_id, file.file_size, old_name,
+                progress=ProgressTracker.download_progress,
+                progress_args=(processing_msg, old_name, user_name, user_id, start_time)
+            )
+            
+            # Link the cached file under the new name, copy across filesystems
+            upload_source = job['workspace'].path(new_name)
+            try:
+                os.link(input_path, upload_source)
+            except OSError:
+                shutil.copyfile(input_path, upload_source)
+            file_size = os.path.getsize(upload_source)
         
         # Upload with new name
-        file_size = os.path.getsize(output_path)
         upload_start = time.time()
         
         # Determine file type and upload accordingly
         if message.reply_to_message.video:
-            await message.reply_video(
-                video=output_path,
-                caption=f"**✅ File renamed!**\n\n"
-                       f"**Old:** `{old_name}`\n"
-                       f"**New:** `{new_name}`\n"
-                       f"**Size:** `{format_size(file_size)}`\n"
-                       f"**👤 Renamed For:** {user_name}",
-                progress=ProgressTracker.upload_progress,
-                progress_args=(processing_msg, new_name, user_name, user_id, upload_start)
-            )
-        elif message.reply_to_message.audio:
-            await message.reply_audio(
-                audio=output_path,
-                caption=f"**✅ File renamed!**\n\n**New Name:** `{new_name}`\n**👤 Renamed For:** {user_name}",
-                progress=ProgressTracker.upload_progress,
-                progress_args=(processing_msg, new_name, user_name, user_id, upload_start)
+            media_type = "video"
+            caption = (
+                f"**✅ File renamed!**\n\n"
+                f"**Old:** `{old_name}`\n"
+                f"**New:** `{new_name}`\n"
+                f"**Size:** `{format_size(file_size)}`\n"
+                f"**👤 Renamed For:** {user_name}"
             )
         else:
-            await message.reply_document(
-                document=output_path,
-                caption=f"**✅ File renamed!**\n\n**New Name:** `{new_name}`\n**👤 Renamed For:** {user_name}",
-                progress=ProgressTracker.upload_progress,
-                progress_args=(processing_msg, new_name, user_name, user_id, upload_start)
-            )
+            media_type = "audio" if message.reply_to_message.audio else "document"
+            caption = f"**✅ File renamed!**\n\n**New Name:** `{new_name}`\n**👤 Renamed For:** {user_name}"
         
-        await processing_msg.delete()
+        upload = {"media_type": media_type, "caption": caption, "user_name": user_name, "file_size": file_size}
+        if media_type == "video":
+            # A relayed video can't be probed, send the source's attributes along
+            video = message.reply_to_message.video
+            upload.update(duration=video.duration or 0, width=video.width or 0, height=video.height or 0)
+        if isinstance(upload_source, RelayStream):
+            # Nothing is kept on disk, a retry relays the file again
+            upload['relay'] = {"file_id": file.file_id, "file_size": file_size, "name": new_name}
+        else:
+            upload['path'] = upload_source
         
-        # Clean up
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        if await upload_or_defer(
+            message, processing_msg, upload, user_id,
+            progress=ProgressTracker.upload_progress,
+            progress_args=(processing_msg, new_name, user_name, user_id, upload_start),
+            source=upload_source
+        ) is False:
+            return False
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_callback_query(filters.regex("^rename_file$"))
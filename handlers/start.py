@@ -140,6 +140,8 @@ async def help_handler(client: Client, message: Message):
 /restart - Rᴇsᴛᴀʀᴛ ᴛʜᴇ ʙᴏᴛ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /queue - Cʜᴇᴄᴋ ᴛᴏᴛᴀʟ ǫᴜᴇᴜᴇ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /clear - Cʟᴇᴀʀ ᴀʟʟ ǫᴜᴇᴜᴇ ᴛᴀsᴋs (Aᴅᴍɪɴ ᴏɴʟʏ)
+/cachestats - Rᴇɴᴅɪᴛɪᴏɴ & sᴏᴜʀᴄᴇ ᴄᴀᴄʜᴇ sᴛᴀᴛs (Aᴅᴍɪɴ ᴏɴʟʏ)
+/clearcache - Cʟᴇᴀʀ ʀᴇɴᴅɪᴛɪᴏɴ & sᴏᴜʀᴄᴇ ᴄᴀᴄʜᴇs (Aᴅᴍɪɴ ᴏɴʟʏ)
 /audio - Sᴇᴛ ᴀᴜᴅɪᴏ ʙɪᴛʀᴀᴛᴇ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /codec - Sᴇᴛ ᴠɪᴅᴇᴏ ᴄᴏᴅᴇᴄ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /addchnl - Sᴇᴛ ғsᴜʙ ᴄʜᴀɴɴᴇʟ (Aᴅᴍɪɴ ᴏɴʟʏ)
@@ -158,6 +160,7 @@ async def help_handler(client: Client, message: Message):
 /rempaid - ʀᴇᴍᴏᴠᴇ ᴘʀᴇᴍɪᴜᴍ ᴜsᴇʀs (Aᴅᴍɪɴ ᴏɴʟʏ)
 /preset - Cʜᴀɴɢᴇ ᴇɴᴄᴏᴅɪɴɢ ᴘʀᴇsᴇᴛ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /crf - Sᴇᴛ CRF ᴠᴀʟᴜᴇ (Aᴅᴍɪɴ ᴏɴʟʏ)
+/adaptivecrf - Pɪᴄᴋ CRF ᴘᴇʀ ᴠɪᴅᴇᴏ (Aᴅᴍɪɴ ᴏɴʟʏ)
 /update - Gɪᴛ ᴘᴜʟʟ ʟᴀᴛᴇsᴛ ᴜᴘᴅᴀᴛᴇs (Aᴅᴍɪɴ ᴏɴʟʏ)
 /Setstartpic - to setstartpic for bot (Admin only)
         """
@@ -2,8 +2,10 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from utils.ffmpeg_helper import FFmpegHelper
-from utils.config import Config
 from utils.helpers import format_size
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from handlers.encoding import upload_or_defer
 import os
 import time
 
@@ -51,7 +53,6 @@ async def add_hard_subtitle(client: Client, message: Message):
 @Client.on_message(filters.command("rsub") & filters.private)
 async def remove_subtitle(client: Client, message: Message):
     """Remove all subtitles from video"""
-    user_id = message.from_user.id
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
@@ -61,49 +62,59 @@ async def remove_subtitle(client: Client, message: Message):
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    file = message.reply_to_message.video or message.reply_to_message.document
+    await JobQueue.submit(message, "remove_subtitle", file.file_id, download_size=file.file_size, output_size=file.file_size)
+
+
+@JobQueue.runner("remove_subtitle")
+async def run_remove_subtitle(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued subtitle removal"""
+    user_id = message.from_user.id
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    
+    input_path = None
     
     try:
         file = message.reply_to_message.video or message.reply_to_message.document
         
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
-        await client.download_media(message.reply_to_message, file_name=input_path)
+        input_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file.file_name)
         
         await processing_msg.edit_text("**🔄 Removing subtitles...**")
         
         # Remove subtitles
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_no_sub.mp4")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_no_sub.mp4")
         success = await FFmpegHelper.remove_subtitle(input_path, output_path)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to remove subtitles!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
         # Upload result
-        await message.reply_video(
-            video=output_path,
-            caption="**✅ Subtitles removed successfully!**\n\n**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": "**✅ Subtitles removed successfully!**\n\n**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        if os.path.exists(input_path):
-            os.remove(input_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 @Client.on_message(filters.command("extract_sub") & filters.private)
 async def extract_subtitle(client: Client, message: Message):
     """Extract subtitles from video"""
-    user_id = message.from_user.id
     
     if not message.reply_to_message or (not message.reply_to_message.video and not message.reply_to_message.document):
         await message.reply_text(
@@ -113,19 +124,28 @@ async def extract_subtitle(client: Client, message: Message):
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    file = message.reply_to_message.video or message.reply_to_message.document
+    await JobQueue.submit(message, "extract_subtitle", file.file_id, download_size=file.file_size)
+
+
+@JobQueue.runner("extract_subtitle")
+async def run_extract_subtitle(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued subtitle extraction"""
+    user_id = message.from_user.id
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading video...**")
+    
+    input_path = None
     
     try:
         file = message.reply_to_message.video or message.reply_to_message.document
         
         # Download video
-        input_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_input.mp4")
-        await client.download_media(message.reply_to_message, file_name=input_path)
+        input_path = await SourceCache.acquire(client, file.file_id, file.file_unique_id, file.file_size, file.file_name)
         
         await processing_msg.edit_text("**🔄 Extracting subtitles...**")
         
         # Extract subtitles
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_subtitle.srt")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_subtitle.srt", size=0)
         success = await FFmpegHelper.extract_subtitles(input_path, output_path)
         
         if not success or not os.path.exists(output_path):
@@ -133,28 +153,28 @@ async def extract_subtitle(client: Client, message: Message):
                 "**⚠️ No subtitles found in the video!**\n\n"
                 "The video doesn't contain any subtitle tracks."
             )
-            if os.path.exists(input_path):
-                os.remove(input_path)
             return
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
         # Upload subtitle file
-        await message.reply_document(
-            document=output_path,
-            caption="**✅ Subtitle extracted successfully!**\n\n**💪 Extracted By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "document",
+            "caption": "**✅ Subtitle extracted successfully!**\n\n**💪 Extracted By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        if os.path.exists(input_path):
-            os.remove(input_path)
         if os.path.exists(output_path):
             os.remove(output_path)
             
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(input_path)
 
 
 # Handle subtitle file uploads
@@ -176,6 +196,8 @@ async def handle_subtitle_file(client: Client, message: Message):
     # Store subtitle file
     state['subtitle'] = {
         'file_id': file.file_id,
+        'file_unique_id': file.file_unique_id,
+        'file_size': file.file_size,
         'file_name': file.file_name
     }
     
@@ -186,32 +208,42 @@ async def handle_subtitle_file(client: Client, message: Message):
     
     # Check if we have both video and subtitle
     if state['video'] and state['subtitle']:
-        await process_subtitle_addition(client, message, user_id, state)
+        state = user_videos_for_sub.pop(user_id)
+        sizes = (state['video'].get('file_size') or 0) + (state['subtitle'].get('file_size') or 0)
+        await JobQueue.submit(message, "add_subtitle", state['video']['file_id'], state, download_size=sizes, output_size=sizes)
 
 
-async def process_subtitle_addition(client, message, user_id, state):
+@JobQueue.runner("add_subtitle")
+async def process_subtitle_addition(client: Client, message: Message, processing_msg: Message, job: dict):
     """Process video + subtitle combination"""
-    processing_msg = await message.reply_text("**⏳ Processing...**\n\n**⬇️ Downloading files...**")
+    user_id = job['user_id']
+    state = job['payload']
+    await processing_msg.edit_text("**⏳ Processing...**\n\n**⬇️ Downloading files...**")
+    video_path = subtitle_path = None
     
     try:
         # Download video
-        video_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_video.mp4")
-        await client.download_media(state['video']['file_id'], file_name=video_path)
+        video = state['video']
+        video_path = await SourceCache.acquire(
+            client, video['file_id'], video.get('file_unique_id'), video.get('file_size') or 0, video.get('file_name')
+        )
         
         # Download subtitle
-        subtitle_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_{state['subtitle']['file_name']}")
-        await client.download_media(state['subtitle']['file_id'], file_name=subtitle_path)
+        subtitle = state['subtitle']
+        subtitle_path = await SourceCache.acquire(
+            client, subtitle['file_id'], subtitle.get('file_unique_id'), subtitle.get('file_size') or 0, subtitle['file_name']
+        )
         
         await processing_msg.edit_text(f"**🔄 Adding {state['type']} subtitles...**")
         
         # Add subtitle
-        output_path = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_with_sub.mp4")
+        output_path = job['workspace'].path(f"{user_id}_{int(time.time())}_with_sub.mp4")
         hard = state['type'] == 'hard'
         success = await FFmpegHelper.add_subtitle(video_path, subtitle_path, output_path, hard=hard)
         
         if not success or not os.path.exists(output_path):
             await processing_msg.edit_text("**❌ Failed to add subtitles!**")
-            return
+            return False
         
         await processing_msg.edit_text("**⬆️ Uploading...**")
         
@@ -219,25 +251,26 @@ async def process_subtitle_addition(client, message, user_id, state):
         file_size = os.path.getsize(output_path)
         subtitle_type = "Hard-coded" if hard else "Soft"
         
-        await message.reply_video(
-            video=output_path,
-            caption=f"**✅ {subtitle_type} subtitle added successfully!**\n\n"
-                   f"**📦 Size:** `{format_size(file_size)}`\n"
-                   f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
-        )
-        
-        await processing_msg.delete()
+        upload = {
+            "path": output_path,
+            "media_type": "video",
+            "caption": f"**✅ {subtitle_type} subtitle added successfully!**\n\n"
+                       f"**📦 Size:** `{format_size(file_size)}`\n"
+                       f"**💪 Processed By:** ꜱᴋ•ᴘᴀᴛʜɪʀᴀᴊ.ᴘʏ™ 𝕏"
+        }
+        if await upload_or_defer(message, processing_msg, upload, user_id) is False:
+            return False
         
         # Clean up
-        for path in [video_path, subtitle_path, output_path]:
-            if os.path.exists(path):
-                os.remove(path)
-        
-        # Clear state
-        del user_videos_for_sub[user_id]
+        if os.path.exists(output_path):
+            os.remove(output_path)
         
     except Exception as e:
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
+        return False
+    finally:
+        SourceCache.release(video_path)
+        SourceCache.release(subtitle_path)
 
 
 @Client.on_callback_query(filters.regex("^subtitle_menu$"))
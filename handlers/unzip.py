@@ -1,9 +1,11 @@
 # handlers/unzip.py
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from utils.config import Config
 from utils.helpers import format_size
 from utils.progress import ProgressTracker
+from utils.job_queue import JobQueue
+from utils.source_cache import SourceCache
+from handlers.encoding import send_upload, defer_upload
 import os
 import time
 import zipfile
@@ -13,8 +15,6 @@ import rarfile
 @Client.on_message(filters.command("Unzip") & filters.private)
 async def unzip_file(client: Client, message: Message):
     """Unzip compressed files"""
-    user_id = message.from_user.id
-    user_name = message.from_user.first_name or message.from_user.username or "User"
     
     if not message.reply_to_message or not message.reply_to_message.document:
         await message.reply_text(
@@ -39,16 +39,28 @@ async def unzip_file(client: Client, message: Message):
         )
         return
     
-    processing_msg = await message.reply_text("**⏳ Starting extraction...**")
+    # Archives usually unpack to more than their own size
+    await JobQueue.submit(message, "unzip", file.file_id, download_size=file.file_size, output_size=file.file_size * 2)
+
+
+@JobQueue.runner("unzip")
+async def run_unzip_file(client: Client, message: Message, processing_msg: Message, job: dict):
+    """Run a queued archive extraction"""
+    user_id = message.from_user.id
+    user_name = message.from_user.first_name or message.from_user.username or "User"
+    file_name = message.reply_to_message.document.file_name
+    
+    await processing_msg.edit_text("**⏳ Starting extraction...**")
+    
+    archive_path = None
     
     try:
         # Download archive
-        archive_path = os.path.join(Config.DOWNLOAD_DIR, f"{user_id}_{int(time.time())}_{file_name}")
+        file = message.reply_to_message.document
         start_time = time.time()
         
-        await client.download_media(
-            message.reply_to_message,
-            file_name=archive_path,
+        archive_path = await SourceCache.acquire(
+            client, file.file_id, file.file_unique_id, file.file_size, file_name,
             progress=ProgressTracker.download_progress,
             progress_args=(processing_msg, file_name, user_name, user_id, start_time)
         )
@@ -66,7 +78,7 @@ async def unzip_file(client: Client, message: Message):
         )
         
         # Extract files
-        extract_dir = os.path.join(Config.UPLOAD_DIR, f"{user_id}_{int(time.time())}_extracted")
+        extract_dir = job['workspace'].path(f"{user_id}_{int(time.time())}_extracted")
         os.makedirs(extract_dir, exist_ok=True)
         
         extracted_files = []
@@ -88,7 +100,7 @@ async def unzip_file(client: Client, message: Message):
         
         if not extracted_files:
             await processing_msg.edit_text("**⚠️ No files found in archive!**")
-            return
+            return False
         
         await processing_msg.edit_text(
             f"**✅ Extraction complete!**\n\n"
@@ -97,7 +109,7 @@ async def unzip_file(client: Client, message: Message):
         )
         
         # Upload all extracted files
-        uploaded = 0
+        uploaded = deferred = 0
         for extracted_file in extracted_files:
             file_path = os.path.join(extract_dir, extracted_file)
             
@@ -117,54 +129,51 @@ async def unzip_file(client: Client, message: Message):
             
             upload_start = time.time()
             
-            try:
-                # Determine file type and upload
-                if extracted_file.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv')):
-                    await message.reply_video(
-                        video=file_path,
-                        caption=f"**📹 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}",
-                        progress=ProgressTracker.upload_progress,
-                        progress_args=(processing_msg, extracted_file, user_name, user_id, upload_start)
-                    )
-                elif extracted_file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
+            lower_name = extracted_file.lower()
+            if lower_name.endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
+                try:
                     await message.reply_photo(
                         photo=file_path,
                         caption=f"**🖼️ Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}"
                     )
-                elif extracted_file.lower().endswith(('.mp3', '.wav', '.ogg', '.m4a', '.flac')):
-                    await message.reply_audio(
-                        audio=file_path,
-                        caption=f"**🎵 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}",
-                        progress=ProgressTracker.upload_progress,
-                        progress_args=(processing_msg, extracted_file, user_name, user_id, upload_start)
+                    uploaded += 1
+                except Exception as e:
+                    await message.reply_text(
+                        f"**❌ Failed to upload:** `{extracted_file}`\n"
+                        f"**Error:** {str(e)}"
                     )
-                else:
-                    await message.reply_document(
-                        document=file_path,
-                        caption=f"**📄 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}",
-                        progress=ProgressTracker.upload_progress,
-                        progress_args=(processing_msg, extracted_file, user_name, user_id, upload_start)
-                    )
-                
+                continue
+            
+            # Determine file type and upload
+            if lower_name.endswith(('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv')):
+                media_type, caption = "video", f"**📹 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}"
+            elif lower_name.endswith(('.mp3', '.wav', '.ogg', '.m4a', '.flac')):
+                media_type, caption = "audio", f"**🎵 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}"
+            else:
+                media_type, caption = "document", f"**📄 Extracted File**\n\n`{extracted_file}`\n\n**👤 For:** {user_name}"
+            
+            upload = {"path": file_path, "media_type": media_type, "caption": caption, "user_name": user_name}
+            try:
+                await send_upload(
+                    message, upload,
+                    progress=ProgressTracker.upload_progress,
+                    progress_args=(processing_msg, extracted_file, user_name, user_id, upload_start)
+                )
                 uploaded += 1
-                
             except Exception as e:
-                await message.reply_text(
-                    f"**❌ Failed to upload:** `{extracted_file}`\n"
-                    f"**Error:** {str(e)}"
-                )
+                # Each failed file gets its own status message for the retry
+                failure_msg = await message.reply_text(f"**❌ Failed to upload:** `{extracted_file}`")
+                if await defer_upload(message, failure_msg, upload, user_id, e):
+                    deferred += 1
         
         await processing_msg.edit_text(
             f"**✅ Extraction & Upload Complete!**\n\n"
             f"**Total Files:** {len(extracted_files)}\n"
             f"**Uploaded:** {uploaded}\n"
+            f"**Retrying Later:** {deferred}\n"
             f"**👤 Extracted For:** {user_name}"
         )
         
-        # Clean up
-        if os.path.exists(archive_path):
-            os.remove(archive_path)
-        
         # Remove extracted directory
         import shutil
         if os.path.exists(extract_dir):
@@ -174,8 +183,9 @@ async def unzip_file(client: Client, message: Message):
         await processing_msg.edit_text(f"**❌ Error:** {str(e)}")
         
         # Clean up on error
-        if 'archive_path' in locals() and os.path.exists(archive_path):
-            os.remove(archive_path)
         if 'extract_dir' in locals() and os.path.exists(extract_dir):
             import shutil
             shutil.rmtree(extract_dir)
+        return False
+    finally:
+        SourceCache.release(archive_path)
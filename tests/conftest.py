@@ -0,0 +1,13 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# Keep the directories and database the bot creates on import out of the tree
+_root = tempfile.mkdtemp(prefix="encoder_bot_tests_")
+for name in ("DOWNLOAD_DIR", "UPLOAD_DIR", "THUMB_DIR"):
+    os.environ[name] = os.path.join(_root, name.lower())
+os.environ["DATABASE_URL"] = os.path.join(_root, "bot_database.db")
+os.environ["STAGING_DIR"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,98 @@
+# tests/test_cpu_budget.py
+import asyncio
+import pytest
+from utils.config import Config
+from utils.cpu_budget import CPUBudget
+
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch):
+    """A 32 core budget shared by 3 queue workers, FFmpeg starting at 2 threads"""
+    monkeypatch.setattr(CPUBudget, "total", 32)
+    monkeypatch.setattr(CPUBudget, "allocated", 0)
+    monkeypatch.setattr(CPUBudget, "active", 0)
+    monkeypatch.setattr(CPUBudget, "waiting", 0)
+    monkeypatch.setattr(CPUBudget, "_condition", None)
+    monkeypatch.setattr(Config, "QUEUE_WORKERS", 3)
+    monkeypatch.setattr(Config, "FFMPEG_THREADS", 2)
+    monkeypatch.setattr(Config, "CPU_MAX_THREADS_PER_PROCESS", 0)
+
+
+def test_min_threads_never_exceeds_the_cores(monkeypatch):
+    monkeypatch.setattr(CPUBudget, "total", 1)
+    assert CPUBudget.min_threads() == 1
+    assert CPUBudget.min_threads(encoders=6) == 1
+
+
+def test_max_threads_defaults_to_a_share_per_queue_worker():
+    assert CPUBudget.max_threads() == 10
+
+
+def test_max_threads_setting(monkeypatch):
+    monkeypatch.setattr(Config, "CPU_MAX_THREADS_PER_PROCESS", 4)
+    assert CPUBudget.max_threads() == 4
+    # Never below the minimum share
+    monkeypatch.setattr(Config, "CPU_MAX_THREADS_PER_PROCESS", 1)
+    assert CPUBudget.max_threads() == 2
+
+
+def test_lone_process_is_capped_so_later_ones_start():
+    async def scenario():
+        grants = [await CPUBudget.acquire() for _ in range(4)]
+        return grants, CPUBudget.get_stats()
+
+    grants, stats = asyncio.run(scenario())
+    assert grants == [10, 10, 10, 2]
+    assert stats == {"total": 32, "allocated": 32, "active": 4, "waiting": 0}
+
+
+def test_ladder_gets_the_minimum_share_per_encoder():
+    async def scenario():
+        threads = await CPUBudget.acquire(encoders=6)
+        await CPUBudget.release(threads)
+        return threads
+
+    threads = asyncio.run(scenario())
+    assert threads == 12
+    assert threads // 6 >= Config.FFMPEG_THREADS
+
+
+def test_max_threads_argument_limits_the_grant():
+    async def scenario():
+        return await CPUBudget.acquire(max_threads=3)
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_waits_for_free_cores_and_takes_the_released_share(monkeypatch):
+    monkeypatch.setattr(CPUBudget, "total", 4)
+
+    async def scenario():
+        first = await CPUBudget.acquire()
+        second = await CPUBudget.acquire()
+        waiter = asyncio.create_task(CPUBudget.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert CPUBudget.waiting == 1
+
+        await CPUBudget.release(first)
+        third = await asyncio.wait_for(waiter, timeout=1)
+        await CPUBudget.release(second)
+        await CPUBudget.release(third)
+        return first, second, third
+
+    assert asyncio.run(scenario()) == (2, 2, 2)
+    assert CPUBudget.allocated == 0
+    assert CPUBudget.active == 0
+
+
+def test_reserve_releases_on_error():
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with CPUBudget.reserve() as threads:
+                assert CPUBudget.allocated == threads
+                raise RuntimeError("ffmpeg failed")
+
+    asyncio.run(scenario())
+    assert CPUBudget.allocated == 0
+    assert CPUBudget.active == 0
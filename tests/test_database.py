@@ -0,0 +1,240 @@
+# tests/test_database.py
+import asyncio
+import sqlite3
+import pytest
+from utils.config import Config
+from utils.database import Database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A fresh database file, with none of the class-level caches of other tests"""
+    path = str(tmp_path / "bot_database.db")
+    monkeypatch.setattr(Database, "DB_PATH", path)
+    monkeypatch.setattr(Database, "_pending_users", {})
+    monkeypatch.setattr(Database, "_profiles", {})
+    monkeypatch.setattr(Database, "_bot_settings", {})
+    return path
+
+
+def run(scenario):
+    """Run `scenario` against an open database, closing it afterwards"""
+    async def main():
+        await Database.init_db()
+        try:
+            return await scenario()
+        finally:
+            await Database.close()
+    return asyncio.run(main())
+
+
+async def fetch(sql, params=()):
+    async with Database._reader.execute(sql, params) as cursor:
+        return await cursor.fetchall()
+
+
+def test_registrations_are_buffered_until_flushed(db_path):
+    async def scenario():
+        await Database.add_user(1, "alice", "Alice")
+        await Database.add_user(2, "bob", "Bob")
+        before = await fetch("SELECT user_id FROM users")
+        await Database.flush_users()
+        after = await fetch("SELECT user_id, username, first_name FROM users ORDER BY user_id")
+        return before, after
+
+    before, after = run(scenario)
+    assert before == []
+    assert after == [(1, "alice", "Alice"), (2, "bob", "Bob")]
+
+
+def test_upsert_updates_names_and_keeps_premium_and_join_date(db_path):
+    async def scenario():
+        await Database.add_user(1, "alice", "Alice")
+        await Database.flush_users()
+        await Database.add_premium_user(1, days=30)
+        joined = await fetch("SELECT joined_date FROM users WHERE user_id = 1")
+
+        await Database.add_user(1, "alice_new", "Alice", "Smith")
+        await Database.flush_users()
+        rows = await fetch("SELECT username, last_name, is_premium, joined_date FROM users WHERE user_id = 1")
+        return joined[0][0], rows
+
+    joined, rows = run(scenario)
+    assert rows == [("alice_new", "Smith", 1, joined)]
+
+
+def test_latest_registration_of_a_batch_wins(db_path):
+    async def scenario():
+        await Database.add_user(1, "first")
+        await Database.add_user(1, "second")
+        return await Database.get_all_users(), await fetch("SELECT username FROM users")
+
+    users, names = run(scenario)
+    assert users == [1]
+    assert names == [("second",)]
+
+
+def test_full_batch_is_written_inline(db_path, monkeypatch):
+    monkeypatch.setattr(Config, "USER_FLUSH_ROWS", 3)
+    monkeypatch.setattr(Config, "USER_FLUSH_INTERVAL_MS", 60_000)
+
+    async def scenario():
+        for user_id in range(3):
+            await Database.add_user(user_id)
+        return Database._pending_users, await fetch("SELECT COUNT(*) FROM users")
+
+    pending, count = run(scenario)
+    assert pending == {}
+    assert count == [(3,)]
+
+
+def test_flusher_writes_after_the_interval(db_path, monkeypatch):
+    monkeypatch.setattr(Config, "USER_FLUSH_INTERVAL_MS", 10)
+
+    async def scenario():
+        await Database.add_user(1)
+        await asyncio.sleep(0.2)
+        return await fetch("SELECT user_id FROM users")
+
+    assert run(scenario) == [(1,)]
+
+
+def test_close_writes_pending_registrations(db_path, monkeypatch):
+    monkeypatch.setattr(Config, "USER_FLUSH_INTERVAL_MS", 60_000)
+
+    async def scenario():
+        await Database.add_user(1, "alice")
+
+    run(scenario)
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT user_id, username FROM users").fetchall() == [(1, "alice")]
+
+
+def test_failed_flush_keeps_the_rows_for_the_next_one(db_path, monkeypatch):
+    async def scenario():
+        write = Database._write
+
+        async def failing(operation):
+            raise sqlite3.OperationalError("database is locked")
+
+        await Database.add_user(1, "alice")
+        monkeypatch.setattr(Database, "_write", failing)
+        await Database.flush_users()
+        kept = dict(Database._pending_users)
+        monkeypatch.setattr(Database, "_write", write)
+        await Database.flush_users()
+        return kept, await fetch("SELECT user_id FROM users")
+
+    kept, users = run(scenario)
+    assert list(kept) == [1]
+    assert users == [(1,)]
+
+
+def user_version(db_path):
+    with sqlite3.connect(db_path) as db:
+        return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def columns(db_path, table):
+    with sqlite3.connect(db_path) as db:
+        return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+
+def schema(db_path, kind):
+    with sqlite3.connect(db_path) as db:
+        return {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+async def noop():
+    pass
+
+
+def test_new_database_gets_every_migration(db_path):
+    run(noop)
+    assert user_version(db_path) == len(Database.MIGRATIONS)
+    assert {"payload", "attempts", "run_after", "download_size", "output_size"} <= set(columns(db_path, "queue"))
+    assert {"idx_queue_status", "idx_queue_user_status", "idx_rendition_cache_last_used"} <= schema(db_path, "index")
+
+
+def test_database_from_before_migrations_is_upgraded_in_place(db_path):
+    with sqlite3.connect(db_path) as db:
+        # The schema the bot created before it versioned its database
+        db.execute("""
+            CREATE TABLE users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_premium INTEGER DEFAULT 0,
+                premium_expiry TIMESTAMP
+            )
+        """)
+        db.execute("""
+            CREATE TABLE queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        db.execute("INSERT INTO users (user_id, username, is_premium) VALUES (1, 'alice', 1)")
+        db.execute("INSERT INTO queue (user_id, file_id, task_type, status) VALUES (1, 'f', 'encode', 'done')")
+
+    async def scenario():
+        return (
+            await fetch("SELECT user_id, username, is_premium FROM users"),
+            await fetch("SELECT user_id, task_type, status, attempts FROM queue")
+        )
+
+    users, queue = run(scenario)
+    assert users == [(1, "alice", 1)]
+    assert queue == [(1, "encode", "done", 0)]
+    assert user_version(db_path) == len(Database.MIGRATIONS)
+
+
+def test_migrations_run_once(db_path, monkeypatch):
+    calls = []
+
+    async def counted(db):
+        calls.append(1)
+
+    monkeypatch.setattr(Database, "MIGRATIONS", Database.MIGRATIONS + [counted])
+    run(noop)
+    run(noop)
+    assert calls == [1]
+    assert user_version(db_path) == len(Database.MIGRATIONS)
+
+
+def test_failed_migration_is_rolled_back_and_retried(db_path, monkeypatch):
+    shipped = list(Database.MIGRATIONS)
+    run(noop)
+
+    async def broken(db):
+        await db.execute("CREATE TABLE half_done (id INTEGER)")
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(Database, "MIGRATIONS", shipped + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(Database.init_db())
+    assert user_version(db_path) == len(shipped)
+    assert "half_done" not in schema(db_path, "table")
+
+    async def fixed(db):
+        await db.execute("CREATE TABLE half_done (id INTEGER)")
+
+    monkeypatch.setattr(Database, "MIGRATIONS", shipped + [fixed])
+    run(noop)
+    assert user_version(db_path) == len(shipped) + 1
+
+
+def test_newer_schema_is_left_alone(db_path):
+    with sqlite3.connect(db_path) as db:
+        db.execute("CREATE TABLE bot_settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        db.execute(f"PRAGMA user_version = {len(Database.MIGRATIONS) + 1}")
+
+    run(noop)
+    assert user_version(db_path) == len(Database.MIGRATIONS) + 1
+    assert "queue" not in schema(db_path, "table")
@@ -0,0 +1,98 @@
+# tests/test_disk_budget.py
+import os
+import shutil
+from collections import namedtuple
+import pytest
+from utils.config import Config
+from utils.disk_budget import DiskBudget
+from utils.source_cache import SourceCache
+
+MB = 1024 * 1024
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    """A 100 MB disk holding DOWNLOAD_DIR and UPLOAD_DIR, cached sources use it up"""
+    monkeypatch.setattr(Config, "DOWNLOAD_DIR", str(tmp_path / "downloads"))
+    monkeypatch.setattr(Config, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(Config, "DISK_FREE_MARGIN_MB", 10)
+    monkeypatch.setattr(Config, "SOURCE_CACHE_MAX_SIZE_MB", 1024)
+    monkeypatch.setattr(Config, "STAGING_DIR", "")
+    monkeypatch.setattr(DiskBudget, "reserved", {})
+    monkeypatch.setattr(DiskBudget, "active", 0)
+    monkeypatch.setattr(SourceCache, "_refs", {})
+
+    def disk_usage(path):
+        try:
+            used = sum(os.path.getsize(entry.path) for entry in os.scandir(SourceCache.cache_dir()))
+        except FileNotFoundError:
+            used = 0
+        return Usage(100 * MB, used, 100 * MB - used)
+
+    monkeypatch.setattr(shutil, "disk_usage", disk_usage)
+    return tmp_path
+
+
+def cache_source(name, size):
+    os.makedirs(SourceCache.cache_dir(), exist_ok=True)
+    path = os.path.join(SourceCache.cache_dir(), name)
+    with open(path, "wb") as f:
+        f.truncate(size)
+    return path
+
+
+def test_reserves_download_and_output_on_the_same_disk(disk):
+    reservation = DiskBudget.try_reserve(30 * MB, 20 * MB)
+    assert list(reservation.values()) == [50 * MB]
+    assert DiskBudget.active == 1
+    assert DiskBudget.free_space(Config.DOWNLOAD_DIR) == 50 * MB
+
+    DiskBudget.release(reservation)
+    assert DiskBudget.active == 0
+    assert DiskBudget.free_space(Config.DOWNLOAD_DIR) == 100 * MB
+
+
+def test_job_waits_while_running_jobs_hold_the_space(disk):
+    first = DiskBudget.try_reserve(60 * MB)
+    assert DiskBudget.try_reserve(40 * MB) is None
+    assert DiskBudget.active == 1
+
+    DiskBudget.release(first)
+    assert DiskBudget.try_reserve(40 * MB) is not None
+
+
+def test_job_alone_runs_even_if_it_does_not_fit(disk):
+    assert DiskBudget.try_reserve(200 * MB) is not None
+
+
+def test_unused_cached_sources_make_room(disk):
+    old = cache_source("old.mp4", 40 * MB)
+    running = DiskBudget.try_reserve(30 * MB)
+    assert DiskBudget.try_reserve(25 * MB) is not None
+    assert not os.path.exists(old)
+    DiskBudget.release(running)
+
+
+def test_cached_sources_in_use_are_kept(disk):
+    in_use = cache_source("in_use.mp4", 40 * MB)
+    SourceCache._refs[in_use] = 1
+    running = DiskBudget.try_reserve(30 * MB)
+    assert DiskBudget.try_reserve(25 * MB) is None
+    assert os.path.exists(in_use)
+    DiskBudget.release(running)
+
+
+def test_staging_dir(disk, monkeypatch):
+    fallback = str(disk / "work")
+    assert DiskBudget.staging_dir(fallback, MB) == fallback
+
+    staging = str(disk / "shm")
+    monkeypatch.setattr(Config, "STAGING_DIR", staging)
+    monkeypatch.setattr(Config, "STAGING_MAX_FILE_MB", 8)
+    assert DiskBudget.staging_dir(fallback, MB) == staging
+    assert DiskBudget.staging_dir(fallback, 16 * MB) == fallback
+    # Small files only go to RAM while it has plenty of room
+    assert DiskBudget.staging_dir(fallback, 8 * MB) == staging
+    cache_source("big.mp4", 80 * MB)
+    assert DiskBudget.staging_dir(fallback, 8 * MB) == fallback
@@ -0,0 +1,109 @@
+# tests/test_downloader.py
+import asyncio
+import json
+import os
+import pytest
+from utils.config import Config
+from utils.downloader import ParallelDownloader
+
+CHUNK = 4
+DATA = bytes(range(256)) * 2 + b"tail"
+
+
+class FakeClient:
+    """stream_media over an in-memory file, failing after `fail_after` chunks"""
+
+    def __init__(self, data=DATA, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.sent = 0
+        self.requests = []
+
+    async def stream_media(self, file_id, limit=0, offset=0):
+        self.requests.append((offset, limit))
+        for index in range(offset, offset + limit):
+            if self.fail_after is not None and self.sent >= self.fail_after:
+                raise ConnectionError("connection lost")
+            self.sent += 1
+            await asyncio.sleep(0)
+            yield self.data[index * CHUNK:(index + 1) * CHUNK]
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(ParallelDownloader, "CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(Config, "DOWNLOAD_PARTS", 3)
+    monkeypatch.setattr(Config, "DOWNLOAD_PARTS_MIN_SIZE_MB", 0)
+
+
+def download(client, path):
+    return asyncio.run(ParallelDownloader.download(client, "file_id", path, len(DATA)))
+
+
+def test_plan_covers_every_chunk_once():
+    ranges = ParallelDownloader.plan(len(DATA))
+    chunks = -(-len(DATA) // CHUNK)
+    assert len(ranges) == 3
+    assert sum(limit for _, limit in ranges) == chunks
+    assert [offset for offset, _ in ranges] == [0, ranges[0][1], ranges[0][1] + ranges[1][1]]
+    assert max(limit for _, limit in ranges) - min(limit for _, limit in ranges) <= 1
+
+
+def test_plan_downloads_small_files_in_one_part(monkeypatch):
+    monkeypatch.setattr(Config, "DOWNLOAD_PARTS_MIN_SIZE_MB", 1)
+    assert ParallelDownloader.plan(len(DATA)) == [(0, -(-len(DATA) // CHUNK))]
+
+
+def test_download_in_parts(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    assert download(FakeClient(), path) == path
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(f"{path}.temp")
+    assert not os.path.exists(f"{path}.temp.parts")
+
+
+def test_interrupted_download_resumes_from_the_sidecar(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    with pytest.raises(ConnectionError):
+        download(FakeClient(fail_after=40), path)
+
+    assert not os.path.exists(path)
+    assert ParallelDownloader.has_partial(path)
+    with open(f"{path}.temp.parts") as f:
+        state = json.load(f)
+    done = sum(chunks for _, _, chunks in state['ranges'])
+    assert state['file_size'] == len(DATA)
+    assert 0 < done <= 40
+
+    client = FakeClient()
+    download(client, path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    # Only the chunks missing from the sidecar were fetched again
+    assert client.sent == -(-len(DATA) // CHUNK) - done
+    assert not ParallelDownloader.has_partial(path)
+
+
+def test_sidecar_of_another_file_is_ignored(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    temp_path = f"{path}.temp"
+    with open(temp_path, "wb") as f:
+        f.write(b"\0" * 10)
+    ParallelDownloader._save_state(temp_path, 10, [[0, 3, 3]])
+    assert ParallelDownloader._load_state(temp_path, len(DATA)) is None
+
+    client = FakeClient()
+    download(client, path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert client.sent == -(-len(DATA) // CHUNK)
+
+
+def test_corrupt_sidecar_is_ignored(tmp_path):
+    temp_path = str(tmp_path / "video.mp4.temp")
+    with open(temp_path, "wb") as f:
+        f.truncate(len(DATA))
+    with open(f"{temp_path}.parts", "w") as f:
+        f.write("{not json")
+    assert ParallelDownloader._load_state(temp_path, len(DATA)) is None
@@ -0,0 +1,82 @@
+# tests/test_ffmpeg_progress.py
+import asyncio
+import pytest
+from utils.ffmpeg_progress import FFmpegProgress
+
+
+async def lines(text):
+    """Fake the stdout stream of `ffmpeg -progress pipe:1`"""
+    for line in text.strip().splitlines():
+        yield (line.strip() + "\n").encode()
+
+
+def block(out_time_us, progress="continue", speed="2.0x", fps="48.0"):
+    return f"""
+        frame=100
+        fps={fps}
+        bitrate= 1024.0kbits/s
+        total_size=1048576
+        out_time_us={out_time_us}
+        out_time=00:00:00.000000
+        speed={speed}
+        progress={progress}
+    """
+
+
+def read(text, duration=100, interval=0):
+    reports = []
+
+    async def callback(**stats):
+        reports.append(stats)
+
+    asyncio.run(FFmpegProgress(duration, callback, interval).read(lines(text)))
+    return reports
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("00:01:30.500000", 90.5),
+    ("01:00:00", 3600),
+    ("12.25", 12.25),
+    ("N/A", 0.0),
+    ("", 0.0),
+])
+def test_parse_time(value, seconds):
+    assert FFmpegProgress.parse_time(value) == seconds
+
+
+def test_reports_every_block():
+    reports = read(block(25_000_000) + block(50_000_000) + block(100_000_000, "end"))
+    assert [r["current"] for r in reports] == [25, 50, 100]
+    first = reports[0]
+    assert first["percentage"] == 25
+    assert first["speed"] == 2.0
+    assert first["eta"] == 37.5
+    assert first["fps"] == 48.0
+    assert first["size"] == 1048576
+    assert first["bitrate"] == 1024.0
+    assert first["total"] == 100
+
+
+def test_throttles_updates_but_always_reports_the_end():
+    reports = read(block(25_000_000) + block(50_000_000) + block(100_000_000, "end"), interval=3600)
+    assert [r["current"] for r in reports] == [25, 100]
+
+
+def test_falls_back_to_out_time():
+    text = block("N/A").replace("out_time=00:00:00.000000", "out_time=00:00:40.000000")
+    assert read(text)[0]["current"] == 40
+
+
+def test_clamps_to_the_duration():
+    assert read(block(150_000_000, "end"))[0]["percentage"] == 100
+
+
+def test_unknown_values_count_as_zero():
+    reports = read(block(10_000_000, speed="N/A", fps="N/A"))
+    assert reports[0]["fps"] == 0
+    # Without FFmpeg's speed the rate is measured from the elapsed time
+    assert reports[0]["speed"] > 0
+
+
+def test_no_reports_without_a_duration():
+    assert read(block(10_000_000, "end"), duration=0) == []
@@ -0,0 +1,61 @@
+# tests/test_rendition_cache.py
+import pytest
+from utils.config import Config
+from utils.rendition_cache import RenditionCache
+
+SETTINGS = {
+    "codec": "libx264",
+    "preset": "medium",
+    "crf": 28,
+    "audio_bitrate": "128k",
+    "adaptive_crf": False
+}
+NO_WATERMARK = {"text": None, "image": None}
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(Config, "RENDITION_CACHE", True)
+
+
+def key(file_unique_id="AgADxyz", quality="720p", settings=SETTINGS, watermark=NO_WATERMARK, media_type="video"):
+    return RenditionCache.make_key(file_unique_id, quality, settings, watermark, media_type)
+
+
+def test_same_parameters_give_the_same_key():
+    assert key() == key()
+    assert len(key()) == 64
+
+
+@pytest.mark.parametrize("changes", [
+    {"file_unique_id": "AgADother"},
+    {"quality": "480p"},
+    {"media_type": "document"},
+    {"settings": dict(SETTINGS, codec="libx265")},
+    {"settings": dict(SETTINGS, preset="fast")},
+    {"settings": dict(SETTINGS, crf=23)},
+    {"settings": dict(SETTINGS, audio_bitrate="192k")},
+    {"settings": dict(SETTINGS, adaptive_crf=True)},
+    {"watermark": {"text": "@channel", "image": None}},
+    {"watermark": {"text": None, "image": "/thumbs/wm.png"}},
+])
+def test_every_encode_parameter_changes_the_key(changes):
+    assert key(**changes) != key()
+
+
+def test_watermark_fingerprint():
+    assert RenditionCache.watermark_fingerprint(NO_WATERMARK) == "none"
+    assert RenditionCache.watermark_fingerprint({}) == "none"
+    text = RenditionCache.watermark_fingerprint({"text": "@a", "image": None})
+    assert text == RenditionCache.watermark_fingerprint({"text": "@a"})
+    assert text != RenditionCache.watermark_fingerprint({"text": "@b"})
+
+
+def test_no_key_without_a_file_unique_id():
+    assert key(file_unique_id=None) is None
+    assert key(file_unique_id="") is None
+
+
+def test_no_key_when_the_cache_is_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "RENDITION_CACHE", False)
+    assert key() is None
@@ -12,6 +12,17 @@ class Config:
     
     # Database
     DATABASE_URL = os.environ.get("DATABASE_URL", "/app/data/bot_database.db")
+    # Milliseconds a connection waits for a lock before giving up
+    DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT", "5000"))
+    DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "8192"))
+    # Writes committed together in one transaction
+    DB_WRITE_BATCH = int(os.environ.get("DB_WRITE_BATCH", "100"))
+    # /start registrations are written in batches, after this many milliseconds or rows
+    USER_FLUSH_INTERVAL_MS = int(os.environ.get("USER_FLUSH_INTERVAL_MS", "500"))
+    USER_FLUSH_ROWS = int(os.environ.get("USER_FLUSH_ROWS", "200"))
+    # Seconds a user's settings, watermark and thumbnail stay cached (0 = no cache)
+    USER_PROFILE_TTL = int(os.environ.get("USER_PROFILE_TTL", "300"))
+    USER_PROFILE_CACHE_SIZE = int(os.environ.get("USER_PROFILE_CACHE_SIZE", "10000"))
     
     # Admin settings
     ADMIN_IDS = [int(x) for x in os.environ.get("ADMIN_IDS", "0").split()]
@@ -52,13 +63,87 @@ class Config:
     PREMIUM_USERS = []
     
     # Queue settings
+    # Tasks a single user can have waiting or running
     MAX_QUEUE_SIZE = int(os.environ.get("MAX_QUEUE_SIZE", "10"))
+    # Tasks processed at the same time
+    QUEUE_WORKERS = int(os.environ.get("QUEUE_WORKERS", "3"))
+    # Tasks interrupted by this many crashes/restarts are given up
+    QUEUE_MAX_ATTEMPTS = int(os.environ.get("QUEUE_MAX_ATTEMPTS", "3"))
+    
+    # Rendition cache (resend previously uploaded encodes by file_id)
+    RENDITION_CACHE = os.environ.get("RENDITION_CACHE", "True").lower() == "true"
+    RENDITION_CACHE_MAX_AGE_DAYS = int(os.environ.get("RENDITION_CACHE_MAX_AGE_DAYS", "30"))
+    RENDITION_CACHE_MAX_ENTRIES = int(os.environ.get("RENDITION_CACHE_MAX_ENTRIES", "5000"))
+    
+    # Parallel downloads (large files are fetched as several parts at once)
+    DOWNLOAD_PARTS = int(os.environ.get("DOWNLOAD_PARTS", "4"))
+    DOWNLOAD_PARTS_MIN_SIZE_MB = int(os.environ.get("DOWNLOAD_PARTS_MIN_SIZE_MB", "20"))
+    # Attempts per download, each one resumes from the completed chunks
+    DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "3"))
+    
+    # Uploads (large files are sent as several parts at once, failed parts are retried)
+    UPLOAD_PARTS = int(os.environ.get("UPLOAD_PARTS", "4"))
+    UPLOAD_PART_RETRIES = int(os.environ.get("UPLOAD_PART_RETRIES", "5"))
+    # Uploads that still fail are queued again after a delay (seconds)
+    UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", "3"))
+    UPLOAD_RETRY_DELAY = int(os.environ.get("UPLOAD_RETRY_DELAY", "300"))
+    # Parts held in memory between reading and sending (512 KB each)
+    UPLOAD_BUFFER_PARTS = int(os.environ.get("UPLOAD_BUFFER_PARTS", "16"))
+    # /Rename relays the download straight into the upload, without a local copy
+    RENAME_RELAY = os.environ.get("RENAME_RELAY", "True").lower() == "true"
+    
+    # Disk admission (queued tasks start once their download and output fit on disk)
+    DISK_FREE_MARGIN_MB = int(os.environ.get("DISK_FREE_MARGIN_MB", "1024"))
+    # Seconds a task that didn't fit waits in the queue before it is tried again
+    DISK_RETRY_DELAY = int(os.environ.get("DISK_RETRY_DELAY", "30"))
+    # RAM-backed directory for small outputs (empty = always use the disk)
+    STAGING_DIR = os.environ.get("STAGING_DIR", "/dev/shm/encoder_bot" if os.path.isdir("/dev/shm") else "")
+    STAGING_MAX_FILE_MB = int(os.environ.get("STAGING_MAX_FILE_MB", "64"))
+    
+    # Job workspaces (removed when the job ends, orphans are swept)
+    WORKSPACE_MAX_AGE_HOURS = int(os.environ.get("WORKSPACE_MAX_AGE_HOURS", "24"))
+    WORKSPACE_SWEEP_INTERVAL = int(os.environ.get("WORKSPACE_SWEEP_INTERVAL", "3600"))
+    
+    # /mediainfo probes the start and end of a file before falling back to a full download
+    PROBE_HEAD_MB = int(os.environ.get("PROBE_HEAD_MB", "2"))
+    PROBE_TAIL_MB = int(os.environ.get("PROBE_TAIL_MB", "2"))
+    
+    # Source cache (downloaded files reused by later operations on the same file)
+    SOURCE_CACHE_MAX_SIZE_MB = int(os.environ.get("SOURCE_CACHE_MAX_SIZE_MB", "5120"))
+    
+    # /all ladder pipeline (each stage is uploaded while the next one encodes).
+    # Every stage is a separate FFmpeg process that decodes the whole source
+    # again, so more than 1 stage trades extra decodes for upload overlap.
+    LADDER_STAGES = int(os.environ.get("LADDER_STAGES", "1"))
+    LADDER_UPLOAD_WORKERS = int(os.environ.get("LADDER_UPLOAD_WORKERS", "1"))
+    
+    # Stream ingest (pipe single-quality encodes into FFmpeg while they download)
+    STREAM_INGEST = os.environ.get("STREAM_INGEST", "True").lower() == "true"
     
     # Progress update interval (seconds)
     PROGRESS_UPDATE_INTERVAL = int(os.environ.get("PROGRESS_UPDATE_INTERVAL", "5"))
     
     # FFmpeg settings
+    # Cores shared by all FFmpeg processes (0 = every core on the machine)
+    CPU_CORES = int(os.environ.get("CPU_CORES", "0"))
+    # Smallest thread share a single FFmpeg process is started with
     FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", "2"))
+    # Largest thread share a single FFmpeg process is started with (0 = cores / QUEUE_WORKERS)
+    CPU_MAX_THREADS_PER_PROCESS = int(os.environ.get("CPU_MAX_THREADS_PER_PROCESS", "0"))
+    
+    # Adaptive CRF (sample encodes pick a CRF per rendition to hit its target bitrate)
+    ADAPTIVE_CRF = os.environ.get("ADAPTIVE_CRF", "False").lower() == "true"
+    ADAPTIVE_CRF_SAMPLES = int(os.environ.get("ADAPTIVE_CRF_SAMPLES", "3"))
+    ADAPTIVE_CRF_SAMPLE_DURATION = int(os.environ.get("ADAPTIVE_CRF_SAMPLE_DURATION", "4"))
+    ADAPTIVE_CRF_MIN = int(os.environ.get("ADAPTIVE_CRF_MIN", "18"))
+    ADAPTIVE_CRF_MAX = int(os.environ.get("ADAPTIVE_CRF_MAX", "36"))
+    
+    # Segmented encoding (long videos are split at keyframes and encoded in parallel)
+    SEGMENT_ENCODING = os.environ.get("SEGMENT_ENCODING", "True").lower() == "true"
+    SEGMENT_MIN_DURATION = int(os.environ.get("SEGMENT_MIN_DURATION", "600"))
+    SEGMENT_DURATION = int(os.environ.get("SEGMENT_DURATION", "60"))
+    # Chunks encoded at once (0 = as many FFMPEG_THREADS shares as fit the per-process cap)
+    SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", "0"))
     
     @staticmethod
     def create_dirs():
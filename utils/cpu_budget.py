@@ -0,0 +1,95 @@
+# utils/cpu_budget.py
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+from utils.config import Config
+
+class CPUBudget:
+    """Share the CPU cores between all running FFmpeg processes
+
+    Every process asks for a thread count before it starts. It is admitted
+    once enough cores are free and gets an even share of the cores between
+    everything running or waiting, so a busy bot hands out smaller shares
+    instead of oversubscribing. FFmpeg can't change its thread count once
+    running, so shares are rebalanced as processes are admitted: no process
+    gets more than max_threads(), which leaves room for later processes to
+    start, and a process running several encoders gets the minimum share for
+    each of them.
+    """
+
+    total = Config.CPU_CORES or os.cpu_count() or 1
+    allocated = 0
+    active = 0
+    waiting = 0
+    _condition = None
+
+    @staticmethod
+    def _get_condition() -> asyncio.Condition:
+        if CPUBudget._condition is None:
+            CPUBudget._condition = asyncio.Condition()
+        return CPUBudget._condition
+
+    @staticmethod
+    def min_threads(encoders: int = 1) -> int:
+        """Smallest share a process running `encoders` encoders is started with"""
+        return max(1, min(Config.FFMPEG_THREADS * max(1, encoders), CPUBudget.total))
+
+    @staticmethod
+    def max_threads(encoders: int = 1) -> int:
+        """Largest share a process running `encoders` encoders is started with"""
+        cap = Config.CPU_MAX_THREADS_PER_PROCESS or CPUBudget.total // max(1, Config.QUEUE_WORKERS)
+        return max(CPUBudget.min_threads(encoders), min(cap, CPUBudget.total))
+
+    @staticmethod
+    async def acquire(max_threads: Optional[int] = None, encoders: int = 1) -> int:
+        """Wait for free cores and return the number of threads granted"""
+        condition = CPUBudget._get_condition()
+        minimum = CPUBudget.min_threads(encoders)
+
+        async with condition:
+            CPUBudget.waiting += 1
+            try:
+                await condition.wait_for(lambda: CPUBudget.total - CPUBudget.allocated >= minimum)
+            finally:
+                CPUBudget.waiting -= 1
+
+            # Even share between running processes, waiting ones and this one
+            demand = CPUBudget.active + CPUBudget.waiting + 1
+            share = max(minimum, min(CPUBudget.total // demand, CPUBudget.max_threads(encoders)))
+            threads = min(share, CPUBudget.total - CPUBudget.allocated)
+            if max_threads:
+                threads = max(1, min(threads, max_threads))
+
+            CPUBudget.allocated += threads
+            CPUBudget.active += 1
+            return threads
+
+    @staticmethod
+    async def release(threads: int):
+        """Return threads to the budget and wake up waiting processes"""
+        condition = CPUBudget._get_condition()
+        async with condition:
+            CPUBudget.allocated -= threads
+            CPUBudget.active -= 1
+            condition.notify_all()
+
+    @staticmethod
+    @asynccontextmanager
+    async def reserve(max_threads: Optional[int] = None, encoders: int = 1):
+        """Hold a share of the CPU for the duration of the block"""
+        threads = await CPUBudget.acquire(max_threads, encoders)
+        try:
+            yield threads
+        finally:
+            await CPUBudget.release(threads)
+
+    @staticmethod
+    def get_stats() -> dict:
+        """Get current allocation"""
+        return {
+            "total": CPUBudget.total,
+            "allocated": CPUBudget.allocated,
+            "active": CPUBudget.active,
+            "waiting": CPUBudget.waiting
+        }
@@ -1,12 +1,145 @@
 # utils/database.py
 import aiosqlite
+import asyncio
 import json
+import logging
 import os
-from typing import Optional, Dict, Any, List
+import time
+from typing import Optional, Dict, Any, List, Callable, Tuple, TypedDict
 from utils.config import Config
 
+logger = logging.getLogger(__name__)
+
+class EncodeSettings(TypedDict):
+    """Encoder settings configured by admins"""
+    codec: str
+    preset: str
+    crf: int
+    audio_bitrate: str
+    adaptive_crf: bool
+
+class UserProfile(TypedDict):
+    """Per-user data every encode needs"""
+    settings: Dict[str, Any]
+    watermark: Dict[str, Optional[str]]
+    thumbnail: Optional[str]
+
 class Database:
+    """SQLite storage shared by the whole bot
+
+    init_db opens two long-lived connections in WAL mode: one for reads and
+    one for writes. Reads run straight on the read connection and are never
+    blocked by writes. Writes are queued to a single writer task that runs
+    everything waiting in one transaction, each write in its own savepoint,
+    and commits once for the whole batch.
+    """
     DB_PATH = Config.DATABASE_URL
+    _reader = None
+    _writer = None
+    _writes = None
+    _writer_task = None
+    # bot_settings, loaded by init_db and kept up to date by set_bot_setting
+    _bot_settings: Dict[str, str] = {}
+    _encode_settings: Optional[EncodeSettings] = None
+    # User profiles as user_id -> (expiry, profile)
+    _profiles: Dict[int, Tuple[float, UserProfile]] = {}
+    _profile_generation = 0
+    # Registrations waiting for the next batched upsert, user_id -> names
+    _pending_users: Dict[int, Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+    _users_ready = None
+    _users_flusher = None
+    
+    @staticmethod
+    async def _connect():
+        """Open a connection with the pragmas every connection needs"""
+        db = await aiosqlite.connect(Database.DB_PATH, isolation_level=None)
+        await db.execute("PRAGMA journal_mode = WAL")
+        # WAL keeps the database consistent with NORMAL, only the last commits can be lost on power failure
+        await db.execute("PRAGMA synchronous = NORMAL")
+        await db.execute(f"PRAGMA busy_timeout = {Config.DB_BUSY_TIMEOUT}")
+        await db.execute(f"PRAGMA cache_size = -{Config.DB_CACHE_SIZE_KB}")
+        await db.execute("PRAGMA temp_store = MEMORY")
+        return db
+    
+    @staticmethod
+    async def _write(operation: Callable) -> Any:
+        """Run `operation(db)` on the writer connection and return its result once committed"""
+        future = asyncio.get_running_loop().create_future()
+        await Database._writes.put((operation, future))
+        return await future
+    
+    @staticmethod
+    async def _writer_loop():
+        """Run queued writes in batches, one commit per batch"""
+        db = Database._writer
+        running = True
+        while running:
+            batch = [await Database._writes.get()]
+            while len(batch) < Config.DB_WRITE_BATCH and not Database._writes.empty():
+                batch.append(Database._writes.get_nowait())
+            
+            # None asks the writer to stop once the writes before it are done
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+                if not batch:
+                    break
+            
+            results = []
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                for operation, future in batch:
+                    # A failing write only rolls back itself, not the rest of the batch
+                    await db.execute("SAVEPOINT write")
+                    try:
+                        results.append((future, await operation(db), None))
+                        await db.execute("RELEASE write")
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO write")
+                        await db.execute("RELEASE write")
+                        results.append((future, None, e))
+                await db.commit()
+            except Exception as e:
+                logger.exception("Database write batch failed")
+                try:
+                    await db.rollback()
+                except Exception:
+                    pass
+                results = [(future, None, e) for _, future in batch]
+            
+            for future, result, error in results:
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+    
+    @staticmethod
+    async def close():
+        """Finish the queued writes and close the connections"""
+        if Database._users_flusher:
+            Database._users_flusher.cancel()
+            await asyncio.gather(Database._users_flusher, return_exceptions=True)
+            Database._users_flusher = None
+            await Database.flush_users()
+        
+        if Database._writer_task:
+            await Database._writes.put(None)
+            await Database._writer_task
+            Database._writer_task = None
+        
+        if Database._writer:
+            # Refresh the query planner statistics the indexes rely on
+            try:
+                await Database._writer.execute("PRAGMA optimize")
+            except Exception as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
+        
+        for db in (Database._reader, Database._writer):
+            if db:
+                await db.close()
+        Database._reader = Database._writer = None
     
     @staticmethod
     async def init_db():
@@ -20,297 +153,646 @@ class Database:
         if not db_dir:
             Database.DB_PATH = os.path.join(os.getcwd(), Database.DB_PATH)
         
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            # Users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_premium INTEGER DEFAULT 0,
-                    premium_expiry TIMESTAMP
-                )
-            """)
-            
-            # Thumbnails table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS thumbnails (
-                    user_id INTEGER PRIMARY KEY,
-                    file_id TEXT NOT NULL
-                )
-            """)
-            
-            # Watermarks table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS watermarks (
-                    user_id INTEGER PRIMARY KEY,
-                    watermark_text TEXT,
-                    watermark_image TEXT
-                )
-            """)
-            
-            # User settings table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id INTEGER PRIMARY KEY,
-                    upload_as_doc INTEGER DEFAULT 0,
-                    spoiler_enabled INTEGER DEFAULT 0,
-                    preferred_quality TEXT DEFAULT '720p'
-                )
-            """)
-            
-            # Force sub channels table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS fsub_channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_id INTEGER NOT NULL UNIQUE,
-                    channel_username TEXT
-                )
-            """)
-            
-            # Bot settings table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bot_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-            """)
-            
-            # Queue table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS queue (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    file_id TEXT NOT NULL,
-                    task_type TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            await db.commit()
+        db = await Database._connect()
+        try:
+            await Database._migrate(db)
+        except BaseException:
+            await db.close()
+            raise
+        
+        Database._writer = db
+        Database._reader = await Database._connect()
+        async with Database._reader.execute("SELECT key, value FROM bot_settings") as cursor:
+            Database._bot_settings = {row[0]: row[1] async for row in cursor}
+        Database._encode_settings = None
+        Database._writes = asyncio.Queue()
+        Database._writer_task = asyncio.create_task(Database._writer_loop())
+        Database._users_ready = asyncio.Event()
+        Database._users_flusher = asyncio.create_task(Database._users_flush_loop())
+    
+    @staticmethod
+    async def _migrate(db):
+        """Bring the schema up to date, one transaction per migration
+        
+        PRAGMA user_version holds the number of migrations applied. Databases
+        created before migrations existed start at 0, so the first migrations
+        only create what is missing.
+        """
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        
+        if version > len(Database.MIGRATIONS):
+            logger.warning(f"Database schema version {version} is newer than this bot ({len(Database.MIGRATIONS)})")
+            return
+        
+        for number, migration in enumerate(Database.MIGRATIONS[version:], start=version + 1):
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                await migration(db)
+                # user_version is part of the transaction, so a failed migration is retried on the next start
+                await db.execute(f"PRAGMA user_version = {number}")
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+            logger.info(f"Database migrated to schema version {number}")
+    
+    @staticmethod
+    async def _add_columns(db, table: str, columns: List[Tuple[str, str]]):
+        """Add the columns a table doesn't have yet"""
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            existing = [row[1] async for row in cursor]
+        for column, definition in columns:
+            if column not in existing:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    @staticmethod
+    async def _migration_1_tables(db):
+        """Create the tables"""
+        # Users table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_premium INTEGER DEFAULT 0,
+                premium_expiry TIMESTAMP
+            )
+        """)
+        
+        # Thumbnails table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                user_id INTEGER PRIMARY KEY,
+                file_id TEXT NOT NULL
+            )
+        """)
+        
+        # Watermarks table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                user_id INTEGER PRIMARY KEY,
+                watermark_text TEXT,
+                watermark_image TEXT
+            )
+        """)
+        
+        # User settings table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                upload_as_doc INTEGER DEFAULT 0,
+                spoiler_enabled INTEGER DEFAULT 0,
+                preferred_quality TEXT DEFAULT '720p'
+            )
+        """)
+        
+        # Force sub channels table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS fsub_channels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER NOT NULL UNIQUE,
+                channel_username TEXT
+            )
+        """)
+        
+        # Bot settings table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS bot_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        
+        # Queue table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Rendition cache table
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS rendition_cache (
+                cache_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                file_size INTEGER DEFAULT 0,
+                hits INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+    @staticmethod
+    async def _migration_2_queue_jobs(db):
+        """Columns needed to run queued jobs"""
+        await Database._add_columns(db, "queue", [
+            ("chat_id", "INTEGER"),
+            ("message_id", "INTEGER"),
+            ("status_message_id", "INTEGER"),
+            ("payload", "TEXT DEFAULT '{}'"),
+            ("attempts", "INTEGER DEFAULT 0"),
+            ("error", "TEXT"),
+            ("updated_at", "TIMESTAMP"),
+            ("run_after", "TIMESTAMP"),
+            ("download_size", "INTEGER DEFAULT 0"),
+            ("output_size", "INTEGER DEFAULT 0")
+        ])
+    
+    @staticmethod
+    async def _migration_3_indexes(db):
+        """Indexes for the queries that run on every task, /start and admin command"""
+        # Queue counts, claim_next_job and requeueing filter on status and walk ids
+        # in order; run_after is in the index so due tasks are found without the table
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_queue_status ON queue(status, id, run_after)")
+        # Per-user queue limit
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_queue_user_status ON queue(user_id, status)")
+        # Premium listings and expiry checks
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_users_premium ON users(is_premium, premium_expiry)")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_premium_expiry ON users(premium_expiry) "
+            "WHERE premium_expiry IS NOT NULL"
+        )
+        # Rendition cache eviction by age and recency
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_rendition_cache_last_used ON rendition_cache(last_used)")
+        await db.execute("ANALYZE")
+    
+    # Applied in order, append new migrations at the end and never change shipped ones
+    MIGRATIONS = [
+        _migration_1_tables,
+        _migration_2_queue_jobs,
+        _migration_3_indexes
+    ]
     
     # User operations
     @staticmethod
     async def add_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
-        """Add or update user in database"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
+        """Add or update user in database
+        
+        Registrations are buffered and written in batches, at the latest
+        USER_FLUSH_INTERVAL_MS later.
+        """
+        Database._pending_users[user_id] = (username, first_name, last_name)
+        if len(Database._pending_users) >= Config.USER_FLUSH_ROWS:
+            await Database.flush_users()
+        elif len(Database._pending_users) == 1:
+            # The first registration of a batch wakes the flusher
+            Database._users_ready.set()
+    
+    @staticmethod
+    async def flush_users():
+        """Write the buffered registrations in one upsert"""
+        if not Database._pending_users:
+            return
+        
+        users = Database._pending_users
+        Database._pending_users = {}
+        rows = [(user_id, *names) for user_id, names in users.items()]
+        try:
+            # Joined date and premium status stay, and unchanged rows aren't rewritten
+            await Database._write(lambda db: db.executemany("""
+                INSERT INTO users (user_id, username, first_name, last_name)
                 VALUES (?, ?, ?, ?)
-            """, (user_id, username, first_name, last_name))
-            await db.commit()
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE users.username IS NOT excluded.username
+                   OR users.first_name IS NOT excluded.first_name
+                   OR users.last_name IS NOT excluded.last_name
+            """, rows))
+        except Exception:
+            logger.exception(f"Failed to register {len(rows)} users, retrying with the next batch")
+            for user_id, names in users.items():
+                Database._pending_users.setdefault(user_id, names)
+            # The flusher only wakes up for a new batch, so wake it for these rows
+            Database._users_ready.set()
+    
+    @staticmethod
+    async def _users_flush_loop():
+        """Flush registrations USER_FLUSH_INTERVAL_MS after the first one of a batch"""
+        while True:
+            await Database._users_ready.wait()
+            await asyncio.sleep(Config.USER_FLUSH_INTERVAL_MS / 1000)
+            Database._users_ready.clear()
+            await Database.flush_users()
     
     @staticmethod
     async def get_all_users() -> List[int]:
         """Get all user IDs"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("SELECT user_id FROM users") as cursor:
-                return [row[0] async for row in cursor]
+        await Database.flush_users()
+        async with Database._reader.execute("SELECT user_id FROM users") as cursor:
+            return [row[0] async for row in cursor]
     
     @staticmethod
     async def is_premium_user(user_id: int) -> bool:
         """Check if user is premium"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT is_premium FROM users WHERE user_id = ?
-            """, (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                return bool(result[0]) if result else False
+        async with Database._reader.execute("""
+            SELECT is_premium FROM users WHERE user_id = ?
+        """, (user_id,)) as cursor:
+            result = await cursor.fetchone()
+            return bool(result[0]) if result else False
     
     @staticmethod
     async def add_premium_user(user_id: int, days: int = 30):
         """Add premium user"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                UPDATE users 
-                SET is_premium = 1, 
-                    premium_expiry = datetime('now', '+' || ? || ' days')
-                WHERE user_id = ?
-            """, (days, user_id))
-            await db.commit()
+        await Database.flush_users()
+        await Database._write(lambda db: db.execute("""
+            UPDATE users 
+            SET is_premium = 1, 
+                premium_expiry = datetime('now', '+' || ? || ' days')
+            WHERE user_id = ?
+        """, (days, user_id)))
     
     @staticmethod
     async def remove_premium_user(user_id: int):
         """Remove premium status"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                UPDATE users SET is_premium = 0, premium_expiry = NULL WHERE user_id = ?
-            """, (user_id,))
-            await db.commit()
+        await Database._write(lambda db: db.execute("""
+            UPDATE users SET is_premium = 0, premium_expiry = NULL WHERE user_id = ?
+        """, (user_id,)))
     
     @staticmethod
     async def get_premium_users() -> List[Dict]:
         """Get all premium users"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT user_id, username, premium_expiry FROM users WHERE is_premium = 1
-            """) as cursor:
-                return [{"user_id": row[0], "username": row[1], "expiry": row[2]} async for row in cursor]
+        async with Database._reader.execute("""
+            SELECT user_id, username, premium_expiry FROM users WHERE is_premium = 1
+        """) as cursor:
+            return [{"user_id": row[0], "username": row[1], "expiry": row[2]} async for row in cursor]
+    
+    # User profile (settings, watermark and thumbnail, cached per user)
+    @staticmethod
+    def _invalidate_profile(user_id: int):
+        """Drop a cached profile after one of its parts changed"""
+        Database._profiles.pop(user_id, None)
+        Database._profile_generation += 1
+    
+    @staticmethod
+    async def get_user_profile(user_id: int) -> UserProfile:
+        """Get the settings, watermark and thumbnail of a user in one query
+        
+        Profiles are cached for USER_PROFILE_TTL seconds and dropped as soon
+        as the user changes any part of them.
+        """
+        cached = Database._profiles.get(user_id)
+        now = time.monotonic()
+        if not cached or cached[0] <= now:
+            generation = Database._profile_generation
+            async with Database._reader.execute("""
+                SELECT s.user_id, s.upload_as_doc, s.spoiler_enabled, s.preferred_quality,
+                       w.watermark_text, w.watermark_image, t.file_id
+                FROM (SELECT ? AS user_id) AS u
+                LEFT JOIN user_settings AS s ON s.user_id = u.user_id
+                LEFT JOIN watermarks AS w ON w.user_id = u.user_id
+                LEFT JOIN thumbnails AS t ON t.user_id = u.user_id
+            """, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            
+            profile = {
+                "settings": {
+                    "upload_as_doc": bool(row[1]),
+                    "spoiler_enabled": bool(row[2]),
+                    "preferred_quality": row[3]
+                } if row[0] is not None else {
+                    "upload_as_doc": False,
+                    "spoiler_enabled": False,
+                    "preferred_quality": "720p"
+                },
+                "watermark": {"text": row[4], "image": row[5]},
+                "thumbnail": row[6]
+            }
+            # A write that landed during the query may have made this profile stale
+            if generation == Database._profile_generation and Config.USER_PROFILE_TTL > 0:
+                if len(Database._profiles) >= Config.USER_PROFILE_CACHE_SIZE:
+                    Database._profiles = {
+                        key: entry for key, entry in Database._profiles.items() if entry[0] > now
+                    }
+                if len(Database._profiles) < Config.USER_PROFILE_CACHE_SIZE:
+                    Database._profiles[user_id] = (now + Config.USER_PROFILE_TTL, profile)
+            cached = (0, profile)
+        
+        # Copies, so callers can't change the cached profile
+        profile = cached[1]
+        return {
+            "settings": dict(profile["settings"]),
+            "watermark": dict(profile["watermark"]),
+            "thumbnail": profile["thumbnail"]
+        }
     
     # Thumbnail operations
     @staticmethod
     async def set_thumbnail(user_id: int, file_id: str):
         """Set user thumbnail"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO thumbnails (user_id, file_id) VALUES (?, ?)
-            """, (user_id, file_id))
-            await db.commit()
+        await Database._write(lambda db: db.execute("""
+            INSERT OR REPLACE INTO thumbnails (user_id, file_id) VALUES (?, ?)
+        """, (user_id, file_id)))
+        Database._invalidate_profile(user_id)
     
     @staticmethod
     async def get_thumbnail(user_id: int) -> Optional[str]:
         """Get user thumbnail"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT file_id FROM thumbnails WHERE user_id = ?
-            """, (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else None
+        return (await Database.get_user_profile(user_id))["thumbnail"]
     
     @staticmethod
     async def delete_thumbnail(user_id: int):
         """Delete user thumbnail"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("DELETE FROM thumbnails WHERE user_id = ?", (user_id,))
-            await db.commit()
+        await Database._write(lambda db: db.execute("DELETE FROM thumbnails WHERE user_id = ?", (user_id,)))
+        Database._invalidate_profile(user_id)
     
     # Watermark operations
     @staticmethod
     async def set_watermark(user_id: int, watermark_text: str = None, watermark_image: str = None):
         """Set user watermark"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO watermarks (user_id, watermark_text, watermark_image)
-                VALUES (?, ?, ?)
-            """, (user_id, watermark_text, watermark_image))
-            await db.commit()
+        await Database._write(lambda db: db.execute("""
+            INSERT OR REPLACE INTO watermarks (user_id, watermark_text, watermark_image)
+            VALUES (?, ?, ?)
+        """, (user_id, watermark_text, watermark_image)))
+        Database._invalidate_profile(user_id)
     
     @staticmethod
     async def get_watermark(user_id: int) -> Dict[str, Optional[str]]:
         """Get user watermark"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT watermark_text, watermark_image FROM watermarks WHERE user_id = ?
-            """, (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    return {"text": result[0], "image": result[1]}
-                return {"text": None, "image": None}
+        return (await Database.get_user_profile(user_id))["watermark"]
     
     # User settings
     @staticmethod
     async def set_user_setting(user_id: int, setting: str, value: Any):
         """Set user setting"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            if setting == "upload_as_doc":
-                await db.execute("""
-                    INSERT OR REPLACE INTO user_settings (user_id, upload_as_doc)
-                    VALUES (?, ?)
-                """, (user_id, 1 if value else 0))
-            elif setting == "spoiler_enabled":
-                await db.execute("""
-                    INSERT OR REPLACE INTO user_settings (user_id, spoiler_enabled)
-                    VALUES (?, ?)
-                """, (user_id, 1 if value else 0))
-            elif setting == "preferred_quality":
-                await db.execute("""
-                    INSERT OR REPLACE INTO user_settings (user_id, preferred_quality)
-                    VALUES (?, ?)
-                """, (user_id, value))
-            await db.commit()
+        if setting == "upload_as_doc":
+            sql = "INSERT OR REPLACE INTO user_settings (user_id, upload_as_doc) VALUES (?, ?)"
+            value = 1 if value else 0
+        elif setting == "spoiler_enabled":
+            sql = "INSERT OR REPLACE INTO user_settings (user_id, spoiler_enabled) VALUES (?, ?)"
+            value = 1 if value else 0
+        elif setting == "preferred_quality":
+            sql = "INSERT OR REPLACE INTO user_settings (user_id, preferred_quality) VALUES (?, ?)"
+        else:
+            return
+        await Database._write(lambda db: db.execute(sql, (user_id, value)))
+        Database._invalidate_profile(user_id)
     
     @staticmethod
     async def get_user_settings(user_id: int) -> Dict:
         """Get user settings"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT upload_as_doc, spoiler_enabled, preferred_quality
-                FROM user_settings WHERE user_id = ?
-            """, (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    return {
-                        "upload_as_doc": bool(result[0]),
-                        "spoiler_enabled": bool(result[1]),
-                        "preferred_quality": result[2]
-                    }
-                return {
-                    "upload_as_doc": False,
-                    "spoiler_enabled": False,
-                    "preferred_quality": "720p"
-                }
+        return (await Database.get_user_profile(user_id))["settings"]
     
     # Force sub operations
     @staticmethod
     async def add_fsub_channel(channel_id: int, channel_username: str = None):
         """Add force subscribe channel"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT OR IGNORE INTO fsub_channels (channel_id, channel_username)
-                VALUES (?, ?)
-            """, (channel_id, channel_username))
-            await db.commit()
+        await Database._write(lambda db: db.execute("""
+            INSERT OR IGNORE INTO fsub_channels (channel_id, channel_username)
+            VALUES (?, ?)
+        """, (channel_id, channel_username)))
     
     @staticmethod
     async def remove_fsub_channel(channel_id: int):
         """Remove force subscribe channel"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("DELETE FROM fsub_channels WHERE channel_id = ?", (channel_id,))
-            await db.commit()
+        await Database._write(lambda db: db.execute("DELETE FROM fsub_channels WHERE channel_id = ?", (channel_id,)))
     
     @staticmethod
     async def get_fsub_channels() -> List[Dict]:
         """Get all force subscribe channels"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("SELECT channel_id, channel_username FROM fsub_channels") as cursor:
-                return [{"channel_id": row[0], "username": row[1]} async for row in cursor]
+        async with Database._reader.execute("SELECT channel_id, channel_username FROM fsub_channels") as cursor:
+            return [{"channel_id": row[0], "username": row[1]} async for row in cursor]
     
     # Bot settings
     @staticmethod
     async def set_bot_setting(key: str, value: str):
         """Set bot setting"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)
-            """, (key, value))
-            await db.commit()
+        await Database._write(lambda db: db.execute("""
+            INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)
+        """, (key, value)))
+        Database._bot_settings[key] = value
+        Database._encode_settings = None
     
     @staticmethod
     async def get_bot_setting(key: str) -> Optional[str]:
         """Get bot setting"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            async with db.execute("""
-                SELECT value FROM bot_settings WHERE key = ?
-            """, (key,)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else None
+        return Database._bot_settings.get(key)
+    
+    @staticmethod
+    def get_encode_settings() -> EncodeSettings:
+        """Get the encoder settings configured by admins, without a query"""
+        if Database._encode_settings is None:
+            settings = Database._bot_settings
+            Database._encode_settings = {
+                "codec": settings.get("codec") or Config.DEFAULT_CODEC,
+                "preset": settings.get("preset") or Config.DEFAULT_PRESET,
+                "crf": int(settings.get("crf") or Config.DEFAULT_CRF),
+                "audio_bitrate": settings.get("audio_bitrate") or Config.DEFAULT_AUDIO_BITRATE,
+                "adaptive_crf": (settings.get("adaptive_crf") or str(Config.ADAPTIVE_CRF)).lower() == "true"
+            }
+        # A copy, so callers can't change the snapshot for everyone
+        return EncodeSettings(**Database._encode_settings)
     
     # Queue operations
     @staticmethod
-    async def add_to_queue(user_id: int, file_id: str, task_type: str):
-        """Add task to queue"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("""
-                INSERT INTO queue (user_id, file_id, task_type) VALUES (?, ?, ?)
-            """, (user_id, file_id, task_type))
-            await db.commit()
+    async def add_to_queue(
+        user_id: int,
+        file_id: str,
+        task_type: str,
+        chat_id: int = None,
+        message_id: int = None,
+        status_message_id: int = None,
+        payload: Dict = None,
+        delay: int = 0,
+        download_size: int = 0,
+        output_size: int = 0
+    ) -> int:
+        """Add task to queue, `delay` seconds before it may run"""
+        cursor = await Database._write(lambda db: db.execute("""
+            INSERT INTO queue (
+                user_id, file_id, task_type, chat_id, message_id, status_message_id, payload,
+                updated_at, run_after, download_size, output_size
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, datetime('now', ?), ?, ?)
+        """, (
+            user_id, file_id, task_type, chat_id, message_id, status_message_id,
+            json.dumps(payload or {}), f"+{delay} seconds" if delay else None,
+            download_size or 0, output_size or 0
+        )))
+        return cursor.lastrowid
     
     @staticmethod
     async def get_queue_size() -> int:
         """Get total queue size"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
+        async with Database._reader.execute("""
+            SELECT COUNT(*) FROM queue WHERE status = 'pending'
+        """) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+    
+    @staticmethod
+    async def get_user_queue_size(user_id: int) -> int:
+        """Get the number of pending and running tasks of a user"""
+        async with Database._reader.execute("""
+            SELECT COUNT(*) FROM queue WHERE user_id = ? AND status IN ('pending', 'running')
+        """, (user_id,)) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+    
+    @staticmethod
+    async def get_queue_stats() -> Dict[str, int]:
+        """Get task counts per status"""
+        stats = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        async with Database._reader.execute("SELECT status, COUNT(*) FROM queue GROUP BY status") as cursor:
+            async for row in cursor:
+                stats[row[0]] = row[1]
+        return stats
+    
+    @staticmethod
+    async def claim_next_job() -> Optional[Dict]:
+        """Mark the oldest pending task that is due as running and return it"""
+        async def claim(db):
+            # Select and update in the same transaction, so two workers never claim one task
             async with db.execute("""
-                SELECT COUNT(*) FROM queue WHERE status = 'pending'
+                SELECT id, user_id, file_id, task_type, chat_id, message_id, status_message_id, payload, attempts,
+                       download_size, output_size
+                FROM queue
+                WHERE status = 'pending' AND (run_after IS NULL OR run_after <= CURRENT_TIMESTAMP)
+                ORDER BY id LIMIT 1
             """) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else 0
+                row = await cursor.fetchone()
+            
+            if row:
+                await db.execute("""
+                    UPDATE queue SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (row[0],))
+            return row
+        
+        row = await Database._write(claim)
+        if not row:
+            return None
+        
+        return {
+            "id": row[0],
+            "user_id": row[1],
+            "file_id": row[2],
+            "task_type": row[3],
+            "chat_id": row[4],
+            "message_id": row[5],
+            "status_message_id": row[6],
+            "payload": json.loads(row[7] or "{}"),
+            "attempts": row[8] + 1,
+            "download_size": row[9] or 0,
+            "output_size": row[10] or 0
+        }
+    
+    @staticmethod
+    async def defer_job(job_id: int, delay: int):
+        """Put a claimed task back in the queue without counting the attempt"""
+        await Database._write(lambda db: db.execute("""
+            UPDATE queue SET status = 'pending', attempts = attempts - 1,
+            run_after = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (f"+{delay} seconds", job_id)))
+    
+    @staticmethod
+    async def finish_job(job_id: int, status: str, error: str = None):
+        """Mark a task as done or failed"""
+        await Database._write(lambda db: db.execute("""
+            UPDATE queue SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        """, (status, error, job_id)))
+    
+    @staticmethod
+    async def requeue_interrupted_jobs(max_attempts: int) -> Dict[str, int]:
+        """Put tasks that were running when the bot stopped back in the queue"""
+        async def requeue(db):
+            cursor = await db.execute("""
+                UPDATE queue SET status = 'failed', error = 'Interrupted too many times', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND attempts >= ?
+            """, (max_attempts,))
+            failed = cursor.rowcount
+            
+            cursor = await db.execute("""
+                UPDATE queue SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'running'
+            """)
+            return {"requeued": cursor.rowcount, "failed": failed}
+        
+        return await Database._write(requeue)
+    
+    @staticmethod
+    async def purge_finished_jobs(days: int = 7) -> int:
+        """Delete finished tasks older than `days`"""
+        cursor = await Database._write(lambda db: db.execute("""
+            DELETE FROM queue WHERE status IN ('done', 'failed')
+            AND updated_at < datetime('now', '-' || ? || ' days')
+        """, (days,)))
+        return cursor.rowcount
     
     @staticmethod
     async def clear_queue():
-        """Clear all queue tasks"""
-        async with aiosqlite.connect(Database.DB_PATH) as db:
-            await db.execute("DELETE FROM queue")
-            await db.commit()
+        """Clear all queue tasks that are not running"""
+        await Database._write(lambda db: db.execute("DELETE FROM queue WHERE status != 'running'"))
+    
+    # Rendition cache operations
+    @staticmethod
+    async def get_cached_rendition(cache_key: str) -> Optional[Dict]:
+        """Get a previously uploaded rendition and mark it as used"""
+        async with Database._reader.execute("""
+            SELECT file_id, media_type, file_size FROM rendition_cache WHERE cache_key = ?
+        """, (cache_key,)) as cursor:
+            result = await cursor.fetchone()
+        
+        if not result:
+            return None
+        
+        await Database._write(lambda db: db.execute("""
+            UPDATE rendition_cache SET hits = hits + 1, last_used = CURRENT_TIMESTAMP
+            WHERE cache_key = ?
+        """, (cache_key,)))
+        return {"file_id": result[0], "media_type": result[1], "file_size": result[2]}
+    
+    @staticmethod
+    async def add_cached_rendition(cache_key: str, file_id: str, media_type: str, file_size: int = 0):
+        """Remember an uploaded rendition"""
+        await Database._write(lambda db: db.execute("""
+            INSERT OR REPLACE INTO rendition_cache (cache_key, file_id, media_type, file_size)
+            VALUES (?, ?, ?, ?)
+        """, (cache_key, file_id, media_type, file_size)))
+    
+    @staticmethod
+    async def delete_cached_rendition(cache_key: str):
+        """Forget a cached rendition"""
+        await Database._write(lambda db: db.execute("DELETE FROM rendition_cache WHERE cache_key = ?", (cache_key,)))
+    
+    @staticmethod
+    async def evict_cached_renditions(max_age_days: int, max_entries: int) -> int:
+        """Drop renditions unused for too long and the least recently used beyond max_entries"""
+        async def evict(db):
+            cursor = await db.execute("""
+                DELETE FROM rendition_cache WHERE last_used < datetime('now', '-' || ? || ' days')
+            """, (max_age_days,))
+            removed = cursor.rowcount
+            
+            cursor = await db.execute("""
+                DELETE FROM rendition_cache WHERE cache_key NOT IN (
+                    SELECT cache_key FROM rendition_cache ORDER BY last_used DESC LIMIT ?
+                )
+            """, (max_entries,))
+            return removed + cursor.rowcount
+        
+        return await Database._write(evict)
+    
+    @staticmethod
+    async def get_rendition_cache_stats() -> Dict:
+        """Get rendition cache size and total hits"""
+        async with Database._reader.execute("""
+            SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(file_size), 0) FROM rendition_cache
+        """) as cursor:
+            result = await cursor.fetchone()
+            return {"entries": result[0], "hits": result[1], "size": result[2]}
+    
+    @staticmethod
+    async def clear_rendition_cache():
+        """Clear the rendition cache"""
+        await Database._write(lambda db: db.execute("DELETE FROM rendition_cache"))
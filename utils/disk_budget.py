@@ -0,0 +1,97 @@
+# utils/disk_budget.py
+import os
+import shutil
+import logging
+from typing import Dict, Optional
+from utils.config import Config
+from utils.source_cache import SourceCache
+
+logger = logging.getLogger(__name__)
+
+class DiskBudget:
+    """Start jobs only once their files fit on disk
+
+    Every job declares the size of its download and of its output when it is
+    queued. Before it runs that space is reserved on the disks holding
+    DOWNLOAD_DIR and UPLOAD_DIR, next to what the running jobs reserved.
+    Jobs that don't fit go back to the queue until space is freed. Reserved
+    space is only returned when a job ends, so the check errs on the safe
+    side while files are being written.
+
+    Small files (thumbnails, subtitles, short clips) can be staged on a
+    RAM-backed directory instead, which saves the disk the I/O.
+    """
+
+    reserved: Dict[int, int] = {}
+    active = 0
+
+    @staticmethod
+    def _device(path: str) -> int:
+        os.makedirs(path, exist_ok=True)
+        return os.stat(path).st_dev
+
+    @staticmethod
+    def free_space(path: str) -> int:
+        """Free bytes on the disk holding `path`, minus what running jobs reserved"""
+        os.makedirs(path, exist_ok=True)
+        return shutil.disk_usage(path).free - DiskBudget.reserved.get(DiskBudget._device(path), 0)
+
+    @staticmethod
+    def try_reserve(download_size: int = 0, output_size: int = 0) -> Optional[Dict[int, int]]:
+        """Reserve space for a job, None if it doesn't fit next to the running jobs"""
+        needs = {}
+        for path, size in ((Config.DOWNLOAD_DIR, download_size), (Config.UPLOAD_DIR, output_size)):
+            need = needs.setdefault(DiskBudget._device(path), [path, 0])
+            need[1] += size or 0
+
+        margin = Config.DISK_FREE_MARGIN_MB * 1024 * 1024
+        cache_device = DiskBudget._device(SourceCache.cache_dir())
+        for device, (path, size) in needs.items():
+            missing = size + margin - DiskBudget.free_space(path)
+            if missing <= 0:
+                continue
+            # Unused cached sources make room before a job is turned away
+            if device == cache_device:
+                missing -= SourceCache.trim(missing)
+            # A job alone can't wait for anything to finish, it runs and fails if it must
+            if missing > 0 and DiskBudget.active:
+                return None
+
+        reservation = {device: size for device, (_, size) in needs.items()}
+        for device, size in reservation.items():
+            DiskBudget.reserved[device] = DiskBudget.reserved.get(device, 0) + size
+        DiskBudget.active += 1
+        return reservation
+
+    @staticmethod
+    def release(reservation: Dict[int, int]):
+        """Return the space reserved for a job"""
+        for device, size in reservation.items():
+            DiskBudget.reserved[device] = max(0, DiskBudget.reserved.get(device, 0) - size)
+        DiskBudget.active -= 1
+
+    @staticmethod
+    def staging_dir(fallback: str, size: int = 0) -> str:
+        """RAM-backed directory for a small file, `fallback` for anything else"""
+        if not Config.STAGING_DIR or size > Config.STAGING_MAX_FILE_MB * 1024 * 1024:
+            return fallback
+
+        try:
+            os.makedirs(Config.STAGING_DIR, exist_ok=True)
+            # Leave room for other staged files, RAM is scarcer than disk
+            if shutil.disk_usage(Config.STAGING_DIR).free < max(size, 1024 * 1024) * 4:
+                return fallback
+        except OSError as e:
+            logger.warning(f"Staging directory unavailable: {e}")
+            return fallback
+        return Config.STAGING_DIR
+
+    @staticmethod
+    def get_stats() -> dict:
+        """Get reservations and free space"""
+        return {
+            "active": DiskBudget.active,
+            "reserved": sum(DiskBudget.reserved.values()),
+            "download_free": max(0, DiskBudget.free_space(Config.DOWNLOAD_DIR)),
+            "upload_free": max(0, DiskBudget.free_space(Config.UPLOAD_DIR))
+        }
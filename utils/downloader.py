@@ -0,0 +1,146 @@
+# utils/downloader.py
+import os
+import math
+import json
+import asyncio
+from typing import Optional, Callable
+from utils.config import Config
+
+class ParallelDownloader:
+    """Download large Telegram files as several parts at once
+
+    The file is split into ranges of whole chunks, each range is fetched by
+    its own `stream_media` call and written at its offset in a preallocated
+    file. Files of unknown size use `download_media`.
+
+    Completed chunks of every range are recorded in a sidecar next to the
+    partial file, so a download that was interrupted by an error or a
+    restart continues where it stopped instead of starting over.
+    """
+
+    # stream_media offsets and limits count chunks of this size
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def plan(file_size: int, parts: int = None) -> list:
+        """Split a file into (offset, limit) chunk ranges"""
+        parts = Config.DOWNLOAD_PARTS if parts is None else parts
+        if file_size < Config.DOWNLOAD_PARTS_MIN_SIZE_MB * 1024 * 1024:
+            parts = 1
+
+        chunks = math.ceil(file_size / ParallelDownloader.CHUNK_SIZE)
+        parts = max(1, min(parts, chunks))
+        base, extra = divmod(chunks, parts)
+
+        ranges, offset = [], 0
+        for i in range(parts):
+            limit = base + (1 if i < extra else 0)
+            ranges.append((offset, limit))
+            offset += limit
+        return ranges
+
+    @staticmethod
+    def has_partial(file_path: str) -> bool:
+        """Check if an interrupted download of `file_path` can be resumed"""
+        return os.path.exists(f"{file_path}.temp") and os.path.exists(f"{file_path}.temp.parts")
+
+    @staticmethod
+    def _load_state(temp_path: str, file_size: int) -> Optional[list]:
+        """[offset, limit, done] per range from the sidecar, if it matches the partial file"""
+        try:
+            with open(f"{temp_path}.parts") as f:
+                state = json.load(f)
+            if state['file_size'] == file_size and os.path.getsize(temp_path) == file_size:
+                return [list(r) for r in state['ranges']]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @staticmethod
+    def _save_state(temp_path: str, file_size: int, ranges: list):
+        """Record the completed chunks, replacing the sidecar atomically"""
+        sidecar = f"{temp_path}.parts"
+        with open(f"{sidecar}.new", "w") as f:
+            json.dump({"file_size": file_size, "ranges": ranges}, f)
+        os.replace(f"{sidecar}.new", sidecar)
+
+    @staticmethod
+    async def download_ranges(client, file_id: str, file_path: str, file_size: int, ranges: list) -> str:
+        """Download only some (offset, limit) chunk ranges into a sparse file of the full size"""
+        if not os.path.exists(file_path):
+            with open(file_path, "wb") as f:
+                f.truncate(file_size)
+
+        async def fetch(offset: int, limit: int):
+            with open(file_path, "r+b") as f:
+                f.seek(offset * ParallelDownloader.CHUNK_SIZE)
+                async for chunk in client.stream_media(file_id, limit=limit, offset=offset):
+                    f.write(chunk)
+
+        await asyncio.gather(*[fetch(offset, limit) for offset, limit in ranges if limit > 0])
+        return file_path
+
+    @staticmethod
+    async def download(
+        client,
+        file_id: str,
+        file_path: str,
+        file_size: int = 0,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = ()
+    ) -> str:
+        """Download a file to `file_path`, with the progress signature of download_media"""
+        if not file_size:
+            return await client.download_media(
+                file_id,
+                file_name=file_path,
+                progress=progress,
+                progress_args=progress_args
+            )
+
+        temp_path = f"{file_path}.temp"
+        ranges = ParallelDownloader._load_state(temp_path, file_size)
+        if ranges is None:
+            ranges = [[offset, limit, 0] for offset, limit in ParallelDownloader.plan(file_size)]
+            with open(temp_path, "wb") as f:
+                f.truncate(file_size)
+            ParallelDownloader._save_state(temp_path, file_size, ranges)
+
+        chunk_size = ParallelDownloader.CHUNK_SIZE
+        received = min(file_size, sum(done for _, _, done in ranges) * chunk_size)
+
+        async def fetch(part: list):
+            """Download the rest of one range into its place in the file"""
+            nonlocal received
+            offset, limit, done = part
+            if done >= limit:
+                return
+
+            with open(temp_path, "r+b") as f:
+                f.seek((offset + done) * chunk_size)
+                async for chunk in client.stream_media(file_id, limit=limit - done, offset=offset + done):
+                    f.write(chunk)
+                    f.flush()
+                    # Only chunks that reached the file are recorded
+                    part[2] += 1
+                    ParallelDownloader._save_state(temp_path, file_size, ranges)
+                    received = min(file_size, received + len(chunk))
+                    if progress:
+                        await progress(received, file_size, *progress_args)
+
+        tasks = [asyncio.create_task(fetch(part)) for part in ranges]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # The partial file and its sidecar stay for the next attempt
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        if any(done < limit for _, limit, done in ranges):
+            raise Exception("Download incomplete, it will resume on the next attempt")
+
+        os.replace(temp_path, file_path)
+        os.remove(f"{temp_path}.parts")
+        return file_path
@@ -1,14 +1,53 @@
 # utils/ffmpeg_helper.py
 import os
 import asyncio
-import re
+import glob
+import math
+import shutil
+import tempfile
 import time
-from typing import Optional, Callable
+from typing import Optional, Callable, Union, AsyncIterator
 from utils.config import Config
+from utils.cpu_budget import CPUBudget
+from utils.workspace import Workspace
+from utils.ffmpeg_progress import FFmpegProgress
 
 class FFmpegHelper:
     """Helper class for FFmpeg operations"""
     
+    # Resolution mapping
+    RESOLUTION_MAP = {
+        "144p": "256x144",
+        "240p": "426x240",
+        "360p": "640x360",
+        "480p": "854x480",
+        "720p": "1280x720",
+        "1080p": "1920x1080",
+        "2160p": "3840x2160"
+    }
+    
+    # Typical video bitrate (kbps) of each rendition, used to skip
+    # renditions that would not come out smaller than the source
+    TARGET_BITRATES = {
+        "144p": 150,
+        "240p": 300,
+        "360p": 600,
+        "480p": 1000,
+        "720p": 2500,
+        "1080p": 4500,
+        "2160p": 15000
+    }
+    
+    # FFmpeg encoder -> codec name reported by ffprobe
+    CODEC_NAMES = {
+        "libx264": "h264",
+        "libx265": "hevc",
+        "libvpx-vp9": "vp9"
+    }
+    
+    # Lowest video bitrate (kbps) a target-size compress will go down to
+    MIN_VIDEO_BITRATE = 64
+    
     @staticmethod
     async def encode_video(
         input_file: str,
@@ -20,22 +59,17 @@ class FFmpegHelper:
         audio_bitrate: str = Config.DEFAULT_AUDIO_BITRATE,
         watermark_text: str = None,
         watermark_image: str = None,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        input_stream: Optional[AsyncIterator[bytes]] = None,
+        duration: Optional[float] = None
     ) -> bool:
-        """Encode video with specified parameters"""
-        
-        # Resolution mapping
-        resolution_map = {
-            "144p": "256x144",
-            "240p": "426x240",
-            "360p": "640x360",
-            "480p": "854x480",
-            "720p": "1280x720",
-            "1080p": "1920x1080",
-            "2160p": "3840x2160"
-        }
+        """Encode video with specified parameters
         
-        scale = resolution_map.get(resolution, "1280:720")
+        With `input_stream` the source is piped into FFmpeg while it is still
+        downloading: `input_file` is ignored and `duration` drives the progress.
+        """
+        if input_stream is not None:
+            input_file = "pipe:0"
         
         # Build FFmpeg command
         cmd = [
@@ -43,67 +77,557 @@ class FFmpegHelper:
             "-c:v", codec,
             "-preset", preset,
             "-crf", str(crf),
-            "-vf", f"scale={scale}",
+            "-vf", FFmpegHelper._video_filter(resolution, watermark_text, watermark_image),
             "-c:a", "aac",
             "-b:a", audio_bitrate,
-            "-threads", str(Config.FFMPEG_THREADS),
             "-y"
         ]
         
-        # Add watermark if specified
-        if watermark_text:
-            cmd[cmd.index("-vf") + 1] += f",drawtext=text='{watermark_text}':fontsize=24:fontcolor=white:x=10:y=10"
-        
-        if watermark_image and os.path.exists(watermark_image):
-            cmd[cmd.index("-vf") + 1] += f",movie={watermark_image}[watermark];[in][watermark]overlay=10:10[out]"
-        
-        cmd.append(output_file)
-        
-        # Get video duration for progress calculation
-        duration = await FFmpegHelper.get_duration(input_file)
+        # A stream can't be probed, remuxed or split before it is complete
+        if input_stream is None:
+            # Get video info for progress calculation
+            info = await FFmpegHelper.get_video_info(input_file)
+            duration = info.get('duration') or None
+            
+            # Already in the target codec and resolution: remux instead of transcoding
+            if FFmpegHelper.can_stream_copy(info, resolution, codec, watermark_text, watermark_image):
+                return await FFmpegHelper.stream_copy(input_file, output_file, info, audio_bitrate)
+            
+            # Long videos are encoded as parallel chunks, falling back to a
+            # single process if the source can't be split cleanly
+            if Config.SEGMENT_ENCODING and duration and duration >= Config.SEGMENT_MIN_DURATION:
+                if await FFmpegHelper.encode_video_segmented(
+                    input_file, output_file, resolution, codec, preset, crf, audio_bitrate,
+                    watermark_text, watermark_image, progress_callback, duration
+                ):
+                    return True
+        
+        async with CPUBudget.reserve() as threads:
+            cmd += ["-threads", str(threads), output_file]
+            
+            # Execute FFmpeg
+            return await FFmpegHelper._run(cmd, progress_callback, duration, stdin=input_stream)
+    
+    @staticmethod
+    async def encode_video_segmented(
+        input_file: str,
+        output_file: str,
+        resolution: str,
+        codec: str,
+        preset: str,
+        crf: int,
+        audio_bitrate: str,
+        watermark_text: str,
+        watermark_image: str,
+        progress_callback: Optional[Callable],
+        duration: float
+    ) -> bool:
+        """Split video at keyframes, encode the chunks in parallel and concat them
         
-        # Execute FFmpeg
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        Audio is left out of the chunks and encoded once while muxing the
+        final file, so there are no gaps at the chunk boundaries.
+        """
+        work_dir = f"{output_file}.segments"
+        os.makedirs(work_dir, exist_ok=True)
         
-        # Monitor progress
-        start_time = time.time()
-        while True:
-            line = await process.stderr.readline()
-            if not line:
-                break
-                
-            line = line.decode('utf-8', errors='ignore')
+        try:
+            # Split the video stream at keyframes without re-encoding
+            split_cmd = [
+                "ffmpeg", "-i", input_file,
+                "-map", "0:v:0",
+                "-c", "copy",
+                "-f", "segment",
+                "-segment_time", str(Config.SEGMENT_DURATION),
+                "-reset_timestamps", "1",
+                "-y", os.path.join(work_dir, "src_%05d.mkv")
+            ]
             
-            # Extract time progress
-            time_match = re.search(r'time=(\d+):(\d+):(\d+\.\d+)', line)
-            if time_match and duration and progress_callback:
-                hours = int(time_match.group(1))
-                minutes = int(time_match.group(2))
-                seconds = float(time_match.group(3))
-                current_time = hours * 3600 + minutes * 60 + seconds
+            split = await FFmpegHelper._run(split_cmd)
+            
+            chunks = sorted(f for f in os.listdir(work_dir) if f.startswith("src_"))
+            if not split or len(chunks) < 2:
+                return False
+            
+            video_filter = FFmpegHelper._video_filter(resolution, watermark_text, watermark_image)
+            # By default run as many minimum shares as one process may hold, so
+            # the chunks don't queue behind each other in the CPU budget
+            workers = Config.SEGMENT_WORKERS or CPUBudget.max_threads() // CPUBudget.min_threads()
+            semaphore = asyncio.Semaphore(max(1, workers))
+            chunk_times = [0.0] * len(chunks)
+            start_time = time.time()
+            last_update = 0
+            
+            async def chunk_progress(index, current):
+                nonlocal last_update
+                chunk_times[index] = current
+                if not progress_callback or time.time() - last_update < Config.PROGRESS_UPDATE_INTERVAL:
+                    return
                 
-                percentage = (current_time / duration) * 100
+                last_update = time.time()
+                done = sum(chunk_times)
                 elapsed = time.time() - start_time
-                
                 if elapsed > 0:
-                    speed = current_time / elapsed
-                    eta = (duration - current_time) / speed if speed > 0 else 0
+                    speed = done / elapsed
+                    eta = (duration - done) / speed if speed > 0 else 0
                     
                     await progress_callback(
-                        percentage=min(percentage, 100),
+                        percentage=min((done / duration) * 100, 100),
                         speed=speed,
                         eta=eta,
-                        current=current_time,
+                        current=done,
                         total=duration
                     )
+            
+            async def encode_chunk(index, chunk):
+                async with semaphore, CPUBudget.reserve() as threads:
+                    cmd = [
+                        "ffmpeg", "-i", os.path.join(work_dir, chunk),
+                        "-an",
+                        "-c:v", codec,
+                        "-preset", preset,
+                        "-crf", str(crf),
+                        "-vf", video_filter,
+                        "-threads", str(threads),
+                        "-y", os.path.join(work_dir, chunk.replace("src_", "enc_"))
+                    ]
+                    
+                    async def callback(current, **stats):
+                        await chunk_progress(index, current)
+                    
+                    # Only the chunk's own position is used, the overall
+                    # duration just enables the progress parser
+                    return await FFmpegHelper._run(cmd, callback, duration, interval=0)
+            
+            results = await asyncio.gather(*(encode_chunk(i, c) for i, c in enumerate(chunks)))
+            if not all(results):
+                return False
+            
+            # Losslessly join the encoded chunks and add the audio in one go
+            concat_file = os.path.join(work_dir, "concat_list.txt")
+            with open(concat_file, 'w') as f:
+                for chunk in chunks:
+                    f.write(f"file '{os.path.abspath(os.path.join(work_dir, chunk.replace('src_', 'enc_')))}'\n")
+            
+            cmd = [
+                "ffmpeg", "-f", "concat",
+                "-safe", "0",
+                "-i", concat_file,
+                "-i", input_file,
+                "-map", "0:v:0",
+                "-map", "1:a?",
+                "-c:v", "copy",
+                "-c:a", "aac",
+                "-b:a", audio_bitrate,
+                "-y", output_file
+            ]
+            
+            return await FFmpegHelper._run(cmd)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    @staticmethod
+    async def encode_ladder(
+        input_file: str,
+        outputs: dict,
+        codec: str = Config.DEFAULT_CODEC,
+        preset: str = Config.DEFAULT_PRESET,
+        crf: Union[int, dict] = Config.DEFAULT_CRF,
+        audio_bitrate: str = Config.DEFAULT_AUDIO_BITRATE,
+        watermark_text: str = None,
+        watermark_image: str = None,
+        progress_callback: Optional[Callable] = None,
+        info: dict = None,
+        shared_audio: str = None
+    ) -> bool:
+        """Encode several resolutions in a single pass
+        
+        `outputs` maps a resolution (e.g. "720p") to its output file. The
+        source is decoded once and split into one scale chain per rendition;
+        renditions that already match the source are stream copied. `crf` is
+        either one value for every rendition or a resolution -> CRF dict.
+        The audio is copied or encoded once and muxed into every rendition.
+        Callers encoding a ladder in several passes can encode it themselves
+        and pass it as `shared_audio`, which is then left in place.
+        """
+        info = info or await FFmpegHelper.get_video_info(input_file)
+        duration = info.get('duration') or None
+        
+        qualities = list(outputs)
+        copies = [q for q in qualities if FFmpegHelper.can_stream_copy(info, q, codec, watermark_text, watermark_image)]
+        encodes = [q for q in qualities if q not in copies]
+        count = len(encodes)
+        use_image = bool(count and watermark_image and os.path.exists(watermark_image))
+        
+        cmd = ["ffmpeg", "-y", "-i", input_file]
+        if use_image:
+            cmd += ["-i", watermark_image]
+        
+        # Every rendition gets the same audio track
+        audio_args = ["-map", "0:a?"] + FFmpegHelper._audio_args(info, audio_bitrate)
+        temp_audio = None
+        if not shared_audio and encodes and info.get('audio_codec', 'none') not in ("none", "aac"):
+            temp_audio = f"{os.path.splitext(outputs[encodes[0]])[0]}_audio.m4a"
+            if await FFmpegHelper.encode_audio(input_file, temp_audio, audio_bitrate):
+                shared_audio = temp_audio
+        if shared_audio:
+            audio_args = ["-map", f"{2 if use_image else 1}:a", "-c:a", "copy"]
+            cmd += ["-i", shared_audio]
+        
+        # Decode once, then fan out into one filter chain per rendition
+        graph = []
+        if count:
+            graph.append(f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count)))
+        if use_image:
+            graph.append(f"[1:v]split={count}" + "".join(f"[wm{i}]" for i in range(count)))
+        
+        for i, quality in enumerate(encodes):
+            scale = FFmpegHelper.RESOLUTION_MAP.get(quality, "1280:720")
+            chain = f"[v{i}]scale={scale}"
+            if watermark_text:
+                chain += f",drawtext=text='{watermark_text}':fontsize=24:fontcolor=white:x=10:y=10"
+            if use_image:
+                chain += f"[s{i}];[s{i}][wm{i}]overlay=10:10"
+            graph.append(chain + f"[out{i}]")
+        
+        try:
+            async with CPUBudget.reserve(encoders=count) as threads:
+                # The share is split between the filter graph and every encoder
+                if graph:
+                    cmd += [
+                        "-filter_complex", ";".join(graph),
+                        "-filter_complex_threads", str(threads)
+                    ]
+                
+                for i, quality in enumerate(encodes):
+                    cmd += [
+                        "-map", f"[out{i}]",
+                        "-c:v", codec,
+                        "-preset", preset,
+                        "-crf", str(crf.get(quality, Config.DEFAULT_CRF) if isinstance(crf, dict) else crf),
+                        "-threads", str(max(1, threads // count))
+                    ]
+                    cmd += audio_args + [outputs[quality]]
+                
+                for quality in copies:
+                    cmd += ["-map", "0:v:0", "-c:v", "copy"]
+                    cmd += audio_args + ["-movflags", "+faststart", outputs[quality]]
+                
+                return await FFmpegHelper._run(cmd, progress_callback, duration)
+        finally:
+            if temp_audio and os.path.exists(temp_audio):
+                os.remove(temp_audio)
+    
+    @staticmethod
+    def target_height(resolution: str) -> int:
+        """Height in pixels of a named resolution"""
+        return int(FFmpegHelper.RESOLUTION_MAP.get(resolution, "1280x720").split("x")[1])
+    
+    @staticmethod
+    def can_stream_copy(info: dict, resolution: str, codec: str, watermark_text: str = None, watermark_image: str = None) -> bool:
+        """Check if the source already has the target codec and resolution"""
+        if not info or watermark_text or (watermark_image and os.path.exists(watermark_image)):
+            return False
+        
+        return (
+            info.get('height') == FFmpegHelper.target_height(resolution)
+            and info.get('video_codec') == FFmpegHelper.CODEC_NAMES.get(codec)
+        )
+    
+    @staticmethod
+    def plan_ladder(info: dict, qualities: list, codec: str, watermark_text: str = None, watermark_image: str = None) -> list:
+        """Drop renditions that would upscale the source or not lower its bitrate"""
+        source_height = info.get('height', 0) if info else 0
+        if not source_height:
+            return list(qualities)
+        
+        fitting = [q for q in qualities if FFmpegHelper.target_height(q) <= source_height]
+        if not fitting:
+            # Source is smaller than every rendition, keep the smallest one
+            return [min(qualities, key=FFmpegHelper.target_height)]
+        
+        source_kbps = info.get('video_bitrate', 0) // 1000
+        ladder = [
+            q for q in fitting
+            if not source_kbps
+            or FFmpegHelper.TARGET_BITRATES.get(q, 0) < source_kbps
+            or FFmpegHelper.can_stream_copy(info, q, codec, watermark_text, watermark_image)
+        ]
+        
+        # Always keep the largest rendition the source supports
+        return ladder or [max(fitting, key=FFmpegHelper.target_height)]
+    
+    @staticmethod
+    def split_ladder(qualities: list, stages: int) -> list:
+        """Split a ladder into stages of similar encode cost, largest rendition first
+        
+        The cost of a rendition is taken as its pixel count. Uploads of one
+        stage overlap the encode of the next, so leading with the largest
+        files hides the longest uploads.
+        """
+        def cost(quality):
+            width, height = FFmpegHelper.RESOLUTION_MAP.get(quality, "1280x720").split("x")
+            return int(width) * int(height)
+        
+        ordered = sorted(qualities, key=cost, reverse=True)
+        stages = max(1, min(stages, len(ordered)))
+        total = sum(cost(q) for q in ordered)
+        
+        groups, current, done = [], [], 0
+        for quality in ordered:
+            current.append(quality)
+            done += cost(quality)
+            if len(groups) < stages - 1 and done >= total * (len(groups) + 1) / stages:
+                groups.append(current)
+                current = []
+        if current:
+            groups.append(current)
+        return groups
+    
+    @staticmethod
+    async def choose_crf(
+        input_file: str,
+        resolution: str,
+        codec: str = Config.DEFAULT_CODEC,
+        preset: str = Config.DEFAULT_PRESET,
+        crf: int = Config.DEFAULT_CRF,
+        info: dict = None
+    ) -> int:
+        """Pick the CRF that brings a rendition close to its target bitrate
+        
+        A few short samples spread over the source are encoded at two
+        candidate CRFs. Bitrate falls roughly exponentially as CRF rises, so
+        the CRF for the rendition's target bitrate is interpolated on a log
+        scale. Falls back to `crf` when the source is too short to sample.
+        """
+        target_kbps = FFmpegHelper.TARGET_BITRATES.get(resolution)
+        info = info or await FFmpegHelper.get_video_info(input_file)
+        duration = info.get('duration') or 0
+        sample_count = max(1, Config.ADAPTIVE_CRF_SAMPLES)
+        if not target_kbps or duration < Config.ADAPTIVE_CRF_SAMPLE_DURATION * sample_count:
+            return crf
+        
+        # Sample the middle of evenly spaced windows, away from intros and credits
+        sample_duration = Config.ADAPTIVE_CRF_SAMPLE_DURATION
+        starts = [
+            duration * (i + 1) / (sample_count + 1) - sample_duration / 2
+            for i in range(sample_count)
+        ]
+        
+        # Cached sources are shared between jobs, so the samples get their own
+        # directory, swept with the workspaces if a crash leaves it behind
+        os.makedirs(Workspace.root(), exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=f"crf_{resolution}_", dir=Workspace.root())
+        
+        try:
+            low, high = crf, crf + 6
+            low_kbps = await FFmpegHelper._sample_bitrate(input_file, resolution, codec, preset, low, starts, sample_duration, work_dir)
+            high_kbps = await FFmpegHelper._sample_bitrate(input_file, resolution, codec, preset, high, starts, sample_duration, work_dir)
+            if not low_kbps or not high_kbps or high_kbps >= low_kbps:
+                return crf
+            
+            slope = (math.log(high_kbps) - math.log(low_kbps)) / (high - low)
+            chosen = low + (math.log(target_kbps) - math.log(low_kbps)) / slope
+            return int(round(min(max(chosen, Config.ADAPTIVE_CRF_MIN), Config.ADAPTIVE_CRF_MAX)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    @staticmethod
+    async def _sample_bitrate(
+        input_file: str,
+        resolution: str,
+        codec: str,
+        preset: str,
+        crf: int,
+        starts: list,
+        sample_duration: float,
+        work_dir: str
+    ) -> float:
+        """Encode the sample windows back to back and return the video bitrate in kbps"""
+        cmd = ["ffmpeg"]
+        for start in starts:
+            cmd += ["-ss", f"{start:.2f}", "-t", str(sample_duration), "-i", input_file]
+        
+        scale = FFmpegHelper.RESOLUTION_MAP.get(resolution, "1280:720")
+        graph = "".join(f"[{i}:v:0]" for i in range(len(starts)))
+        graph += f"concat=n={len(starts)}:v=1:a=0,scale={scale}[v]"
+        output = os.path.join(work_dir, f"crf_{crf}.mkv")
+        
+        async with CPUBudget.reserve() as threads:
+            cmd += [
+                "-filter_complex", graph,
+                "-map", "[v]",
+                "-c:v", codec,
+                "-preset", preset,
+                "-crf", str(crf),
+                "-threads", str(threads),
+                "-y", output
+            ]
+            
+            if not await FFmpegHelper._run(cmd) or not os.path.exists(output):
+                return 0
+        
+        return os.path.getsize(output) * 8 / (len(starts) * sample_duration) / 1000
+    
+    @staticmethod
+    def _audio_args(info: dict, audio_bitrate: str) -> list:
+        """Copy AAC audio as is, encode anything else"""
+        if info.get('audio_codec') == "aac":
+            return ["-c:a", "copy"]
+        return ["-c:a", "aac", "-b:a", audio_bitrate]
+    
+    @staticmethod
+    async def stream_copy(input_file: str, output_file: str, info: dict, audio_bitrate: str = Config.DEFAULT_AUDIO_BITRATE, progress_callback: Optional[Callable] = None) -> bool:
+        """Remux a source that already matches the target rendition"""
+        cmd = [
+            "ffmpeg", "-i", input_file,
+            "-map", "0:v:0",
+            "-map", "0:a?",
+            "-c:v", "copy"
+        ]
+        cmd += FFmpegHelper._audio_args(info, audio_bitrate)
+        cmd += ["-movflags", "+faststart", "-y", output_file]
+        
+        return await FFmpegHelper._run(cmd, progress_callback)
+    
+    @staticmethod
+    def can_stream_input(head: bytes) -> bool:
+        """Check from the first bytes of a file if FFmpeg can read it from a pipe
+        
+        MP4/MOV only works with the moov atom in front of the media data,
+        Matroska/WebM, MPEG-TS and FLV can always be read front to back.
+        """
+        if head[:4] == b"\x1a\x45\xdf\xa3" or head[:3] == b"FLV":
+            return True
+        if len(head) > 188 and head[0] == 0x47 and head[188] == 0x47:
+            return True
+        if head[4:8] != b"ftyp":
+            return False
+        
+        # Walk the top level boxes until moov or mdat shows up
+        offset = 0
+        while offset + 8 <= len(head):
+            size = int.from_bytes(head[offset:offset + 4], "big")
+            box = head[offset + 4:offset + 8]
+            if box == b"moov":
+                return True
+            if box == b"mdat":
+                return False
+            if size == 1 and offset + 16 <= len(head):
+                size = int.from_bytes(head[offset + 8:offset + 16], "big")
+            if size < 8:
+                return False
+            offset += size
+        return False
+    
+    @staticmethod
+    def index_offset(head: bytes) -> Optional[int]:
+        """Where the moov atom of an MP4/MOV starts when it comes after the media data
+        
+        Returns None when the index is in `head` already or the file isn't MP4.
+        """
+        if head[4:8] != b"ftyp":
+            return None
+        
+        offset = 0
+        while offset + 8 <= len(head):
+            size = int.from_bytes(head[offset:offset + 4], "big")
+            box = head[offset + 4:offset + 8]
+            if box == b"moov":
+                return None
+            if size == 1 and offset + 16 <= len(head):
+                size = int.from_bytes(head[offset + 8:offset + 16], "big")
+            if size < 8:
+                return None
+            if box == b"mdat":
+                return offset + size
+            offset += size
+        return None
+    
+    @staticmethod
+    def _video_filter(resolution: str, watermark_text: str = None, watermark_image: str = None) -> str:
+        """Build the -vf chain for scaling and watermarking"""
+        scale = FFmpegHelper.RESOLUTION_MAP.get(resolution, "1280:720")
+        video_filter = f"scale={scale}"
+        
+        # Add watermark if specified
+        if watermark_text:
+            video_filter += f",drawtext=text='{watermark_text}':fontsize=24:fontcolor=white:x=10:y=10"
+        
+        if watermark_image and os.path.exists(watermark_image):
+            video_filter += f",movie={watermark_image}[watermark];[in][watermark]overlay=10:10[out]"
+        
+        return video_filter
+    
+    @staticmethod
+    async def _run(
+        cmd: list,
+        progress_callback: Optional[Callable] = None,
+        duration: Optional[float] = None,
+        interval: Optional[float] = None,
+        stdin: Optional[AsyncIterator[bytes]] = None
+    ) -> bool:
+        """Run an FFmpeg command, reporting progress from its -progress stream
+        
+        Chunks from `stdin` are written to the process while it runs.
+        """
+        stdin_pipe = asyncio.subprocess.PIPE if stdin is not None else None
+        
+        if not progress_callback:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=stdin_pipe,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        else:
+            if not duration and stdin is None:
+                duration = await FFmpegHelper.get_duration(cmd[cmd.index("-i") + 1])
+            
+            process = await asyncio.create_subprocess_exec(
+                cmd[0], *FFmpegProgress.ARGS, *cmd[1:],
+                stdin=stdin_pipe,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        feeder = asyncio.create_task(FFmpegHelper._feed(process, stdin)) if stdin is not None else None
         
-        await process.wait()
+        try:
+            if progress_callback:
+                await FFmpegProgress(duration, progress_callback, interval).read(process.stdout)
+            await process.wait()
+            if feeder and not await feeder:
+                return False
+        except BaseException:
+            # A cancelled job or a failing callback must not leave FFmpeg
+            # writing into a workspace that is about to be removed
+            if feeder:
+                feeder.cancel()
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            raise
         return process.returncode == 0
     
+    @staticmethod
+    async def _feed(process, chunks: AsyncIterator[bytes]) -> bool:
+        """Write chunks to a process' stdin, False if the source failed"""
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # FFmpeg stopped reading, its return code tells why
+            pass
+        except Exception:
+            # Don't let FFmpeg finish a file from a truncated source
+            process.kill()
+            return False
+        return True
+    
     @staticmethod
     async def get_duration(file_path: str) -> Optional[float]:
         """Get video duration in seconds"""
@@ -152,10 +676,19 @@ class FFmpegHelper:
             audio_stream = next((s for s in info.get('streams', []) if s['codec_type'] == 'audio'), None)
             format_info = info.get('format', {})
             
+            bitrate = int(format_info.get('bit_rate', 0))
+            audio_bitrate = int(audio_stream.get('bit_rate', 0)) if audio_stream else 0
+            video_bitrate = int(video_stream.get('bit_rate', 0)) if video_stream else 0
+            if video_stream and not video_bitrate and bitrate:
+                # Containers like MKV only report the overall bitrate
+                video_bitrate = max(bitrate - audio_bitrate, 0)
+            
             return {
                 'duration': float(format_info.get('duration', 0)),
                 'size': int(format_info.get('size', 0)),
-                'bitrate': int(format_info.get('bit_rate', 0)),
+                'bitrate': bitrate,
+                'video_bitrate': video_bitrate,
+                'audio_bitrate': audio_bitrate,
                 'width': int(video_stream.get('width', 0)) if video_stream else 0,
                 'height': int(video_stream.get('height', 0)) if video_stream else 0,
                 'video_codec': video_stream.get('codec_name', 'unknown') if video_stream else 'none',
@@ -166,7 +699,7 @@ class FFmpegHelper:
             return {}
     
     @staticmethod
-    async def extract_thumbnail(video_path: str, output_path: str, time: str = "00:00:01") -> bool:
+    async def extract_thumbnail(video_path: str, output_path: str, time: str = "00:00:01", progress_callback: Optional[Callable] = None) -> bool:
         """Extract thumbnail from video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -175,17 +708,10 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def extract_audio(video_path: str, output_path: str) -> bool:
+    async def extract_audio(video_path: str, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Extract audio from video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -193,17 +719,22 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        return await FFmpegHelper._run(cmd, progress_callback)
+    
+    @staticmethod
+    async def encode_audio(video_path: str, output_path: str, audio_bitrate: str = Config.DEFAULT_AUDIO_BITRATE, progress_callback: Optional[Callable] = None) -> bool:
+        """Encode every audio track to AAC without the video"""
+        cmd = [
+            "ffmpeg", "-i", video_path,
+            "-vn", "-map", "0:a",
+            "-c:a", "aac", "-b:a", audio_bitrate,
+            "-y", output_path
+        ]
         
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def extract_subtitles(video_path: str, output_path: str) -> bool:
+    async def extract_subtitles(video_path: str, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Extract subtitles from video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -211,26 +742,12 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def add_subtitle(video_path: str, subtitle_path: str, output_path: str, hard: bool = False) -> bool:
+    async def add_subtitle(video_path: str, subtitle_path: str, output_path: str, hard: bool = False, progress_callback: Optional[Callable] = None) -> bool:
         """Add subtitle to video (soft or hard)"""
-        if hard:
-            cmd = [
-                "ffmpeg", "-i", video_path,
-                "-vf", f"subtitles={subtitle_path}",
-                "-c:a", "copy",
-                "-y", output_path
-            ]
-        else:
+        if not hard:
             cmd = [
                 "ffmpeg", "-i", video_path,
                 "-i", subtitle_path,
@@ -238,18 +755,22 @@ class FFmpegHelper:
                 "-c:s", "mov_text",
                 "-y", output_path
             ]
+            return await FFmpegHelper._run(cmd, progress_callback)
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        # Burning subtitles re-encodes the video
+        async with CPUBudget.reserve() as threads:
+            cmd = [
+                "ffmpeg", "-i", video_path,
+                "-vf", f"subtitles={subtitle_path}",
+                "-c:a", "copy",
+                "-threads", str(threads),
+                "-y", output_path
+            ]
+            
+            return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def remove_subtitle(video_path: str, output_path: str) -> bool:
+    async def remove_subtitle(video_path: str, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Remove all subtitles from video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -257,17 +778,10 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def add_audio(video_path: str, audio_path: str, output_path: str) -> bool:
+    async def add_audio(video_path: str, audio_path: str, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Add audio to video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -279,17 +793,10 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def remove_audio(video_path: str, output_path: str) -> bool:
+    async def remove_audio(video_path: str, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Remove audio from video"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -297,17 +804,10 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def trim_video(video_path: str, output_path: str, start_time: str, end_time: str) -> bool:
+    async def trim_video(video_path: str, output_path: str, start_time: str, end_time: str, progress_callback: Optional[Callable] = None) -> bool:
         """Trim video by time"""
         cmd = [
             "ffmpeg", "-i", video_path,
@@ -317,17 +817,11 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        duration = FFmpegProgress.parse_time(end_time) - FFmpegProgress.parse_time(start_time)
+        return await FFmpegHelper._run(cmd, progress_callback, duration if duration > 0 else None)
     
     @staticmethod
-    async def crop_video(video_path: str, output_path: str, aspect_ratio: str) -> bool:
+    async def crop_video(video_path: str, output_path: str, aspect_ratio: str, progress_callback: Optional[Callable] = None) -> bool:
         """Crop video to aspect ratio"""
         aspect_map = {
             "16:9": "crop=ih*16/9:ih",
@@ -338,27 +832,22 @@ class FFmpegHelper:
         
         crop_filter = aspect_map.get(aspect_ratio, "crop=ih*16/9:ih")
         
-        cmd = [
-            "ffmpeg", "-i", video_path,
-            "-vf", crop_filter,
-            "-c:a", "copy",
-            "-y", output_path
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        
-        await process.wait()
-        return process.returncode == 0
+        async with CPUBudget.reserve() as threads:
+            cmd = [
+                "ffmpeg", "-i", video_path,
+                "-vf", crop_filter,
+                "-c:a", "copy",
+                "-threads", str(threads),
+                "-y", output_path
+            ]
+            
+            return await FFmpegHelper._run(cmd, progress_callback)
     
     @staticmethod
-    async def merge_videos(video_files: list, output_path: str) -> bool:
+    async def merge_videos(video_files: list, output_path: str, progress_callback: Optional[Callable] = None) -> bool:
         """Merge multiple videos"""
-        # Create concat file
-        concat_file = "concat_list.txt"
+        # Create concat file next to the output, jobs run side by side
+        concat_file = f"{output_path}.concat.txt"
         with open(concat_file, 'w') as f:
             for video in video_files:
                 f.write(f"file '{video}'\n")
@@ -371,37 +860,101 @@ class FFmpegHelper:
             "-y", output_path
         ]
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        # The concat list can't be probed, the output is as long as all inputs
+        duration = None
+        if progress_callback:
+            duration = sum([await FFmpegHelper.get_duration(video) or 0 for video in video_files])
         
-        await process.wait()
+        success = await FFmpegHelper._run(cmd, progress_callback, duration)
         
         # Clean up
         if os.path.exists(concat_file):
             os.remove(concat_file)
         
-        return process.returncode == 0
+        return success
     
     @staticmethod
-    async def compress_video(video_path: str, output_path: str, crf: int = 35) -> bool:
+    async def compress_video(video_path: str, output_path: str, crf: int = 35, progress_callback: Optional[Callable] = None) -> bool:
         """Compress video with higher CRF"""
-        cmd = [
-            "ffmpeg", "-i", video_path,
-            "-c:v", "libx264",
-            "-crf", str(crf),
-            "-c:a", "aac",
-            "-b:a", "96k",
-            "-y", output_path
-        ]
+        async with CPUBudget.reserve() as threads:
+            cmd = [
+                "ffmpeg", "-i", video_path,
+                "-c:v", "libx264",
+                "-crf", str(crf),
+                "-c:a", "aac",
+                "-b:a", "96k",
+                "-threads", str(threads),
+                "-y", output_path
+            ]
+            
+            return await FFmpegHelper._run(cmd, progress_callback)
+    
+    @staticmethod
+    def target_video_bitrate(target_size: int, duration: float, audio_bitrate: str = "96k") -> int:
+        """Video bitrate (kbps) that makes a file of `duration` seconds fit in `target_size` bytes"""
+        if not duration:
+            return 0
+        
+        audio_kbps = int(audio_bitrate.lower().rstrip("k"))
+        # Leave ~3% for container overhead
+        total_kbps = target_size * 8 * 0.97 / duration / 1000
+        return int(total_kbps - audio_kbps)
+    
+    @staticmethod
+    async def compress_to_size(video_path: str, output_path: str, target_size: int, audio_bitrate: str = "96k", progress_callback: Optional[Callable] = None) -> bool:
+        """Compress video to fit a target size with a two-pass encode"""
+        info = await FFmpegHelper.get_video_info(video_path)
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        # Already under budget, don't spend an encode on it
+        if os.path.getsize(video_path) <= target_size:
+            return await FFmpegHelper.stream_copy(video_path, output_path, info, audio_bitrate, progress_callback)
         
-        await process.wait()
-        return process.returncode == 0
+        video_kbps = FFmpegHelper.target_video_bitrate(target_size, info.get('duration'), audio_bitrate)
+        if video_kbps < FFmpegHelper.MIN_VIDEO_BITRATE:
+            return False
+        
+        passlog = f"{output_path}.passlog"
+        
+        def pass_progress(index):
+            """Map a pass's own progress onto its half of the bar"""
+            if not progress_callback:
+                return None
+            
+            async def callback(percentage, **stats):
+                await progress_callback(percentage=(index * 100 + percentage) / 2, **stats)
+            return callback
+        
+        try:
+            async with CPUBudget.reserve() as threads:
+                first_pass = [
+                    "ffmpeg", "-i", video_path,
+                    "-c:v", "libx264",
+                    "-b:v", f"{video_kbps}k",
+                    "-pass", "1",
+                    "-passlogfile", passlog,
+                    "-an",
+                    "-threads", str(threads),
+                    "-f", "null",
+                    "-y", os.devnull
+                ]
+                
+                if not await FFmpegHelper._run(first_pass, pass_progress(0), info.get('duration')):
+                    return False
+                
+                second_pass = [
+                    "ffmpeg", "-i", video_path,
+                    "-c:v", "libx264",
+                    "-b:v", f"{video_kbps}k",
+                    "-pass", "2",
+                    "-passlogfile", passlog,
+                    "-c:a", "aac",
+                    "-b:a", audio_bitrate,
+                    "-threads", str(threads),
+                    "-y", output_path
+                ]
+                
+                return await FFmpegHelper._run(second_pass, pass_progress(1), info.get('duration'))
+        finally:
+            # Clean up pass log files
+            for log_file in glob.glob(f"{passlog}*"):
+                os.remove(log_file)
@@ -0,0 +1,84 @@
+# utils/ffmpeg_progress.py
+import time
+from typing import Optional, Callable
+from utils.config import Config
+
+class FFmpegProgress:
+    """Parse the key=value stream FFmpeg writes with `-progress pipe:1`
+
+    FFmpeg prints one block of stats per update, closed by a `progress=continue`
+    or `progress=end` line. Each block is forwarded to the progress callback,
+    at most once every `interval` seconds plus once when the process ends.
+    """
+
+    # Inserted right after the ffmpeg binary in the command line
+    ARGS = ["-progress", "pipe:1", "-nostats"]
+
+    def __init__(self, duration: Optional[float], progress_callback: Callable, interval: Optional[float] = None):
+        self.duration = duration
+        self.progress_callback = progress_callback
+        self.interval = Config.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self.start_time = time.time()
+        self.last_update = 0
+        self.block = {}
+
+    @staticmethod
+    def parse_time(value: str) -> float:
+        """Parse HH:MM:SS(.ms) or plain seconds to seconds"""
+        try:
+            seconds = 0.0
+            for part in str(value).split(":"):
+                seconds = seconds * 60 + float(part)
+            return seconds
+        except ValueError:
+            return 0.0
+
+    @staticmethod
+    def _number(value: Optional[str]) -> float:
+        """FFmpeg reports N/A until a value is known"""
+        try:
+            return float(value.rstrip("x").replace("kbits/s", ""))
+        except (AttributeError, ValueError):
+            return 0.0
+
+    async def read(self, stream):
+        """Consume the progress stream until FFmpeg closes it"""
+        async for line in stream:
+            key, _, value = line.decode('utf-8', errors='ignore').strip().partition("=")
+            if key != "progress":
+                self.block[key] = value
+                continue
+
+            final = value == "end"
+            now = time.time()
+            if final or now - self.last_update >= self.interval:
+                self.last_update = now
+                await self._report()
+            self.block = {}
+
+    async def _report(self):
+        """Forward the current block to the callback"""
+        if not self.duration:
+            return
+
+        current = self._number(self.block.get("out_time_us")) / 1_000_000
+        if not current:
+            current = self.parse_time(self.block.get("out_time", 0))
+        current = min(max(current, 0), self.duration)
+
+        # FFmpeg's own speed is the encode rate as a multiple of realtime
+        speed = self._number(self.block.get("speed"))
+        if not speed:
+            elapsed = time.time() - self.start_time
+            speed = current / elapsed if elapsed > 0 else 0
+
+        await self.progress_callback(
+            percentage=current / self.duration * 100,
+            speed=speed,
+            eta=(self.duration - current) / speed if speed > 0 else 0,
+            current=current,
+            total=self.duration,
+            fps=self._number(self.block.get("fps")),
+            size=int(self._number(self.block.get("total_size"))),
+            bitrate=self._number(self.block.get("bitrate"))
+        )
@@ -121,6 +121,18 @@ def parse_time(time_str: str) -> int:
         return 0
 
 
+def parse_size(size_str: str) -> int:
+    """Parse size string like 50MB, 1.5G or 700 (MB) to bytes"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    try:
+        size_str = size_str.strip().upper().rstrip("B")
+        if size_str and size_str[-1] in units:
+            return int(float(size_str[:-1]) * units[size_str[-1]])
+        return int(float(size_str) * units["M"])
+    except:
+        return 0
+
+
 def format_seconds_to_hhmmss(seconds: int) -> str:
     """Format seconds to HH:MM:SS"""
     hours = seconds // 3600
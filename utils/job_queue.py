@@ -0,0 +1,182 @@
+# utils/job_queue.py
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+from pyrogram.types import Message
+from utils.config import Config
+from utils.database import Database
+from utils.disk_budget import DiskBudget
+from utils.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Run long tasks from the persistent `queue` table
+
+    Handlers validate a command and submit it as a job. Workers claim pending
+    jobs in order, re-fetch the user's message and the job's status message
+    and pass them to the runner registered for the task type. Jobs that were
+    still running when the bot went down are queued again on the next start.
+    """
+
+    runners: Dict[str, Callable] = {}
+    _workers = []
+    _wakeup = None
+    _claim_lock = None
+
+    @staticmethod
+    def runner(task_type: str):
+        """Register the coroutine that runs a task type
+
+        Runners are called as runner(client, message, status_msg, job) and
+        can return False to mark the job as failed. Temporary files belong in
+        job['workspace'].
+        """
+        def decorator(func):
+            JobQueue.runners[task_type] = func
+            return func
+        return decorator
+
+    @staticmethod
+    async def submit(
+        message: Message,
+        task_type: str,
+        file_id: str = "",
+        payload: Dict = None,
+        user_id: int = None,
+        delay: int = 0,
+        download_size: int = 0,
+        output_size: int = 0,
+        status_msg: Message = None
+    ) -> Optional[int]:
+        """Queue a task, replying to `message` with its status
+
+        A `delay` keeps the task from running for that many seconds. The task
+        only starts once `download_size` and `output_size` fit on disk. An
+        existing `status_msg` is reused instead of replying, and left for the
+        caller to edit.
+        """
+        user_id = user_id or message.from_user.id
+
+        if await Database.get_user_queue_size(user_id) >= Config.MAX_QUEUE_SIZE:
+            await message.reply_text(
+                f"**⚠️ Queue is full!**\n\n"
+                f"You already have {Config.MAX_QUEUE_SIZE} tasks waiting. Please try again later."
+            )
+            return None
+
+        if not status_msg:
+            position = await Database.get_queue_size() + 1
+            status_msg = await message.reply_text(
+                f"**⏳ Added to queue!**\n\n"
+                f"**Position:** `{position}`"
+            )
+
+        job_id = await Database.add_to_queue(
+            user_id, file_id or "", task_type,
+            chat_id=message.chat.id,
+            message_id=message.id,
+            status_message_id=status_msg.id,
+            payload=payload,
+            delay=delay,
+            download_size=download_size,
+            output_size=output_size
+        )
+
+        if JobQueue._wakeup:
+            JobQueue._wakeup.set()
+        return job_id
+
+    @staticmethod
+    async def start(client):
+        """Recover interrupted jobs and start the workers"""
+        recovered = await Database.requeue_interrupted_jobs(Config.QUEUE_MAX_ATTEMPTS)
+        purged = await Database.purge_finished_jobs()
+        logger.info(
+            f"Job queue: {recovered['requeued']} interrupted jobs requeued, "
+            f"{recovered['failed']} given up, {purged} old jobs purged"
+        )
+
+        JobQueue._wakeup = asyncio.Event()
+        JobQueue._claim_lock = asyncio.Lock()
+        JobQueue._workers = [
+            asyncio.create_task(JobQueue._worker(client))
+            for _ in range(max(1, Config.QUEUE_WORKERS))
+        ]
+
+    @staticmethod
+    async def stop():
+        """Stop the workers, running jobs are resumed on the next start"""
+        for worker in JobQueue._workers:
+            worker.cancel()
+        await asyncio.gather(*JobQueue._workers, return_exceptions=True)
+        JobQueue._workers = []
+
+    @staticmethod
+    async def _worker(client):
+        """Claim and run jobs until cancelled"""
+        while True:
+            JobQueue._wakeup.clear()
+            async with JobQueue._claim_lock:
+                job = await Database.claim_next_job()
+
+            if not job:
+                # Poll as well, in case a wakeup went to another worker
+                try:
+                    await asyncio.wait_for(JobQueue._wakeup.wait(), timeout=10)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await JobQueue._run(client, job)
+
+    @staticmethod
+    async def _run(client, job: Dict):
+        """Run a single job and record the outcome"""
+        runner = JobQueue.runners.get(job['task_type'])
+        if not runner:
+            await Database.finish_job(job['id'], "failed", f"Unknown task type: {job['task_type']}")
+            return
+
+        try:
+            message = await client.get_messages(job['chat_id'], job['message_id'])
+            if not message or message.empty:
+                await Database.finish_job(job['id'], "failed", "Message was deleted")
+                return
+
+            status_msg = await client.get_messages(job['chat_id'], job['status_message_id'])
+            if not status_msg or status_msg.empty:
+                status_msg = await message.reply_text("**⏳ Initializing...**")
+            elif job['attempts'] > 1:
+                await status_msg.edit_text("**🔄 Resuming after restart...**")
+
+            reservation = DiskBudget.try_reserve(job['download_size'], job['output_size'])
+            if reservation is None:
+                await Database.defer_job(job['id'], Config.DISK_RETRY_DELAY)
+                try:
+                    await status_msg.edit_text(
+                        "**💾 Waiting for disk space...**\n\n"
+                        "The task starts once running tasks have finished."
+                    )
+                except Exception:
+                    pass
+                return
+
+            try:
+                # Whatever the runner leaves in its workspace is removed with it
+                with Workspace(job['task_type']) as workspace:
+                    job['workspace'] = workspace
+                    result = await runner(client, message, status_msg, job)
+            finally:
+                DiskBudget.release(reservation)
+            await Database.finish_job(job['id'], "failed" if result is False else "done")
+        except asyncio.CancelledError:
+            # Left as running so it is picked up again after a restart
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job['id']} ({job['task_type']}) failed")
+            await Database.finish_job(job['id'], "failed", str(e))
+            try:
+                await client.edit_message_text(job['chat_id'], job['status_message_id'], f"**❌ Error:** {str(e)}")
+            except Exception:
+                pass
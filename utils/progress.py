@@ -3,6 +3,7 @@ import time
 import math
 import psutil
 from utils.helpers import format_size, format_time
+from utils.config import Config
 
 class ProgressTracker:
     """Professional progress tracking with animated loading bars"""
@@ -82,7 +83,7 @@ class ProgressTracker:
             cpu_percent = psutil.cpu_percent(interval=0.1)
             ram_percent = psutil.virtual_memory().percent
             uptime = time.time() - psutil.boot_time()
-            disk = psutil.disk_usage('/')
+            disk = psutil.disk_usage(Config.DOWNLOAD_DIR)
             
             uptime_hours = int(uptime // 3600)
             uptime_mins = int((uptime % 3600) // 60)
@@ -207,7 +208,7 @@ Page: 1/1 | Active Tasks: 1"""
             pass
     
     @staticmethod
-    async def encoding_progress(percentage, speed, eta, current, total, message, file_name, quality, user_name, user_id, start_time):
+    async def encoding_progress(percentage, speed, eta, current, total, message, file_name, quality, user_name, user_id, start_time, fps=0):
         """Professional encoding progress display with animation"""
         try:
             elapsed = time.time() - start_time
@@ -229,7 +230,7 @@ Page: 1/1 | Active Tasks: 1"""
 
 {progress_bar} >> {percentage:.1f}%
 {percent_bar}
-├ Speed: {speed:.2f}x
+├ Speed: {speed:.2f}x{f" ({fps:.0f} fps)" if fps else ""}
 ├ Time: {format_time(int(current))} / {format_time(int(total))}
 ├ ETA: {format_time(int(eta))}
 ├ Elapsed: {format_time(int(elapsed))}
@@ -0,0 +1,82 @@
+# utils/rendition_cache.py
+import hashlib
+from typing import Optional, Dict
+from utils.config import Config
+from utils.database import Database
+
+class RenditionCache:
+    """Reuse Telegram file_ids of renditions that were already encoded and uploaded"""
+
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def watermark_fingerprint(watermark: Dict) -> str:
+        """Fingerprint of the watermark applied to an encode"""
+        if not watermark.get('text') and not watermark.get('image'):
+            return "none"
+        raw = f"{watermark.get('text') or ''}|{watermark.get('image') or ''}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    @staticmethod
+    def make_key(file_unique_id: str, quality: str, settings: Dict, watermark: Dict, media_type: str) -> Optional[str]:
+        """Build the cache key for a source file and the effective encode parameters"""
+        if not Config.RENDITION_CACHE or not file_unique_id:
+            return None
+
+        parts = [
+            file_unique_id,
+            quality,
+            settings['codec'],
+            settings['preset'],
+            str(settings['crf']),
+            settings['audio_bitrate'],
+            RenditionCache.watermark_fingerprint(watermark),
+            media_type
+        ]
+        if settings.get('adaptive_crf'):
+            parts.append("adaptive")
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    @staticmethod
+    async def get(cache_key: Optional[str]) -> Optional[Dict]:
+        """Look up a cached rendition"""
+        if not cache_key:
+            return None
+
+        cached = await Database.get_cached_rendition(cache_key)
+        if cached:
+            RenditionCache.hits += 1
+        else:
+            RenditionCache.misses += 1
+        return cached
+
+    @staticmethod
+    async def put(cache_key: Optional[str], file_id: str, media_type: str, file_size: int = 0):
+        """Store an uploaded rendition and apply the eviction policy"""
+        if not cache_key:
+            return
+
+        await Database.add_cached_rendition(cache_key, file_id, media_type, file_size)
+        await Database.evict_cached_renditions(
+            Config.RENDITION_CACHE_MAX_AGE_DAYS,
+            Config.RENDITION_CACHE_MAX_ENTRIES
+        )
+
+    @staticmethod
+    async def invalidate(cache_key: Optional[str]):
+        """Remove a rendition whose file_id can no longer be sent"""
+        if cache_key:
+            await Database.delete_cached_rendition(cache_key)
+
+    @staticmethod
+    async def get_stats() -> Dict:
+        """Get hit/miss counters since start plus the persisted totals"""
+        stats = await Database.get_rendition_cache_stats()
+        lookups = RenditionCache.hits + RenditionCache.misses
+        stats.update({
+            "session_hits": RenditionCache.hits,
+            "session_misses": RenditionCache.misses,
+            "hit_rate": (RenditionCache.hits / lookups * 100) if lookups else 0
+        })
+        return stats
@@ -0,0 +1,306 @@
+# utils/source_cache.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Callable, AsyncIterator
+from utils.config import Config
+from utils.downloader import ParallelDownloader
+
+logger = logging.getLogger(__name__)
+
+class SourceCache:
+    """Keep downloaded source files on disk, keyed by Telegram's file_unique_id
+
+    Handlers acquire a local path for a file and release it when they are
+    done with it. Released files stay cached so the next operation on the
+    same file starts without a download. Once the cache grows past its disk
+    budget the least recently used files that are not in use are evicted.
+    """
+
+    hits = 0
+    misses = 0
+    _refs: Dict[str, int] = {}
+    _locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def cache_dir() -> str:
+        """Directory holding the cached sources"""
+        return os.path.join(Config.DOWNLOAD_DIR, "cache")
+
+    @staticmethod
+    def path_for(file_unique_id: str, file_name: str = "") -> str:
+        """Local path of a cached source"""
+        extension = os.path.splitext(file_name or "")[1].lower() or ".mp4"
+        return os.path.join(SourceCache.cache_dir(), f"{file_unique_id}{extension}")
+
+    @staticmethod
+    def contains(file_unique_id: str, file_name: str = "") -> bool:
+        """Check if a file is cached already"""
+        return bool(file_unique_id) and os.path.exists(SourceCache.path_for(file_unique_id, file_name))
+
+    @staticmethod
+    async def acquire(
+        client,
+        file_id: str,
+        file_unique_id: str = None,
+        file_size: int = 0,
+        file_name: str = "",
+        progress: Optional[Callable] = None,
+        progress_args: tuple = ()
+    ) -> str:
+        """Get a local copy of a file, downloading it on a cache miss
+
+        Every acquire must be paired with a release once the file is no
+        longer read. Concurrent acquires of the same file share one download.
+        """
+        key = file_unique_id or hashlib.sha1(file_id.encode()).hexdigest()
+        path = SourceCache.path_for(key, file_name)
+        SourceCache._refs[path] = SourceCache._refs.get(path, 0) + 1
+
+        try:
+            async with SourceCache._locks.setdefault(path, asyncio.Lock()):
+                if os.path.exists(path):
+                    SourceCache.hits += 1
+                    os.utime(path)
+                    return path
+
+                SourceCache.misses += 1
+                os.makedirs(SourceCache.cache_dir(), exist_ok=True)
+                SourceCache.evict(file_size or 0)
+
+                # Failed attempts resume from the chunks already on disk
+                for attempt in range(1, Config.DOWNLOAD_RETRIES + 1):
+                    try:
+                        await ParallelDownloader.download(
+                            client, file_id, path, file_size or 0,
+                            progress=progress,
+                            progress_args=progress_args
+                        )
+                        break
+                    except Exception as e:
+                        if attempt == Config.DOWNLOAD_RETRIES:
+                            raise
+                        logger.warning(f"Download of {path} failed ({e}), resuming (attempt {attempt + 1})")
+                        await asyncio.sleep(attempt * 5)
+                if not os.path.exists(path):
+                    raise Exception("Download failed")
+
+                SourceCache.evict()
+                return path
+        except BaseException:
+            SourceCache.release(path)
+            raise
+
+    @staticmethod
+    @asynccontextmanager
+    async def stream(
+        client,
+        file_id: str,
+        file_unique_id: str = None,
+        file_size: int = 0,
+        file_name: str = "",
+        check: Optional[Callable[[bytes], bool]] = None
+    ):
+        """Read a file that isn't cached yet as it downloads, caching it on the way
+
+        Yields an async iterator over the file's chunks, or None when the file
+        is cached already or `check` rejects its first chunk, in which case the
+        caller should acquire() it instead. The file only enters the cache
+        once every chunk was read. Other operations on the file wait for the
+        download only, not for the caller to finish with the chunks.
+        """
+        key = file_unique_id or hashlib.sha1(file_id.encode()).hexdigest()
+        path = SourceCache.path_for(key, file_name)
+        SourceCache._refs[path] = SourceCache._refs.get(path, 0) + 1
+        lock = SourceCache._locks.setdefault(path, asyncio.Lock())
+        locked = False
+
+        def unlock():
+            nonlocal locked
+            if locked:
+                locked = False
+                lock.release()
+
+        try:
+            await lock.acquire()
+            locked = True
+
+            # Resuming an interrupted download beats streaming from zero
+            if os.path.exists(path) or ParallelDownloader.has_partial(path):
+                unlock()
+                yield None
+                return
+
+            chunks = client.stream_media(file_id)
+            head = await anext(chunks, b"")
+            if check and not check(head):
+                await chunks.aclose()
+                unlock()
+                yield None
+                return
+
+            SourceCache.misses += 1
+            os.makedirs(SourceCache.cache_dir(), exist_ok=True)
+            SourceCache.evict(file_size or 0)
+
+            tee = SourceCache._tee(head, chunks, path, on_complete=unlock)
+            try:
+                yield tee
+            finally:
+                await tee.aclose()
+                await chunks.aclose()
+            SourceCache.evict()
+        finally:
+            unlock()
+            SourceCache.release(path)
+
+    @staticmethod
+    async def _tee(head: bytes, chunks: AsyncIterator[bytes], path: str, on_complete: Optional[Callable] = None):
+        """Yield the chunks of a download while writing them to the cache
+
+        `on_complete` runs once the file is in the cache or the download was
+        abandoned, before the caller gets control back.
+        """
+        temp_path = f"{path}.temp"
+        complete = False
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(head)
+                yield head
+                async for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                os.replace(temp_path, path)
+            elif os.path.exists(temp_path):
+                os.remove(temp_path)
+            if on_complete:
+                on_complete()
+
+    @staticmethod
+    def release(path: Optional[str]):
+        """Mark a file acquired earlier as no longer in use"""
+        if not path or path not in SourceCache._refs:
+            return
+
+        SourceCache._refs[path] -= 1
+        if SourceCache._refs[path] <= 0:
+            del SourceCache._refs[path]
+            lock = SourceCache._locks.get(path)
+            if lock and not lock.locked():
+                del SourceCache._locks[path]
+
+    @staticmethod
+    def _entries() -> list:
+        """Cached files as (last used, size, path), oldest first"""
+        entries = []
+        try:
+            names = os.listdir(SourceCache.cache_dir())
+        except FileNotFoundError:
+            return entries
+
+        for name in names:
+            path = os.path.join(SourceCache.cache_dir(), name)
+            # Skip partial downloads and their resume records
+            if name.endswith((".temp", ".parts", ".parts.new")) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    @staticmethod
+    def evict(needed: int = 0) -> int:
+        """Remove least recently used files until `needed` more bytes fit the budget"""
+        budget = Config.SOURCE_CACHE_MAX_SIZE_MB * 1024 * 1024
+        entries = SourceCache._entries()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+
+        for _, size, path in entries:
+            if total + needed <= budget:
+                break
+            if SourceCache._refs.get(path):
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                freed += size
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+
+        if total + needed > budget:
+            logger.warning("Source cache is over budget, every cached file is in use")
+        return freed
+
+    @staticmethod
+    def trim(size: int) -> int:
+        """Remove least recently used files that are not in use until `size` bytes are freed"""
+        freed = 0
+        for _, file_size, path in SourceCache._entries():
+            if freed >= size:
+                break
+            if SourceCache._refs.get(path):
+                continue
+            try:
+                os.remove(path)
+                freed += file_size
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+        return freed
+
+    @staticmethod
+    def sweep_partials(max_age: int) -> int:
+        """Remove interrupted downloads that weren't resumed for `max_age` seconds"""
+        removed = 0
+        cutoff = time.time() - max_age
+        try:
+            names = os.listdir(SourceCache.cache_dir())
+        except FileNotFoundError:
+            return removed
+
+        for name in names:
+            if not name.endswith((".temp", ".parts", ".parts.new")):
+                continue
+            path = os.path.join(SourceCache.cache_dir(), name)
+            source = path.split(".temp")[0]
+            try:
+                if SourceCache._refs.get(source) or os.path.getmtime(path) > cutoff:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    @staticmethod
+    def clear() -> int:
+        """Remove every cached file that is not in use"""
+        removed = 0
+        for _, _, path in SourceCache._entries():
+            if SourceCache._refs.get(path):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    @staticmethod
+    def get_stats() -> Dict:
+        """Get disk usage and hit/miss counters since start"""
+        entries = SourceCache._entries()
+        lookups = SourceCache.hits + SourceCache.misses
+        return {
+            "files": len(entries),
+            "size": sum(size for _, size, _ in entries),
+            "in_use": len(SourceCache._refs),
+            "hits": SourceCache.hits,
+            "misses": SourceCache.misses,
+            "hit_rate": (SourceCache.hits / lookups * 100) if lookups else 0
+        }
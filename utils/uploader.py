@@ -0,0 +1,223 @@
+# utils/uploader.py
+import os
+import math
+import asyncio
+import hashlib
+import inspect
+import logging
+from typing import Optional, Callable
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from utils.config import Config
+from utils.downloader import ParallelDownloader
+
+logger = logging.getLogger(__name__)
+
+class Uploader:
+    """Upload files to Telegram part by part, retrying parts that fail
+
+    Pyrogram logs a failed part and carries on, so one network error leaves
+    a hole that is only noticed when the media is sent. Here every part is
+    retried with backoff inside the same upload session (same file id), so
+    the parts that already arrived are never sent again.
+
+    Parts come from a local file or straight from the download of another
+    Telegram file (see RelayStream).
+    """
+
+    PART_SIZE = 512 * 1024
+    # Files above this size are uploaded as "big" files, without an MD5
+    BIG_FILE_SIZE = 10 * 1024 * 1024
+
+    @staticmethod
+    async def save_file(
+        client,
+        path: str,
+        file_id: int = None,
+        file_part: int = 0,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = ()
+    ):
+        """Upload a file and return its InputFile, like Client.save_file
+
+        With `file_id` only `file_part` is sent again, which is how Pyrogram
+        answers a FILE_PART_MISSING error when the media is sent.
+        """
+        file_size = os.path.getsize(path)
+        if file_size == 0:
+            raise ValueError("File size equals to 0 B")
+
+        async def read_parts(parts):
+            with open(path, "rb") as f:
+                for part in parts:
+                    f.seek(part * Uploader.PART_SIZE)
+                    yield part, f.read(Uploader.PART_SIZE)
+
+        return await Uploader._upload(
+            client, read_parts, file_size, os.path.basename(path),
+            file_id, file_part, progress, progress_args
+        )
+
+    @staticmethod
+    async def save_stream(
+        client,
+        stream: "RelayStream",
+        file_id: int = None,
+        file_part: int = 0,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = ()
+    ):
+        """Upload a Telegram file again while it downloads, like Client.save_file
+
+        Downloaded chunks are cut into parts and uploaded right away, at
+        most UPLOAD_BUFFER_PARTS of them wait in memory. A missing part is
+        downloaded again on its own.
+        """
+        async def read_parts(parts):
+            if file_id is not None:
+                yield file_part, await stream.read_part(file_part)
+                return
+
+            part = 0
+            async for chunk in client.stream_media(stream.file_id):
+                for start in range(0, len(chunk), Uploader.PART_SIZE):
+                    yield part, chunk[start:start + Uploader.PART_SIZE]
+                    part += 1
+
+        return await Uploader._upload(
+            client, read_parts, stream.file_size, stream.name,
+            file_id, file_part, progress, progress_args
+        )
+
+    @staticmethod
+    async def _upload(client, read_parts, file_size, name, file_id, file_part, progress, progress_args):
+        """Send the parts produced by `read_parts` with a few workers at once"""
+        total_parts = math.ceil(file_size / Uploader.PART_SIZE)
+        is_big = file_size > Uploader.BIG_FILE_SIZE
+        is_missing_part = file_id is not None
+        file_id = file_id or client.rnd_id()
+        parts = [file_part] if is_missing_part else list(range(file_part, total_parts))
+        # Parts are read in order, so small files get their MD5 on the way
+        md5 = hashlib.md5() if not is_big and not is_missing_part else None
+
+        session = Session(
+            client,
+            await client.storage.dc_id(),
+            await client.storage.auth_key(),
+            await client.storage.test_mode(),
+            is_media=True
+        )
+        await session.start()
+
+        workers_count = Config.UPLOAD_PARTS if is_big else 1
+        queue = asyncio.Queue(maxsize=max(1, Config.UPLOAD_BUFFER_PARTS))
+        done = 0
+
+        async def reader():
+            """Queue the parts for the workers"""
+            sent = 0
+            async for part, chunk in read_parts(parts):
+                if part < file_part and not is_missing_part:
+                    continue
+                if md5:
+                    md5.update(chunk)
+                await queue.put((part, chunk))
+                sent += 1
+            if sent != len(parts):
+                raise Exception(f"Expected {len(parts)} parts to upload, read {sent}")
+            for _ in range(workers_count):
+                await queue.put(None)
+
+        async def worker():
+            """Send parts until none are left"""
+            nonlocal done
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                part, chunk = item
+
+                if is_big:
+                    rpc = raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=part,
+                        file_total_parts=total_parts, bytes=chunk
+                    )
+                else:
+                    rpc = raw.functions.upload.SaveFilePart(
+                        file_id=file_id, file_part=part, bytes=chunk
+                    )
+                await Uploader._send_part(session, rpc, part)
+
+                done += 1
+                if progress:
+                    current = min((file_part + done) * Uploader.PART_SIZE, file_size)
+                    result = progress(current, file_size, *progress_args)
+                    if inspect.isawaitable(result):
+                        await result
+
+        tasks = [asyncio.create_task(reader())] + [
+            asyncio.create_task(worker())
+            for _ in range(workers_count)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await session.stop()
+
+        if is_missing_part:
+            return None
+        if is_big:
+            return raw.types.InputFileBig(id=file_id, parts=total_parts, name=name)
+        return raw.types.InputFile(id=file_id, parts=total_parts, name=name, md5_checksum=md5.hexdigest())
+
+    @staticmethod
+    async def _send_part(session, rpc, part: int):
+        """Send one part, retrying with exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                if await session.invoke(rpc):
+                    return
+                error = "not saved"
+            except FloodWait as e:
+                # Waiting out a flood limit doesn't use up an attempt
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                error = e
+
+            attempt += 1
+            if attempt >= Config.UPLOAD_PART_RETRIES:
+                raise Exception(f"Upload of part {part} failed: {error}")
+            logger.warning(f"Upload of part {part} failed ({error}), retrying (attempt {attempt + 1})")
+            await asyncio.sleep(min(2 ** attempt, 60))
+
+
+class RelayStream:
+    """A Telegram file to upload again under another name, without a local copy
+
+    Pass it to reply_video/reply_document/reply_audio like an in-memory
+    file. The bot's save_file hands it to Uploader.save_stream.
+    """
+
+    def __init__(self, client, file_id: str, file_size: int, name: str):
+        self.client = client
+        self.file_id = file_id
+        self.file_size = file_size
+        self.name = name
+
+    async def read_part(self, part: int) -> bytes:
+        """Download a single upload part again"""
+        # stream_media counts in chunks that hold a whole number of parts
+        per_chunk = ParallelDownloader.CHUNK_SIZE // Uploader.PART_SIZE
+        chunk_index, index = divmod(part, per_chunk)
+        async for chunk in self.client.stream_media(self.file_id, limit=1, offset=chunk_index):
+            start = index * Uploader.PART_SIZE
+            return chunk[start:start + Uploader.PART_SIZE]
+        return b""
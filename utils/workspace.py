@@ -0,0 +1,161 @@
+# utils/workspace.py
+import os
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import Optional, Set
+from utils.config import Config
+from utils.disk_budget import DiskBudget
+from utils.source_cache import SourceCache
+
+logger = logging.getLogger(__name__)
+
+class Workspace:
+    """A private directory for the temporary files of one job
+
+    Every queued job gets a fresh directory under UPLOAD_DIR/jobs, so two
+    jobs never pick the same file name. The directory is removed with all
+    its files when the job ends, however it ends. Small files can be
+    staged in RAM, in a directory of their own that is removed as well.
+    A sweeper removes the directories that a crash left behind.
+    """
+
+    _active: Set[str] = set()
+    _sweeper = None
+
+    def __init__(self, prefix: str = "job"):
+        os.makedirs(Workspace.root(), exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix=f"{prefix}_", dir=Workspace.root())
+        self.staging_dir: Optional[str] = None
+        Workspace._active.add(self.dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    @staticmethod
+    def root() -> str:
+        """Directory holding the workspaces"""
+        return os.path.join(Config.UPLOAD_DIR, "jobs")
+
+    @staticmethod
+    def retry_root() -> str:
+        """Directory holding outputs kept for a later upload"""
+        return os.path.join(Config.UPLOAD_DIR, "retry")
+
+    def path(self, file_name: str, size: Optional[int] = None) -> str:
+        """Path for a file in the workspace, staged in RAM when a small `size` is given"""
+        if size is not None:
+            staging = DiskBudget.staging_dir(None, size)
+            if staging:
+                if not self.staging_dir:
+                    self.staging_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(self.dir)}_", dir=staging)
+                    Workspace._active.add(self.staging_dir)
+                return os.path.join(self.staging_dir, file_name)
+        return os.path.join(self.dir, file_name)
+
+    def cleanup(self):
+        """Remove the workspace and everything in it"""
+        for directory in (self.dir, self.staging_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+                Workspace._active.discard(directory)
+
+    @staticmethod
+    def keep(path: str) -> str:
+        """Move a file out of its workspace so it survives the job, returning its new path"""
+        if os.path.dirname(os.path.dirname(path)) == Workspace.retry_root():
+            return path
+
+        os.makedirs(Workspace.retry_root(), exist_ok=True)
+        directory = tempfile.mkdtemp(dir=Workspace.retry_root())
+        new_path = os.path.join(directory, os.path.basename(path))
+        # Staged files live on another filesystem, so os.replace may not do
+        shutil.move(path, new_path)
+        return new_path
+
+    @staticmethod
+    def discard(path: str):
+        """Remove a file kept earlier"""
+        directory = os.path.dirname(path)
+        if os.path.dirname(directory) == Workspace.retry_root():
+            shutil.rmtree(directory, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def sweep(max_age: int) -> int:
+        """Remove workspaces no job owns and kept files older than `max_age` seconds"""
+        removed = 0
+        cutoff = time.time() - max_age
+        roots = [Workspace.root(), Workspace.retry_root()]
+        if Config.STAGING_DIR:
+            roots.append(Config.STAGING_DIR)
+
+        for root in roots:
+            try:
+                names = os.listdir(root)
+            except FileNotFoundError:
+                continue
+
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if path in Workspace._active or os.path.getmtime(path) > cutoff:
+                        continue
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Could not sweep {path}: {e}")
+
+        return removed + SourceCache.sweep_partials(max_age)
+
+    @staticmethod
+    def start():
+        """Sweep the workspaces a crash left behind and keep sweeping periodically"""
+        max_age = Config.WORKSPACE_MAX_AGE_HOURS * 3600
+        # No job is running yet, so every workspace is an orphan. Kept files
+        # still wait for their upload retry.
+        removed = Workspace.sweep(max_age) + Workspace._sweep_workspaces()
+        logger.info(f"Workspace sweeper: {removed} orphaned files and directories removed")
+        Workspace._sweeper = asyncio.create_task(Workspace._sweep_loop(max_age))
+
+    @staticmethod
+    async def stop():
+        """Stop the periodic sweeper"""
+        if Workspace._sweeper:
+            Workspace._sweeper.cancel()
+            await asyncio.gather(Workspace._sweeper, return_exceptions=True)
+            Workspace._sweeper = None
+
+    @staticmethod
+    def _sweep_workspaces() -> int:
+        """Remove every workspace that isn't in use, whatever its age"""
+        removed = 0
+        try:
+            names = os.listdir(Workspace.root())
+        except FileNotFoundError:
+            return removed
+
+        for name in names:
+            path = os.path.join(Workspace.root(), name)
+            if path not in Workspace._active:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    @staticmethod
+    async def _sweep_loop(max_age: int):
+        """Sweep every WORKSPACE_SWEEP_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(Config.WORKSPACE_SWEEP_INTERVAL)
+            removed = Workspace.sweep(max_age)
+            if removed:
+                logger.info(f"Workspace sweeper: {removed} stale files and directories removed")